@@ -70,6 +70,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'chatbot.middleware.XFrameOptionsMiddleware',
+    'chatbot.middleware.ServerTimingMiddleware',
     "corsheaders.middleware.CorsMiddleware",
 ]
 
@@ -163,3 +164,79 @@ CORS_ALLOWS_CREDENTIALS = True
 # Media files settings
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Where generated PDFs are stored. The PDF workers save files that the web process serves, so
+# the backend must be shared between processes: the file system, or an object store such as
+# django-storages' 'storages.backends.s3.S3Storage'. InMemoryStorage is private to one process
+# and only suits tests.
+STORAGES = {
+    'default': {
+        'BACKEND': os.getenv('PDF_STORAGE_BACKEND', 'django.core.files.storage.FileSystemStorage'),
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# PDF generation job queue
+PDF_JOB_WORKERS = int(os.getenv('PDF_JOB_WORKERS', 2))
+PDF_JOB_POLL_INTERVAL = float(os.getenv('PDF_JOB_POLL_INTERVAL', 1.0))
+
+# On-disk cache of LLM responses
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(BASE_DIR, 'llm_cache.sqlite3'))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 7 * 24 * 60 * 60))
+# Whether the content and refine stages, sampled at temperature 0.7, may reuse an earlier answer;
+# off by default, so asking for the same PDF twice gives two different documents
+LLM_CACHE_GENERATED_CONTENT = os.getenv('LLM_CACHE_GENERATED_CONTENT', 'false').lower() == 'true'
+
+# Per-stage checkpoints of PDF generation runs
+PIPELINE_CHECKPOINT_DIR = os.getenv('PIPELINE_CHECKPOINT_DIR', os.path.join(BASE_DIR, 'checkpoints'))
+PIPELINE_KEEP_CHECKPOINTS = os.getenv('PIPELINE_KEEP_CHECKPOINTS', 'false').lower() == 'true'
+
+# How PDFs are edited: 'native' rewrites their content streams, 'docx' round-trips them through Word.
+# Font size changes need the text reflowed, so they go through Word with either engine.
+PDF_EDIT_ENGINE = os.getenv('PDF_EDIT_ENGINE', 'native')
+# Read common formatting instructions with local rules instead of the LLM agent
+EDIT_RULES_ENABLED = os.getenv('EDIT_RULES_ENABLED', 'true').lower() == 'true'
+# Processes and pages per chunk used by the 'docx' engine to convert PDFs to Word
+PDF2DOCX_WORKERS = int(os.getenv('PDF2DOCX_WORKERS', os.cpu_count() or 1))
+PDF2DOCX_CHUNK_PAGES = int(os.getenv('PDF2DOCX_CHUNK_PAGES', 8))
+# On-disk cache of whole PDFs converted to Word, so repeated whole-document edits of one upload convert it once;
+# edits limited to some pages are not cached
+DOCUMENT_CACHE_ENABLED = os.getenv('DOCUMENT_CACHE_ENABLED', 'true').lower() == 'true'
+DOCUMENT_CACHE_PATH = os.getenv('DOCUMENT_CACHE_PATH', os.path.join(BASE_DIR, 'document_cache.sqlite3'))
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv('DOCUMENT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# On-disk cache of rendered page previews, reused for pages an edit does not change
+PREVIEW_CACHE_ENABLED = os.getenv('PREVIEW_CACHE_ENABLED', 'true').lower() == 'true'
+PREVIEW_CACHE_PATH = os.getenv('PREVIEW_CACHE_PATH', os.path.join(BASE_DIR, 'preview_cache.sqlite3'))
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv('PREVIEW_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+# Default preview scale, relative to 72 dpi
+PREVIEW_ZOOM = float(os.getenv('PREVIEW_ZOOM', 0.5))
+# Text and text spans of each PDF, extracted once and read page by page
+TEXT_LAYER_DIR = os.getenv('TEXT_LAYER_DIR', os.path.join(BASE_DIR, 'text_layers'))
+# BM25 indexes of PDF text for question answering, and how passages are cut and retrieved
+RETRIEVAL_INDEX_PATH = os.getenv('RETRIEVAL_INDEX_PATH', os.path.join(BASE_DIR, 'retrieval_index.sqlite3'))
+RETRIEVAL_CHUNK_WORDS = int(os.getenv('RETRIEVAL_CHUNK_WORDS', 200))
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv('RETRIEVAL_CHUNK_OVERLAP', 50))
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 4))
+# Most passages a single question or search may ask for
+RETRIEVAL_MAX_K = int(os.getenv('RETRIEVAL_MAX_K', 50))
+# Hashed embeddings of the same passages for semantic search. Documents with at least
+# VECTOR_IVF_MIN_ROWS passages are searched through a coarse quantizer, probing the
+# VECTOR_IVF_PROBES nearest clusters; 0 always searches every passage
+VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', os.path.join(BASE_DIR, 'vector_index'))
+VECTOR_DIMENSIONS = int(os.getenv('VECTOR_DIMENSIONS', 1024))
+VECTOR_IVF_MIN_ROWS = int(os.getenv('VECTOR_IVF_MIN_ROWS', 0))
+VECTOR_IVF_PROBES = int(os.getenv('VECTOR_IVF_PROBES', 8))
+# Long texts are summarized in chunks of SUMMARY_CHUNK_WORDS words, SUMMARY_CONCURRENCY
+# at a time, and the chunk summaries combined SUMMARY_REDUCE_FANOUT at a time
+SUMMARY_CHUNK_WORDS = int(os.getenv('SUMMARY_CHUNK_WORDS', 1500))
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', 4))
+SUMMARY_REDUCE_FANOUT = int(os.getenv('SUMMARY_REDUCE_FANOUT', 8))
+
+# Metrics snapshots written by web and worker processes and merged by the /metrics view.
+# Web processes save theirs after a request at most every METRICS_SNAPSHOT_INTERVAL seconds
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', 5))
@@ -2,8 +2,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
-from chatbot.views import CreateUserView
+from chatbot.views import CreateUserView, metrics, serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -16,4 +15,10 @@ urlpatterns = [
     # Chatbot routes
     path('api/chatbot/user/register/', CreateUserView.as_view(), name='register'),
     path('api/chatbot/', include('chatbot.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+    # Prometheus metrics
+    path('metrics', metrics, name='metrics'),
+
+    # Generated PDFs, streamed from the configured storage
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:name>", serve_media, name='media'),
+]
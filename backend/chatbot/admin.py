@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Conversation, PDF
+from .models import Conversation, PDF, PDFJob
 
 class PDFInline(admin.TabularInline):
     model = PDF
@@ -13,5 +13,16 @@ class PDFAdmin(admin.ModelAdmin):
     list_display = ('conversation', 'description', 'pdf_url', 'created_at')
     search_fields = ('description',)
 
+class PDFJobAdmin(admin.ModelAdmin):
+    list_display = ('conversation', 'status', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('description',)
+    actions = ['requeue_jobs']
+
+    @admin.action(description="Requeue selected failed jobs")
+    def requeue_jobs(self, request, queryset):
+        queryset.filter(status=PDFJob.FAILED).update(status=PDFJob.QUEUED, error='', started_at=None, finished_at=None)
+
 admin.site.register(Conversation, ConversationAdmin)
 admin.site.register(PDF, PDFAdmin)
+admin.site.register(PDFJob, PDFJobAdmin)
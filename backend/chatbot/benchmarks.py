@@ -0,0 +1,471 @@
+from django.test.utils import override_settings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from .llm import OfflineChatModel, sample_markdown
+from .create_pdf import pdf_generator
+import tracemalloc
+import tempfile
+import pymupdf
+import platform
+import math
+import time
+import io
+import os
+
+WORKLOADS = ('generate', 'edit', 'edit_rules', 'recolor', 'recolor_page', 'retrieve', 'summarize')
+
+EDIT_INSTRUCTIONS = "Change the background to black and the text to white."
+
+BENCHMARK_SETTINGS = {
+    # Measure the pipeline itself, not cache hits or disk writes
+    'LLM_CACHE_ENABLED': False,
+    'PIPELINE_KEEP_CHECKPOINTS': False,
+    'STORAGES': {
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+}
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """
+    Returns the pct-th percentile of the values, interpolating between the closest ranks.
+
+    Args:
+        values (Sequence[float]): The samples.
+        pct (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile, or NaN when there are no samples.
+    """
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def measure(func: Callable[[], Any], runs: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Calls func `runs` times from `concurrency` threads and summarizes the latencies.
+
+    A call counts as an error when it raises or returns a falsy result.
+
+    Args:
+        func (Callable[[], Any]): The operation to measure.
+        runs (int): Total number of calls.
+        concurrency (int): Number of calls in flight at once.
+
+    Returns:
+        Dict[str, Any]: Throughput, latency percentiles and error count.
+    """
+    def timed_call(_) -> Tuple[float, bool]:
+        start = time.perf_counter()
+        try:
+            ok = bool(func())
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed_call, range(runs)))
+    wall = time.perf_counter() - start
+
+    latencies = [latency for latency, ok in samples if ok]
+    return {
+        'runs': runs,
+        'errors': runs - len(latencies),
+        'wall_s': wall,
+        'throughput_per_s': len(latencies) / wall if wall else 0.0,
+        'latency_mean_s': sum(latencies) / len(latencies) if latencies else math.nan,
+        'latency_p50_s': percentile(latencies, 50),
+        'latency_p95_s': percentile(latencies, 95),
+    }
+
+
+@contextmanager
+def offline_models(sections: int, latency: float, tokens_per_second: float):
+    """Swaps the generator's and editor's chat models for offline stand-ins for the duration of the block."""
+    def model(name: str) -> OfflineChatModel:
+        return OfflineChatModel(model_name=name, latency=latency, tokens_per_second=tokens_per_second or None, document_sections=sections)
+
+    originals = (pdf_generator.llm_llama, pdf_generator.llm_mixtral)
+    pdf_generator.llm_llama = model("llama3-70b-8192")
+    pdf_generator.llm_mixtral = model("mixtral-8x7b-32768")
+    try:
+        yield model
+    finally:
+        pdf_generator.llm_llama, pdf_generator.llm_mixtral = originals
+
+
+def benchmark_generate(sections: int, concurrency: int, runs: int, latency: float, tokens_per_second: float) -> Dict[str, Any]:
+    with offline_models(sections, latency, tokens_per_second):
+        return measure(lambda: pdf_generator.generate_pdf_from_description("Benchmark document."), runs, concurrency)
+
+
+def benchmark_edit(sections: int, concurrency: int, runs: int, latency: float, tokens_per_second: float,
+                   rules: bool = False) -> Dict[str, Any]:
+    from langchain.agents import AgentExecutor, create_tool_calling_agent
+    from .edit_pdf import edit_pdf
+
+    with offline_models(sections, latency, tokens_per_second) as model, tempfile.TemporaryDirectory() as workdir, \
+            override_settings(EDIT_RULES_ENABLED=rules):
+        originals = (edit_pdf.llm, edit_pdf.agent, edit_pdf.agent_executor)
+        edit_pdf.llm = model("mixtral-8x7b-32768")
+        edit_pdf.agent = create_tool_calling_agent(edit_pdf.llm, edit_pdf.tools, edit_pdf.prompt)
+        edit_pdf.agent_executor = AgentExecutor(agent=edit_pdf.agent, tools=edit_pdf.tools)
+        source = pdf_generator.render_pdf(sample_markdown(sections), {})
+        counter = iter(range(runs))
+
+        def edit() -> str:
+            # Every run edits its own copy so outputs do not overwrite each other
+            input_pdf = os.path.join(workdir, f"input_{next(counter)}.pdf")
+            with open(input_pdf, 'wb') as f:
+                f.write(source)
+            output_pdf = edit_pdf.edit_pdf_from_description(input_pdf, EDIT_INSTRUCTIONS)
+            return output_pdf if os.path.exists(output_pdf) else ""
+
+        try:
+            return measure(edit, runs, concurrency)
+        finally:
+            edit_pdf.llm, edit_pdf.agent, edit_pdf.agent_executor = originals
+
+
+def benchmark_edit_rules(sections: int, concurrency: int, runs: int, latency: float, tokens_per_second: float) -> Dict[str, Any]:
+    # The same instruction read by the rule-based parser instead of the agent
+    return benchmark_edit(sections, concurrency, runs, latency, tokens_per_second, rules=True)
+
+
+def benchmark_recolor(sections: int, concurrency: int, runs: int, latency: float, tokens_per_second: float) -> Dict[str, Any]:
+    # The formatting step of an edit on its own, without the LLM calls that choose the formats
+    from .edit_pdf.content_stream import ContentStreamEditor
+
+    source = pdf_generator.render_pdf(sample_markdown(sections), {})
+    editor = ContentStreamEditor(font_color='#FFFFFF', bg_color='#000000', font_size_scale=1.1)
+    return measure(lambda: editor.edit_bytes(source), runs, concurrency)
+
+
+def benchmark_recolor_page(sections: int, concurrency: int, runs: int, latency: float, tokens_per_second: float) -> Dict[str, Any]:
+    # Like 'recolor' but limited to the first page, which should cost the same at every document size
+    from .edit_pdf.editor import PDFEditor
+
+    source = pdf_generator.render_pdf(sample_markdown(sections), {})
+    with tempfile.TemporaryDirectory() as workdir:
+        input_pdf = os.path.join(workdir, "input.pdf")
+        with open(input_pdf, 'wb') as f:
+            f.write(source)
+        counter = iter(range(runs))
+
+        def edit() -> str:
+            output_pdf = os.path.join(workdir, f"output_{next(counter)}.pdf")
+            PDFEditor(input_pdf, output_pdf, font_color='#FFFFFF', bg_color='#000000', pages="1").apply_custom_formats()
+            return output_pdf
+
+        return measure(edit, runs, concurrency)
+
+
+def benchmark_retrieve(sections: int, concurrency: int, runs: int, latency: float, tokens_per_second: float) -> Dict[str, Any]:
+    # BM25 search of an indexed document, without extracting its text or answering with the LLM
+    from .retrieval import RetrievalStore, chunk_pages
+    from .text_layer import extract_text_layer
+
+    pages = [text for text, _, _, _ in extract_text_layer(pdf_generator.render_pdf(sample_markdown(sections), {}))]
+    with tempfile.TemporaryDirectory() as workdir:
+        store = RetrievalStore(os.path.join(workdir, "retrieval.sqlite3"))
+        store.add("benchmark", chunk_pages(pages), len(pages))
+        queries = iter(range(runs))
+        return measure(lambda: store.search("benchmark", f"section {next(queries) % sections + 1} nested detail latency"), runs, concurrency)
+
+
+def benchmark_summarize(sections: int, concurrency: int, runs: int, latency: float, tokens_per_second: float) -> Dict[str, Any]:
+    # Map-reduce summarization of the generated document's text with the offline model
+    import asyncio
+    from .summaries import summarize
+    from .text_layer import extract_text_layer
+
+    text = "\f".join(text for text, _, _, _ in extract_text_layer(pdf_generator.render_pdf(sample_markdown(sections), {})))
+    with offline_models(sections, latency, tokens_per_second) as model:
+        llm = model("mixtral-8x7b-32768")
+        return measure(lambda: asyncio.run(summarize(text, llm)), runs, concurrency)
+
+
+BENCHMARKS = {'generate': benchmark_generate, 'edit': benchmark_edit, 'edit_rules': benchmark_edit_rules, 'recolor': benchmark_recolor,
+              'recolor_page': benchmark_recolor_page, 'retrieve': benchmark_retrieve, 'summarize': benchmark_summarize}
+
+
+def run_benchmarks(workloads: Sequence[str], sizes: Sequence[int], concurrency_levels: Sequence[int], runs: int,
+                   latency: float = 0.0, tokens_per_second: float = 0.0, log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """
+    Measures throughput and latency of each workload across document sizes and concurrency levels.
+
+    Args:
+        workloads (Sequence[str]): Names from WORKLOADS.
+        sizes (Sequence[int]): Document sizes, in sections of roughly one page.
+        concurrency_levels (Sequence[int]): Numbers of requests in flight at once.
+        runs (int): Requests per (workload, size, concurrency) combination.
+        latency (float): Simulated seconds of latency per LLM call.
+        tokens_per_second (float): Simulated LLM output rate, 0 for instant output.
+        log (Callable[[str], None]): Receives a line per finished combination.
+
+    Returns:
+        Dict[str, Any]: The run parameters and one result per combination, ready to be saved as JSON.
+    """
+    results = []
+    with override_settings(**BENCHMARK_SETTINGS):
+        for workload in workloads:
+            try:
+                for sections in sizes:
+                    for concurrency in concurrency_levels:
+                        with redirect_stdout(io.StringIO()):
+                            result = BENCHMARKS[workload](sections, concurrency, runs, latency, tokens_per_second)
+                        result.update(workload=workload, sections=sections, concurrency=concurrency)
+                        results.append(result)
+                        log(format_result(result))
+            except ImportError as e:
+                log(f"Skipping '{workload}': {e}")
+    return {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'runs': runs,
+            'simulated_latency_s': latency,
+            'simulated_tokens_per_second': tokens_per_second,
+        },
+        'results': results,
+    }
+
+
+def benchmark_pdf2docx_scaling(sections: int, workers: Sequence[int], chunk_pages: int, runs: int,
+                               log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """
+    Measures how PDF to Word conversion scales with the number of worker processes.
+
+    Args:
+        sections (int): Document size, in sections of roughly half a page.
+        workers (Sequence[int]): Worker process counts to compare; the first is the baseline for speedups.
+        chunk_pages (int): Pages parsed per task.
+        runs (int): Conversions per worker count.
+        log (Callable[[str], None]): Receives a line per worker count.
+
+    Returns:
+        Dict[str, Any]: The run parameters and one result per worker count, ready to be saved as JSON.
+    """
+    from .edit_pdf.editor import PDFConverter
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        input_pdf = os.path.join(workdir, "input.pdf")
+        with open(input_pdf, 'wb') as f:
+            f.write(pdf_generator.render_pdf(sample_markdown(sections), {}))
+        with pymupdf.open(input_pdf) as doc:
+            pages = len(doc)
+
+        for count in workers:
+            converter = PDFConverter(input_pdf, os.path.join(workdir, f"output_{count}.docx"), None, count, chunk_pages)
+            with redirect_stdout(io.StringIO()):
+                result = measure(lambda: converter.pdf_to_word() or True, runs, 1)
+            result.update(workers=count, speedup=results[0]['latency_mean_s'] / result['latency_mean_s'] if results else 1.0)
+            results.append(result)
+            log(f"workers={count:<3} mean={result['latency_mean_s']:.2f}s speedup=x{result['speedup']:.2f} errors={result['errors']}/{runs}")
+
+    return {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'pages': pages,
+            'chunk_pages': chunk_pages,
+            'runs': runs,
+        },
+        'results': results,
+    }
+
+
+def build_large_docx(paragraphs: int, runs_per_paragraph: int) -> bytes:
+    """
+    Builds a DOCX whose runs cycle through a small set of fonts, sizes and styles, like converted PDFs do.
+
+    Args:
+        paragraphs (int): Number of paragraphs.
+        runs_per_paragraph (int): Runs in each paragraph.
+
+    Returns:
+        bytes: The DOCX file.
+    """
+    from docx import Document
+    from docx.shared import Pt
+
+    doc = Document()
+    for i in range(paragraphs):
+        paragraph = doc.add_paragraph()
+        paragraph.paragraph_format.space_after = Pt(6 + i % 3)
+        paragraph.paragraph_format.left_indent = Pt(18 * (i % 2))
+        for j in range(runs_per_paragraph):
+            run = paragraph.add_run(f"Run {j} of paragraph {i}. ")
+            run.font.size = Pt((10, 11, 12, 14)[(i + j) % 4])
+            run.font.name = ('Calibri', 'Times New Roman')[j % 2]
+            run.bold = j % 3 == 0
+            run.italic = j % 5 == 0
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def benchmark_extract(paragraphs: int, runs_per_paragraph: int, runs: int) -> Dict[str, Any]:
+    """
+    Measures the time and peak memory of ContentExtractor.extract_content on a generated DOCX.
+
+    Args:
+        paragraphs (int): Number of paragraphs in the document.
+        runs_per_paragraph (int): Runs in each paragraph.
+        runs (int): Extractions to time.
+
+    Returns:
+        Dict[str, Any]: Latency summary, peak traced memory and the number of runs extracted.
+    """
+    from docx import Document
+    from .edit_pdf.editor import ContentExtractor
+
+    data = build_large_docx(paragraphs, runs_per_paragraph)
+    result = measure(lambda: ContentExtractor(Document(io.BytesIO(data))).extract_content(), runs, 1)
+
+    doc = Document(io.BytesIO(data))
+    tracemalloc.start()
+    content, _, _ = ContentExtractor(doc).extract_content()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    formats = [run_format for item in content if item['type'] == 'paragraph' for _, run_format in item['content']]
+    result.update(
+        paragraphs=paragraphs,
+        runs_per_paragraph=runs_per_paragraph,
+        extracted_runs=len(formats),
+        distinct_format_objects=len({id(run_format) for run_format in formats}),
+        peak_memory_mb=peak / 1024 / 1024,
+    )
+    return result
+
+
+def build_table_docx(tables: int, rows: int, cols: int) -> bytes:
+    """
+    Builds a DOCX of tables with a merged first column and a nested table in their last cell,
+    plus a header table.
+
+    Args:
+        tables (int): Number of tables in the body.
+        rows (int): Rows per table.
+        cols (int): Columns per table.
+
+    Returns:
+        bytes: The DOCX file.
+    """
+    from docx import Document
+
+    doc = Document()
+    doc.sections[0].header.add_table(2, 2, doc.sections[0].page_width).cell(0, 0).text = "Header cell"
+    for i in range(tables):
+        doc.add_paragraph(f"Table {i}")
+        table = doc.add_table(rows, cols)
+        for row in table.rows:
+            for cell in row.cells:
+                cell.text = "Cell text"
+        table.cell(0, 0).merge(table.cell(rows - 1, 0))
+        table.cell(0, cols - 1).add_table(2, 2).cell(1, 1).text = "Nested"
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def recolor_via_proxies(formatter, doc) -> None:
+    """The python-docx proxy walk apply_formats_in_place used before it worked on the XML, kept as a baseline."""
+    from docx.shared import RGBColor
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+
+    font_color_rgb = RGBColor(*[int(c * 255) for c in formatter.hex_to_rgb(formatter.font_color)])
+    bg_color_hex = formatter.bg_color.lstrip('#')
+    for para in doc.paragraphs:
+        for run in para.runs:
+            run.font.color.rgb = font_color_rgb
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                shd = OxmlElement('w:shd')
+                shd.set(qn('w:fill'), bg_color_hex)
+                cell._element.get_or_add_tcPr().append(shd)
+                for para in cell.paragraphs:
+                    for run in para.runs:
+                        run.font.color.rgb = font_color_rgb
+
+
+def benchmark_recolor_in_place(tables: int, rows: int, cols: int, runs: int) -> Dict[str, Any]:
+    """
+    Compares DocumentFormatter.apply_formats_in_place with the proxy walk it replaced.
+
+    Args:
+        tables (int): Number of tables in the generated document.
+        rows (int): Rows per table.
+        cols (int): Columns per table.
+        runs (int): Recolorings to time with each method.
+
+    Returns:
+        Dict[str, Any]: A latency summary per method, and the speedup.
+    """
+    from docx import Document
+    from .edit_pdf.editor import DocumentFormatter
+
+    data = build_table_docx(tables, rows, cols)
+    formatter = DocumentFormatter(font_color='#FF0000', bg_color='#000000')
+
+    def recolor(method):
+        doc = Document(io.BytesIO(data))
+        method(doc)
+        return doc
+
+    results = {
+        'proxies': measure(lambda: recolor(lambda doc: recolor_via_proxies(formatter, doc)), runs, 1),
+        'xml': measure(lambda: recolor(formatter.apply_formats_in_place), runs, 1),
+    }
+    results['speedup'] = results['proxies']['latency_mean_s'] / results['xml']['latency_mean_s']
+    return results
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    return (
+        f"{result['workload']:<8} sections={result['sections']:<4} concurrency={result['concurrency']:<3} "
+        f"throughput={result['throughput_per_s']:.2f}/s p50={result['latency_p50_s']:.3f}s "
+        f"p95={result['latency_p95_s']:.3f}s errors={result['errors']}/{result['runs']}"
+    )
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """
+    Describes how each combination's p50 latency and throughput changed since a baseline run.
+
+    Args:
+        baseline (Dict[str, Any]): Results of an earlier run_benchmarks call.
+        current (Dict[str, Any]): Results of the run to compare.
+
+    Returns:
+        List[str]: One line per combination present in both runs.
+    """
+    def key(result):
+        return result['workload'], result['sections'], result['concurrency']
+
+    previous = {key(result): result for result in baseline['results']}
+    lines = []
+    for result in current['results']:
+        before = previous.get(key(result))
+        if before is None or not before['latency_p50_s'] or not before['throughput_per_s']:
+            continue
+        lines.append(
+            f"{result['workload']:<8} sections={result['sections']:<4} concurrency={result['concurrency']:<3} "
+            f"p50 x{result['latency_p50_s'] / before['latency_p50_s']:.2f} "
+            f"throughput x{result['throughput_per_s'] / before['throughput_per_s']:.2f}"
+        )
+    return lines
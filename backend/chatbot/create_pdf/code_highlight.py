@@ -0,0 +1,177 @@
+from reportlab.platypus import Flowable
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib import colors
+from pygments.formatter import Formatter
+from pygments.lexer import Lexer
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+from xml.sax.saxutils import escape, quoteattr
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+import threading
+import hashlib
+
+# Number of highlighted code blocks kept in memory
+HIGHLIGHT_CACHE_SIZE = 256
+
+# Courier variants by (bold, italic)
+COURIER_FONTS = {
+    (False, False): 'Courier',
+    (True, False): 'Courier-Bold',
+    (False, True): 'Courier-Oblique',
+    (True, True): 'Courier-BoldOblique',
+}
+
+# A run of text drawn with one font and color; a color of None means the document text color
+Fragment = Tuple[str, str, Optional[str]]
+
+
+@lru_cache(maxsize=None)
+def hex_color(value: str) -> colors.Color:
+    return colors.HexColor(value)
+
+
+@lru_cache(maxsize=None)
+def get_lexer(language: str) -> Lexer:
+    """Returns the shared lexer for a language, falling back to plain text for unknown names."""
+    try:
+        return get_lexer_by_name(language, stripall=True)
+    except ClassNotFound:
+        return get_lexer_by_name("text", stripall=True)
+
+
+class ReportLabFormatter(Formatter):
+    """
+    Pygments formatter that turns a token stream into lines of styled fragments
+    ready to be drawn by ReportLab, without an HTML intermediate.
+    """
+
+    name = 'ReportLab'
+    aliases = ['reportlab']
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.token_styles = {}
+        for ttype, style in self.style:
+            self.token_styles[ttype] = (
+                COURIER_FONTS[(bool(style['bold']), bool(style['italic']))],
+                f"#{style['color']}" if style['color'] else None,
+            )
+
+    def token_style(self, ttype) -> Tuple[str, Optional[str]]:
+        """
+        Returns the font and color of a token type.
+
+        Lexers may define their own token subtypes, which the style does not list; those
+        are drawn like the nearest parent type the style knows.
+        """
+        style = self.token_styles.get(ttype)
+        if style is None:
+            parent = ttype.parent
+            while parent not in self.token_styles:
+                parent = parent.parent
+            style = self.token_styles.setdefault(ttype, self.token_styles[parent])
+        return style
+
+    def format_lines(self, tokensource: Iterable) -> List[List[Fragment]]:
+        """
+        Groups a token stream into lines of fragments, merging adjacent tokens with the same style.
+
+        Args:
+            tokensource (Iterable): (token type, value) pairs from a lexer.
+
+        Returns:
+            List[List[Fragment]]: The fragments of each line.
+        """
+        lines: List[List[Fragment]] = [[]]
+        for ttype, value in tokensource:
+            font, color = self.token_style(ttype)
+            for i, part in enumerate(value.split('\n')):
+                if i:
+                    lines.append([])
+                if not part:
+                    continue
+                line = lines[-1]
+                if line and line[-1][1:] == (font, color):
+                    line[-1] = (line[-1][0] + part, font, color)
+                else:
+                    line.append((part, font, color))
+        if not lines[-1]:
+            lines.pop()
+        return lines
+
+    def format(self, tokensource, outfile):
+        """Writes the tokens as ReportLab paragraph markup, for use with XPreformatted."""
+        for i, line in enumerate(self.format_lines(tokensource)):
+            if i:
+                outfile.write('\n')
+            for text, font, color in line:
+                color_attr = f" color={quoteattr(color)}" if color else ""
+                outfile.write(f'<font name="{font}"{color_attr}>{escape(text)}</font>')
+
+
+_formatter = ReportLabFormatter(style='colorful')
+_highlight_cache: "OrderedDict[Tuple[str, str], List[List[Fragment]]]" = OrderedDict()
+_highlight_lock = threading.Lock()
+
+
+def highlight_lines(code: str, language: str) -> List[List[Fragment]]:
+    """
+    Highlights code into lines of fragments, memoized on (language, hash of the code).
+
+    Args:
+        code (str): The source code.
+        language (str): The language named in the code fence.
+
+    Returns:
+        List[List[Fragment]]: The fragments of each line.
+    """
+    key = (language, hashlib.sha1(code.encode('utf-8')).hexdigest())
+    with _highlight_lock:
+        if key in _highlight_cache:
+            _highlight_cache.move_to_end(key)
+            return _highlight_cache[key]
+
+    lines = _formatter.format_lines(get_lexer(language).get_tokens(code))
+    with _highlight_lock:
+        _highlight_cache[key] = lines
+        if len(_highlight_cache) > HIGHLIGHT_CACHE_SIZE:
+            _highlight_cache.popitem(last=False)
+    return lines
+
+
+class CodeBlock(Flowable):
+    """A highlighted code block drawn directly from styled fragments; splits between lines across pages."""
+
+    def __init__(self, lines: List[List[Fragment]], style: ParagraphStyle, text_color: colors.Color):
+        super().__init__()
+        self.lines = lines
+        self.style = style
+        self.text_color = text_color
+
+    def wrap(self, availWidth, availHeight):
+        self.width = availWidth
+        self.height = len(self.lines) * self.style.leading
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        fits = int(availHeight // self.style.leading)
+        if fits <= 0:
+            return []
+        if fits >= len(self.lines):
+            return [self]
+        return [
+            CodeBlock(self.lines[:fits], self.style, self.text_color),
+            CodeBlock(self.lines[fits:], self.style, self.text_color),
+        ]
+
+    def draw(self):
+        font_size = self.style.fontSize
+        for i, line in enumerate(self.lines):
+            text = self.canv.beginText(0, self.height - i * self.style.leading - font_size)
+            for part, font, color in line:
+                text.setFont(font, font_size)
+                text.setFillColor(hex_color(color) if color else self.text_color)
+                text.textOut(part)
+            self.canv.drawText(text)
@@ -0,0 +1,125 @@
+from reportlab.platypus import Flowable, Paragraph, Image, ListFlowable, ListItem, Table, TableStyle, HRFlowable
+from markdown_it import MarkdownIt
+from markdown_it.token import Token
+from xml.sax.saxutils import escape, quoteattr
+from typing import Any, List
+from .themes import Theme
+from .code_highlight import CodeBlock, highlight_lines
+from ..metrics import span
+
+# CommonMark plus the GitHub table and strikethrough extensions
+markdown_parser = MarkdownIt('commonmark').enable(['table', 'strikethrough'])
+
+# ReportLab paragraph markup for inline Markdown tokens
+INLINE_TAGS = {
+    'strong_open': '<b>', 'strong_close': '</b>',
+    'em_open': '<i>', 'em_close': '</i>',
+    's_open': '<strike>', 's_close': '</strike>',
+    'link_close': '</a>',
+}
+
+
+def render_inline(token: Token) -> List[Any]:
+    """
+    Converts an inline token into ReportLab paragraph markup.
+
+    Args:
+        token (Token): An `inline` token from the Markdown token stream.
+
+    Returns:
+        List[Any]: The paragraph markup, followed by the `src` of every image in the token.
+    """
+    markup = []
+    images = []
+    for child in token.children or []:
+        if child.type == 'text':
+            markup.append(escape(child.content))
+        elif child.type == 'code_inline':
+            markup.append(f'<font name="Courier">{escape(child.content)}</font>')
+        elif child.type in ('softbreak', 'hardbreak'):
+            markup.append('<br/>' if child.type == 'hardbreak' else ' ')
+        elif child.type == 'link_open':
+            markup.append(f'<a href={quoteattr(child.attrs.get("href", ""))}>')
+        elif child.type == 'image':
+            images.append(child.attrs.get('src', ''))
+        elif child.type in INLINE_TAGS:
+            markup.append(INLINE_TAGS[child.type])
+    return ["".join(markup).strip()] + images
+
+
+def code_flowable(code: str, language: str, theme: Theme) -> CodeBlock:
+    """
+    Builds a highlighted block for fenced code.
+
+    Args:
+        code (str): The source code.
+        language (str): The language named in the code fence.
+        theme (Theme): The document theme.
+
+    Returns:
+        CodeBlock: The highlighted code block.
+    """
+    return CodeBlock(highlight_lines(code, language), theme.code, theme.body.textColor)
+
+
+def markdown_to_flowables(content: str, theme: Theme) -> List[Flowable]:
+    """
+    Converts Markdown content to ReportLab flowable elements in a single pass over its token stream.
+
+    Nested blocks are tracked on a stack, so each token is visited exactly once and
+    paragraphs inside list items or table cells are emitted only as part of their container.
+    All styles come from the theme, so no style objects are created per element.
+
+    Args:
+        content (str): The Markdown content.
+        theme (Theme): The compiled styles of the document.
+
+    Returns:
+        List[Flowable]: A list of ReportLab flowable elements.
+    """
+    with span('markdown_parse'):
+        tokens = markdown_parser.parse(content)
+    with span('flowables'):
+        return tokens_to_flowables(tokens, theme)
+
+
+def tokens_to_flowables(tokens: List[Token], theme: Theme) -> List[Flowable]:
+    elements: List[Flowable] = []
+    # Each frame is [kind, flowables] for the root, lists and list items, or [kind, rows] for tables
+    stack: List[List[Any]] = [['root', elements]]
+    block = None
+
+    for token in tokens:
+        kind, children = stack[-1]
+        if token.type in ('heading_open', 'paragraph_open', 'th_open', 'td_open'):
+            block = token.tag
+        elif token.type == 'inline':
+            text, *images = render_inline(token)
+            if block in ('th', 'td'):
+                children[-1].append(Paragraph(text, theme.table_header if block == 'th' else theme.table_cell))
+                continue
+            if text:
+                children.append(Paragraph(text, theme.headings.get(block, theme.body)))
+            for src in images:
+                children.append(Image(src, width=theme.image_width, height=theme.image_height))
+        elif token.type in ('fence', 'code_block'):
+            language = token.info.split()[0] if token.info.strip() else "text"
+            children.append(code_flowable(token.content, language, theme))
+        elif token.type == 'html_block':
+            children.append(Paragraph(escape(token.content.strip()), theme.body))
+        elif token.type == 'hr':
+            children.append(HRFlowable(width="100%", thickness=2, color=theme.body.textColor))
+        elif token.type in ('bullet_list_open', 'ordered_list_open', 'list_item_open', 'table_open'):
+            stack.append([token.tag, []])
+        elif token.type == 'tr_open':
+            children.append([])
+        elif token.type == 'list_item_close':
+            stack.pop()
+            stack[-1][1].append(ListItem(children))
+        elif token.type in ('bullet_list_close', 'ordered_list_close'):
+            stack.pop()
+            stack[-1][1].append(ListFlowable(children, bulletType="bullet" if kind == "ul" else "i"))
+        elif token.type == 'table_close':
+            stack.pop()
+            stack[-1][1].append(Table(children, style=TableStyle(theme.table_commands)))
+    return elements
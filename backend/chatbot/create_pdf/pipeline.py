@@ -0,0 +1,252 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+from ..metrics import span
+import contextvars
+import threading
+import json
+import time
+import os
+
+
+class Stage:
+    """
+    A named step of the pipeline that reads and produces named values.
+
+    A stage that raises one of `retry_on` is retried on its own up to `retries`
+    times, waiting `backoff` seconds before the first retry and doubling the
+    wait after each one.
+    """
+
+    def __init__(self, name: str, func: Callable[..., Any], inputs: Sequence[str], outputs: Sequence[str],
+                 retries: int = 0, backoff: float = 0.0, retry_on: Tuple[Type[BaseException], ...] = (ValueError,)):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_on = retry_on
+
+    def run(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Calls the stage function with its inputs and maps the result onto its outputs.
+
+        Args:
+            values (Dict[str, Any]): All values available so far, keyed by name.
+
+        Returns:
+            Dict[str, Any]: The values produced by this stage.
+        """
+        result = self.func(*[values[name] for name in self.inputs])
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+        return dict(zip(self.outputs, result))
+
+
+class Checkpoint:
+    """
+    JSON file holding the outputs of every stage that completed during a run,
+    along with attempt counts and the last error of failed stages.
+
+    Running a graph again with the same checkpoint skips the stages that
+    already completed, so a retry resumes from the stage that failed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.stages = json.load(f)['stages']
+
+    def is_complete(self, stage: Stage) -> bool:
+        return self.stages.get(stage.name, {}).get('status') == 'completed'
+
+    def values(self) -> Dict[str, Any]:
+        """Returns every value produced by the completed stages."""
+        values = {}
+        for entry in self.stages.values():
+            if entry['status'] == 'completed':
+                values.update(entry['outputs'])
+        return values
+
+    def record_success(self, stage: Stage, outputs: Dict[str, Any], attempts: int, duration: float) -> None:
+        self._write(stage.name, {'status': 'completed', 'attempts': attempts, 'duration': duration, 'outputs': outputs})
+
+    def record_failure(self, stage: Stage, error: BaseException, attempts: int) -> None:
+        self._write(stage.name, {'status': 'failed', 'attempts': attempts, 'error': f"{type(error).__name__}: {error}"})
+
+    def _write(self, name: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self.stages[name] = dict(entry, updated_at=time.time())
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'stages': self.stages}, f, indent=2, default=str)
+            os.replace(tmp_path, self.path)
+
+    def discard(self) -> None:
+        """Deletes the checkpoint file."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StageTiming:
+    """Start and end offsets of one stage, relative to the start of the run."""
+
+    def __init__(self, name: str, start: float, end: float, attempts: int = 1):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attempts = attempts
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class RunTrace:
+    """Timings of a single graph run and the chain of stages that bounded its duration."""
+
+    def __init__(self, timings: Dict[str, StageTiming], critical_path: List[str]):
+        self.timings = timings
+        self.critical_path = critical_path
+
+    @property
+    def total(self) -> float:
+        return max((t.end for t in self.timings.values()), default=0.0)
+
+    def __str__(self) -> str:
+        path = " -> ".join(f"{name} ({self.timings[name].duration:.2f}s)" for name in self.critical_path)
+        return f"total {self.total:.2f}s, critical path: {path}"
+
+
+class StageGraph:
+    """
+    Executes stages as soon as their inputs are available, running independent
+    stages concurrently on a thread pool.
+    """
+
+    def __init__(self, stages: Sequence[Stage], max_workers: Optional[int] = None):
+        self.stages = list(stages)
+        self.max_workers = max_workers or len(self.stages)
+        self.producers: Dict[str, Stage] = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"'{output}' is produced by both '{self.producers[output].name}' and '{stage.name}'")
+                self.producers[output] = stage
+
+    def run(self, checkpoint: Optional[Checkpoint] = None, **initial: Any) -> Tuple[Dict[str, Any], RunTrace]:
+        """
+        Runs every stage of the graph.
+
+        Args:
+            checkpoint (Optional[Checkpoint]): Where completed stages are recorded; stages
+                already completed in it are skipped.
+            **initial: Values available before any stage runs.
+
+        Returns:
+            Tuple[Dict[str, Any], RunTrace]: All values produced by the run and its trace.
+
+        Raises:
+            ValueError: If a stage needs a value that nothing provides.
+            Exception: The first exception raised by a stage.
+        """
+        for stage in self.stages:
+            missing = [name for name in stage.inputs if name not in initial and name not in self.producers]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' has no source for inputs: {', '.join(missing)}")
+
+        values = dict(initial)
+        pending = list(self.stages)
+        if checkpoint is not None:
+            values.update(checkpoint.values())
+            pending = [stage for stage in pending if not checkpoint.is_complete(stage)]
+        timings: Dict[str, StageTiming] = {}
+        running = {}
+        origin = time.perf_counter()
+
+        def timed(stage: Stage, inputs: Dict[str, Any]) -> Dict[str, Any]:
+            start = time.perf_counter() - origin
+            with span(stage.name):
+                outputs, attempt = attempts(stage, inputs, start)
+            self._finish(checkpoint, timings, StageTiming(stage.name, start, time.perf_counter() - origin, attempt), outputs=outputs)
+            return outputs
+
+        def attempts(stage: Stage, inputs: Dict[str, Any], start: float) -> Tuple[Dict[str, Any], int]:
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    outputs = stage.run(inputs)
+                    break
+                except stage.retry_on as e:
+                    if attempt > stage.retries:
+                        self._finish(checkpoint, timings, StageTiming(stage.name, start, time.perf_counter() - origin, attempt), error=e)
+                        raise
+                    print(f"Stage '{stage.name}' failed (attempt {attempt}): {e}")
+                    time.sleep(stage.backoff * 2 ** (attempt - 1))
+                except Exception as e:
+                    self._finish(checkpoint, timings, StageTiming(stage.name, start, time.perf_counter() - origin, attempt), error=e)
+                    raise
+            return outputs, attempt
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for stage in [s for s in pending if all(name in values for name in s.inputs)]:
+                    pending.remove(stage)
+                    # Copy the context so the stage's spans reach the timings of the calling request
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, timed, stage, values)] = stage
+                if not running:
+                    names = ", ".join(s.name for s in pending)
+                    raise ValueError(f"Stages can never run because their inputs form a cycle: {names}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    values.update(future.result())
+
+        return values, RunTrace(timings, self.critical_path(timings))
+
+    def _finish(self, checkpoint: Optional[Checkpoint], timings: Dict[str, StageTiming], timing: StageTiming,
+                outputs: Optional[Dict[str, Any]] = None, error: Optional[BaseException] = None) -> None:
+        timings[timing.name] = timing
+        if checkpoint is None:
+            return
+        stage = next(s for s in self.stages if s.name == timing.name)
+        if error is None:
+            checkpoint.record_success(stage, outputs, timing.attempts, timing.duration)
+        else:
+            checkpoint.record_failure(stage, error, timing.attempts)
+
+    def critical_path(self, timings: Dict[str, StageTiming]) -> List[str]:
+        """
+        Walks back from the last stage to finish, each time following the input
+        whose producer finished latest.
+
+        Args:
+            timings (Dict[str, StageTiming]): Timings of a completed run.
+
+        Returns:
+            List[str]: Stage names along the critical path, in execution order.
+        """
+        if not timings:
+            return []
+        stage = next(s for s in self.stages if s.name == max(timings, key=lambda name: timings[name].end))
+        path = [stage.name]
+        while True:
+            # Stages restored from a checkpoint did not run and have no timing
+            parents = {self.producers[name] for name in stage.inputs if name in self.producers and self.producers[name].name in timings}
+            if not parents:
+                break
+            stage = max(parents, key=lambda s: timings[s.name].end)
+            path.append(stage.name)
+        return path[::-1]
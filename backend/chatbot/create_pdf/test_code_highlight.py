@@ -0,0 +1,57 @@
+import io
+import unittest
+from reportlab.platypus import SimpleDocTemplate, XPreformatted
+from reportlab.lib import colors
+from pygments import highlight
+from pygments.token import String
+from chatbot.create_pdf.code_highlight import CodeBlock, ReportLabFormatter, get_lexer, highlight_lines
+from chatbot.create_pdf.themes import get_theme
+
+CODE = 'def greet(name):\n    # say hi\n    return "hi " + name\n'
+
+
+class TestCodeHighlight(unittest.TestCase):
+
+    def test_lexers_are_cached(self):
+        self.assertIs(get_lexer('python'), get_lexer('python'))
+        self.assertEqual(get_lexer('no-such-language').name, get_lexer('text').name)
+
+    def test_fragments(self):
+        lines = highlight_lines(CODE, 'python')
+        self.assertEqual(len(lines), 3)
+        self.assertEqual("".join(text for text, _, _ in lines[1]), "    # say hi")
+        self.assertIn(('def', 'Courier-Bold', '#008800'), lines[0])
+        self.assertIn(('# say hi', 'Courier', '#888888'), lines[1])
+
+    def test_lexer_specific_token_types(self):
+        # Quoted identifiers are String.Name and quoted atoms String.Atom, which the style does not list
+        lines = highlight_lines('SELECT "user name" FROM t;', 'postgresql')
+        self.assertEqual("".join(text for text, _, _ in lines[0]), 'SELECT "user name" FROM t;')
+        lines = highlight_lines("greet('hello world').", 'prolog')
+        self.assertEqual("".join(text for text, _, _ in lines[0]), "greet('hello world').")
+        formatter = ReportLabFormatter(style='colorful')
+        self.assertEqual(formatter.token_style(String.Atom), formatter.token_style(String))
+
+    def test_highlight_is_memoized(self):
+        self.assertIs(highlight_lines(CODE, 'python'), highlight_lines(CODE, 'python'))
+        self.assertIsNot(highlight_lines(CODE, 'python'), highlight_lines(CODE, 'text'))
+
+    def test_markup_output(self):
+        markup = highlight(CODE, get_lexer('python'), ReportLabFormatter(style='colorful'))
+        self.assertIn('<font name="Courier-Bold" color="#008800">def</font>', markup)
+        XPreformatted(markup, get_theme({}).code)
+
+    def test_code_block_splits_across_pages(self):
+        theme = get_theme({})
+        block = CodeBlock(highlight_lines(CODE * 200, 'python'), theme.code, colors.black)
+        first, rest = block.split(500, 120)
+        self.assertEqual(len(first.lines), 10)
+        self.assertEqual(len(first.lines) + len(rest.lines), 600)
+
+        buffer = io.BytesIO()
+        SimpleDocTemplate(buffer).build([block])
+        self.assertTrue(buffer.getvalue().startswith(b'%PDF'))
+
+
+if __name__ == "__main__":
+    unittest.main()
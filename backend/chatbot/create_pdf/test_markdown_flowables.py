@@ -0,0 +1,83 @@
+import io
+import time
+import unittest
+from reportlab.platypus import SimpleDocTemplate, Paragraph, ListFlowable, Table, HRFlowable
+from chatbot.create_pdf.markdown_flowables import markdown_to_flowables
+from chatbot.create_pdf.themes import get_theme
+from chatbot.create_pdf.code_highlight import CodeBlock
+
+SAMPLE = """# Title
+
+Intro with **bold**, *italic*, `code` and a [link](https://example.com) & <angle> brackets.
+
+## Section
+
+- first
+- second
+  - nested
+
+1. one
+2. two
+
+| Model | Score |
+|-------|-------|
+| A     | 0.9   |
+| B     | 0.8   |
+
+```python
+print("hi")
+```
+
+---
+"""
+
+
+class TestMarkdownToFlowables(unittest.TestCase):
+
+    def setUp(self):
+        self.theme = get_theme({'fontSize': 12})
+
+    def test_block_types(self):
+        elements = markdown_to_flowables(SAMPLE, self.theme)
+        self.assertEqual(
+            [type(e) for e in elements],
+            [Paragraph, Paragraph, Paragraph, ListFlowable, ListFlowable, Table, CodeBlock, HRFlowable]
+        )
+
+    def test_heading_styles(self):
+        title, intro, section = markdown_to_flowables(SAMPLE, self.theme)[:3]
+        self.assertEqual(title.style.fontSize, 12 * 1.4)
+        self.assertEqual(title.style.fontName, 'Helvetica-Bold')
+        self.assertEqual(section.style.fontSize, 12 * 1.2)
+        self.assertIs(intro.style, self.theme.body)
+
+    def test_list_and_table_content_is_not_duplicated(self):
+        elements = markdown_to_flowables(SAMPLE, self.theme)
+        bullets = elements[3]
+        self.assertEqual(len(bullets._flowables), 2)
+        table = elements[5]
+        self.assertEqual(len(table._cellvalues), 3)
+        self.assertIs(table._cellvalues[0][0].style, self.theme.table_header)
+        self.assertIs(table._cellvalues[1][0].style, self.theme.table_cell)
+        self.assertIs(table._cellvalues[2][1].style, self.theme.table_cell)
+        self.assertEqual(sum(isinstance(e, Paragraph) for e in elements), 3)
+
+    def test_builds_pdf(self):
+        buffer = io.BytesIO()
+        SimpleDocTemplate(buffer).build(markdown_to_flowables(SAMPLE, self.theme))
+        self.assertTrue(buffer.getvalue().startswith(b'%PDF'))
+
+    def test_linear_time(self):
+        small = markdown_to_flowables_time(SAMPLE * 50, self.theme)
+        large = markdown_to_flowables_time(SAMPLE * 500, self.theme)
+        self.assertLess(large, small * 20)
+
+
+def markdown_to_flowables_time(content, theme):
+    start = time.perf_counter()
+    markdown_to_flowables(content, theme)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    unittest.main()
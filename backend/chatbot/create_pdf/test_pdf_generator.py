@@ -2,7 +2,7 @@ from reportlab.platypus import Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
 import unittest
 from unittest.mock import patch
-from pdf_generator import (
+from chatbot.create_pdf.pdf_generator import (
     extract_formatting_and_content,
     create_content,
     refine_content_and_structure,
@@ -31,8 +31,8 @@ class TestPDFGenerator(unittest.TestCase):
         """
         self.invalid_input = "Create a document."
 
-    @patch('pdf_generator.ChatPromptTemplate')
-    @patch('pdf_generator.llm_mixtral')
+    @patch('chatbot.create_pdf.pdf_generator.ChatPromptTemplate')
+    @patch('chatbot.create_pdf.pdf_generator.llm_llama')
     def test_extract_formatting_and_content_valid(self, mock_llm, mock_template):
         mock_response = unittest.mock.Mock()
         mock_response.content.strip.return_value = """
@@ -46,8 +46,8 @@ class TestPDFGenerator(unittest.TestCase):
         self.assertIn("Create a technical whitepaper", content_description)
         self.assertIn("Use a white background", formatting_instructions)
 
-    @patch('pdf_generator.ChatPromptTemplate')
-    @patch('pdf_generator.llm_mixtral')
+    @patch('chatbot.create_pdf.pdf_generator.ChatPromptTemplate')
+    @patch('chatbot.create_pdf.pdf_generator.llm_llama')
     def test_extract_formatting_and_content_invalid(self, mock_llm, mock_template):
         mock_response = unittest.mock.Mock()
         mock_response.content.strip.return_value = "Invalid response"
@@ -57,8 +57,8 @@ class TestPDFGenerator(unittest.TestCase):
         with self.assertRaises(ValueError):
             extract_formatting_and_content(self.invalid_input)
 
-    @patch('pdf_generator.ChatPromptTemplate')
-    @patch('pdf_generator.llm_llama')
+    @patch('chatbot.create_pdf.pdf_generator.ChatPromptTemplate')
+    @patch('chatbot.create_pdf.pdf_generator.llm_llama')
     def test_create_content(self, mock_llm, mock_template):
         mock_response = unittest.mock.Mock()
         mock_response.content.strip.return_value = "# Introduction\nThis is the introduction."
@@ -69,8 +69,8 @@ class TestPDFGenerator(unittest.TestCase):
         content = create_content(content_description)
         self.assertIn("# Introduction", content)
 
-    @patch('pdf_generator.ChatPromptTemplate')
-    @patch('pdf_generator.llm_mixtral')
+    @patch('chatbot.create_pdf.pdf_generator.ChatPromptTemplate')
+    @patch('chatbot.create_pdf.pdf_generator.llm_mixtral')
     def test_refine_content_and_structure(self, mock_llm, mock_template):
         mock_response = unittest.mock.Mock()
         mock_response.content.strip.return_value = "# Introduction\nThis is the refined introduction."
@@ -82,8 +82,8 @@ class TestPDFGenerator(unittest.TestCase):
         refined_content = refine_content_and_structure(initial_content, content_description)
         self.assertIn("refined introduction", refined_content)
 
-    @patch('pdf_generator.ChatPromptTemplate')
-    @patch('pdf_generator.llm_mixtral')
+    @patch('chatbot.create_pdf.pdf_generator.ChatPromptTemplate')
+    @patch('chatbot.create_pdf.pdf_generator.llm_mixtral')
     def test_generate_formatting_kwargs(self, mock_llm, mock_template):
         mock_response = unittest.mock.Mock()
         mock_response.content.strip.return_value = '{"fontName": "Helvetica", "fontSize": 12, "backColor": "#FFFFFF"}'
@@ -95,13 +95,11 @@ class TestPDFGenerator(unittest.TestCase):
         self.assertEqual(formatting_kwargs['fontName'], 'Helvetica')
         self.assertEqual(formatting_kwargs['fontSize'], 12)
 
-    @patch('pdf_generator.SimpleDocTemplate')
-    @patch('pdf_generator.markdown2.markdown')
-    @patch('pdf_generator.parse_html')
-    def test_create_pdf(self, mock_parse_html, mock_markdown, mock_doc_template):
+    @patch('chatbot.create_pdf.pdf_generator.SimpleDocTemplate')
+    @patch('chatbot.create_pdf.pdf_generator.markdown_to_flowables')
+    def test_create_pdf(self, mock_markdown_to_flowables, mock_doc_template):
         mock_doc_template.return_value = unittest.mock.Mock()
-        mock_markdown.return_value = "<h1>Introduction</h1>"
-        mock_parse_html.return_value = [Paragraph("Introduction", getSampleStyleSheet()["Normal"])]
+        mock_markdown_to_flowables.return_value = [Paragraph("Introduction", getSampleStyleSheet()["Normal"])]
         
         content = "# Introduction\nThis is the introduction."
         formatting_kwargs = {
@@ -111,7 +109,9 @@ class TestPDFGenerator(unittest.TestCase):
             "textColor": "#000000",
             "header": "Technical Whitepaper"
         }
-        create_pdf(content, formatting_kwargs)
+        storage = unittest.mock.Mock()
+        storage.url.return_value = "/media/test.pdf"
+        self.assertEqual(create_pdf(content, formatting_kwargs, storage=storage), "/media/test.pdf")
         self.assertTrue(mock_doc_template.called)
 
 if __name__ == "__main__":
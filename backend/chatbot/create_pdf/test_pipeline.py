@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import Mock
+from chatbot.create_pdf.pipeline import Checkpoint, Stage, StageGraph
+
+
+def slow(value, delay=0.2):
+    time.sleep(delay)
+    return value
+
+
+class TestStageGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = StageGraph([
+            Stage('split', lambda text: tuple(text.split(',')), inputs=['text'], outputs=['left', 'right']),
+            Stage('left_upper', lambda left: slow(left.upper()), inputs=['left'], outputs=['left_upper']),
+            Stage('right_upper', lambda right: slow(right.upper(), 0.1), inputs=['right'], outputs=['right_upper']),
+            Stage('join', lambda left, right: f"{left}+{right}", inputs=['left_upper', 'right_upper'], outputs=['joined']),
+        ])
+
+    def test_independent_stages_run_concurrently(self):
+        start = time.perf_counter()
+        values, trace = self.graph.run(text="a,b")
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(values['joined'], "A+B")
+        self.assertLess(elapsed, 0.28)
+        self.assertLess(trace.timings['right_upper'].start, trace.timings['left_upper'].end)
+
+    def test_critical_path(self):
+        values, trace = self.graph.run(text="a,b")
+        self.assertEqual(trace.critical_path, ['split', 'left_upper', 'join'])
+        self.assertIn('left_upper', str(trace))
+
+    def test_stage_error_is_raised(self):
+        def fail(left):
+            raise ValueError("bad stage")
+
+        graph = StageGraph([
+            Stage('split', lambda text: tuple(text.split(',')), inputs=['text'], outputs=['left', 'right']),
+            Stage('fail', fail, inputs=['left'], outputs=['never']),
+        ])
+        with self.assertRaises(ValueError):
+            graph.run(text="a,b")
+
+    def test_missing_input(self):
+        with self.assertRaises(ValueError):
+            self.graph.run(other="a,b")
+
+    def test_duplicate_output(self):
+        with self.assertRaises(ValueError):
+            StageGraph([
+                Stage('one', str, inputs=['text'], outputs=['out']),
+                Stage('two', str, inputs=['text'], outputs=['out']),
+            ])
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "run.json")
+        self.first = Mock(return_value="first")
+        self.second = Mock(side_effect=[ValueError("bad"), "second"])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def graph(self, retries=0):
+        return StageGraph([
+            Stage('first', self.first, inputs=['text'], outputs=['a']),
+            Stage('second', self.second, inputs=['a'], outputs=['b'], retries=retries),
+        ])
+
+    def test_stage_retries_on_its_own(self):
+        values, trace = self.graph(retries=1).run(text="x")
+        self.assertEqual(values['b'], "second")
+        self.assertEqual(self.first.call_count, 1)
+        self.assertEqual(trace.timings['second'].attempts, 2)
+
+    def test_retry_resumes_from_failed_stage(self):
+        with self.assertRaises(ValueError):
+            self.graph().run(checkpoint=Checkpoint(self.path), text="x")
+
+        checkpoint = Checkpoint(self.path)
+        self.assertEqual(checkpoint.stages['first']['status'], 'completed')
+        self.assertEqual(checkpoint.stages['second']['status'], 'failed')
+        self.assertIn("bad", checkpoint.stages['second']['error'])
+
+        values, trace = self.graph().run(checkpoint=checkpoint, text="x")
+        self.assertEqual(values['b'], "second")
+        self.assertEqual(self.first.call_count, 1)
+        self.assertEqual(trace.critical_path, ['second'])
+        self.assertEqual(Checkpoint(self.path).values(), {'a': 'first', 'b': 'second'})
+
+
+if __name__ == "__main__":
+    unittest.main()
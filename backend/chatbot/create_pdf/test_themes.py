@@ -0,0 +1,30 @@
+import unittest
+from reportlab.lib import colors
+from chatbot.create_pdf.themes import get_theme
+
+
+class TestThemes(unittest.TestCase):
+
+    def test_same_formatting_reuses_theme(self):
+        first = get_theme({'fontSize': 14, 'backColor': '#000000', 'pageSize': [612, 792]})
+        second = get_theme({'pageSize': [612, 792], 'backColor': '#000000', 'fontSize': 14})
+        self.assertIs(first, second)
+        self.assertIsNot(first, get_theme({'fontSize': 10}))
+
+    def test_styles(self):
+        theme = get_theme({'fontSize': 10, 'textColor': '#FFFFFF', 'backColor': '#000000', 'tableTextColor': '#FF0000'})
+        self.assertEqual(theme.body.fontSize, 10)
+        self.assertEqual(theme.headings['h1'].fontSize, 14)
+        self.assertEqual(theme.headings['h6'].fontName, 'Helvetica-Bold')
+        self.assertEqual(theme.table_header.fontName, 'Helvetica-Bold')
+        self.assertEqual(theme.table_cell.textColor, colors.toColor('#FF0000'))
+        self.assertEqual(theme.table_cell.backColor, colors.toColor('#000000'))
+        self.assertEqual(theme.code.fontSize, 10)
+
+    def test_invalid_color(self):
+        with self.assertRaises(ValueError):
+            get_theme({'textColor': 'not a color'})
+
+
+if __name__ == "__main__":
+    unittest.main()
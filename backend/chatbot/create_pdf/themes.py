@@ -0,0 +1,128 @@
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.units import mm
+from reportlab.lib import colors
+from functools import lru_cache
+from typing import Any, Dict, Hashable, List, Tuple
+
+# Number of compiled themes kept in memory
+THEME_CACHE_SIZE = 64
+
+HEADING_SCALES = {'h1': 1.4, 'h2': 1.2, 'h3': 1.1, 'h4': 1.1, 'h5': 1.1, 'h6': 1.1}
+
+
+class Theme:
+    """
+    Every style used to render a document, compiled once from its formatting arguments.
+
+    Themes are shared between documents with the same formatting, so they must not
+    be modified after they are compiled.
+    """
+
+    def __init__(self, formatting_kwargs: Dict[str, Any]):
+        self.formatting_kwargs = formatting_kwargs
+        styles = getSampleStyleSheet()
+        self.body = ParagraphStyle(
+            name='CustomStyle',
+            parent=styles['Normal'],
+            fontName=formatting_kwargs.get('fontName', 'Helvetica'),
+            fontSize=formatting_kwargs.get('fontSize', 12),
+            leading=formatting_kwargs.get('leading', 1.2 * formatting_kwargs.get('fontSize', 12)),
+            spaceBefore=formatting_kwargs.get('spaceBefore', 6),
+            spaceAfter=formatting_kwargs.get('spaceAfter', 12),
+            leftIndent=formatting_kwargs.get('leftIndent', 0),
+            rightIndent=formatting_kwargs.get('rightIndent', 0),
+            firstLineIndent=formatting_kwargs.get('firstLineIndent', 0),
+            alignment=formatting_kwargs.get('alignment', 0),
+            spaceShrinkage=formatting_kwargs.get('spaceShrinkage', 0.05),
+            textColor=colors.toColor(formatting_kwargs.get('textColor', '#000000')),
+            backColor=colors.toColor(formatting_kwargs.get('backColor', '#FFFFFF'))
+        )
+        self.headings = {tag: self._heading(tag, scale) for tag, scale in HEADING_SCALES.items()}
+        self.code = ParagraphStyle(
+            name='CodeStyle',
+            fontName='Courier',
+            fontSize=self.body.fontSize,
+            leading=12
+        )
+
+        background_color = formatting_kwargs.get('backColor', colors.white)
+        cell_text_color = colors.toColor(formatting_kwargs.get('tableTextColor', self.body.textColor))
+        cell_back_color = colors.toColor(formatting_kwargs.get('tableBackColor', background_color))
+        self.table_cell = self._cell('TableCell', self.body.fontName, cell_text_color, cell_back_color)
+        self.table_header = self._cell('TableHeader', 'Helvetica-Bold', cell_text_color, cell_back_color)
+        self.table_commands: List[Tuple] = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.toColor(formatting_kwargs.get('tableHeaderBackColor', self.body.textColor))),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.toColor(formatting_kwargs.get('tableHeaderTextColor', background_color))),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]
+
+        self.image_width = formatting_kwargs.get('imageWidth', 400)
+        self.image_height = formatting_kwargs.get('imageHeight', 300)
+        self.header = formatting_kwargs.get('header', '')
+
+    def _heading(self, tag: str, scale: float) -> ParagraphStyle:
+        return ParagraphStyle(
+            name=tag.upper(),
+            parent=self.body,
+            fontSize=self.body.fontSize * scale,
+            spaceBefore=self.body.spaceBefore * scale,
+            spaceAfter=self.body.spaceAfter * scale,
+            alignment=TA_CENTER if tag == "h1" else self.body.alignment,
+            textColor=self.body.textColor,
+            fontName='Helvetica-Bold'
+        )
+
+    def _cell(self, name: str, font_name: str, text_color: colors.Color, back_color: colors.Color) -> ParagraphStyle:
+        return ParagraphStyle(
+            name=name,
+            parent=self.body,
+            fontName=font_name,
+            fontSize=self.body.fontSize,
+            leading=self.body.leading,
+            textColor=text_color,
+            backColor=back_color
+        )
+
+    def add_background(self, canvas, doc) -> None:
+        """
+        Adds a background to each page of the PDF document.
+        """
+        canvas.setFillColor(self.body.backColor)
+        canvas.rect(0, 0, doc.pagesize[0], doc.pagesize[1], fill=1)
+        canvas.setFont('Helvetica', 10)
+        canvas.setFillColor(self.body.textColor)
+        canvas.drawRightString(200 * mm, 10 * mm, f"Page {doc.page}")
+        canvas.drawString(10 * mm, doc.pagesize[1] - 10 * mm, self.header)
+
+
+def freeze(value: Any) -> Hashable:
+    """Converts nested lists and dicts into tuples so the value can be used as a cache key."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Hashable) -> Any:
+    return list(value) if isinstance(value, tuple) else value
+
+
+@lru_cache(maxsize=THEME_CACHE_SIZE)
+def _compile_theme(key: Tuple) -> Theme:
+    return Theme({name: thaw(value) for name, value in key})
+
+
+def get_theme(formatting_kwargs: Dict[str, Any]) -> Theme:
+    """
+    Returns the compiled theme for the formatting arguments, reusing a cached
+    theme when the same formatting was seen recently.
+
+    Args:
+        formatting_kwargs (Dict[str, Any]): The formatting arguments for styling the PDF.
+
+    Returns:
+        Theme: The compiled theme.
+    """
+    return _compile_theme(freeze(formatting_kwargs))
@@ -0,0 +1,330 @@
+from contextlib import contextmanager
+from collections import Counter
+from typing import Iterator, List, Optional, Sequence, Set, Tuple
+import threading
+import pymupdf
+import re
+import os
+
+# An operator with the raw bytes of its operands; inline images are kept whole as the operator
+Operation = Tuple[List[bytes], bytes]
+Color = Tuple[float, float, float]
+
+TOKEN_RE = re.compile(rb"""
+    (?P<space>[\x00\t\n\x0c\r ]+)
+  | (?P<comment>%[^\r\n]*)
+  | (?P<open>\[|<<)
+  | (?P<close>\]|>>)
+  | (?P<string>\()
+  | (?P<hex><[^>]*>)
+  | (?P<name>/[^\x00\t\n\x0c\r ()<>\[\]{}/%]*)
+  | (?P<word>[^\x00\t\n\x0c\r ()<>\[\]{}/%]+)
+""", re.VERBOSE)
+STRING_SPECIAL_RE = re.compile(rb"[()\\]")
+INLINE_IMAGE_DATA_RE = re.compile(rb"\bID[\x00\t\n\x0c\r ]")
+INLINE_IMAGE_END_RE = re.compile(rb"[\x00\t\n\x0c\r ]EI(?=[\x00\t\n\x0c\r ]|$)")
+
+OPERAND_WORDS = {b'true', b'false', b'null'}
+FILL_COLOR_OPS = {b'g', b'rg', b'k', b'cs', b'sc', b'scn'}
+PATH_CONSTRUCTION_OPS = {b'm', b'l', b'c', b'v', b'y', b'h', b're'}
+FILL_PAINT_OPS = {b'f', b'F', b'f*', b'B', b'B*', b'b', b'b*'}
+PATH_END_OPS = FILL_PAINT_OPS | {b'S', b's', b'n'}
+# Operand positions measured in text space units, which scale with the font size
+TEXT_SIZE_OPERANDS = {b'Tf': (1,), b'TL': (0,), b'Tc': (0,), b'Tw': (0,), b'"': (0, 1)}
+
+# MuPDF is not thread-safe, so the threads of a process take turns using it, holding the lock
+# around the blocks that call it but not while waiting on other processes. Parallel PDF work
+# comes from processes, which each have their own
+# MuPDF: the job workers (run_pdf_workers), the server's worker processes and pdf2docx's pool.
+MUPDF_LOCK = threading.RLock()
+
+WHITE: Color = (1.0, 1.0, 1.0)
+BLACK: Color = (0.0, 0.0, 0.0)
+
+# A filled rectangle at least this fraction of the page in both directions is a page background
+PAGE_BACKGROUND_COVERAGE = 0.95
+
+
+def hex_to_rgb(hex_color: str) -> Color:
+    """Converts a hex color to an RGB tuple with components between 0 and 1."""
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+@contextmanager
+def atomic_path(path: str) -> Iterator[str]:
+    """
+    Yields a temporary path to write to, and moves it to `path` once the block succeeds,
+    so a reader never sees a partly written file.
+    """
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    with atomic_path(path) as temporary, open(temporary, 'wb') as f:
+        f.write(data)
+
+
+def format_number(value: float) -> bytes:
+    return (f"{value:.4f}".rstrip('0').rstrip('.') or '0').encode()
+
+
+def color_operation(color: Color) -> Operation:
+    return [format_number(c) for c in color], b'rg'
+
+
+def _string_end(data: bytes, start: int) -> int:
+    """Returns the position after the literal string opening at `start`, honoring nesting and escapes."""
+    depth = 0
+    pos = start
+    while True:
+        match = STRING_SPECIAL_RE.search(data, pos)
+        if match is None:
+            raise ValueError(f"Unterminated string starting at byte {start}")
+        char = data[match.start()]
+        if char == 0x5C:  # backslash escapes the next byte
+            pos = match.start() + 2
+            continue
+        depth += 1 if char == 0x28 else -1
+        pos = match.start() + 1
+        if depth == 0:
+            return pos
+
+
+def _inline_image_end(data: bytes, start: int) -> int:
+    """Returns the position after the EI that ends the inline image whose BI ends at `start`."""
+    image_data = INLINE_IMAGE_DATA_RE.search(data, start)
+    end = INLINE_IMAGE_END_RE.search(data, image_data.end()) if image_data else None
+    if end is None:
+        raise ValueError(f"Unterminated inline image starting at byte {start}")
+    return end.end()
+
+
+def parse_content(data: bytes) -> List[Operation]:
+    """
+    Splits a PDF content stream into operations, keeping every operand as its raw bytes.
+
+    Args:
+        data (bytes): The decoded content stream.
+
+    Returns:
+        List[Operation]: (operands, operator) pairs; serializing them reproduces the drawing.
+    """
+    operations: List[Operation] = []
+    operands: List[bytes] = []
+    depth = 0
+    group_start = 0
+    pos = 0
+    size = len(data)
+    while pos < size:
+        match = TOKEN_RE.match(data, pos)
+        if match is None:
+            raise ValueError(f"Unexpected byte {data[pos:pos + 1]!r} at {pos}")
+        kind = match.lastgroup
+        end = _string_end(data, pos) if kind == 'string' else match.end()
+
+        if kind in ('space', 'comment'):
+            pass
+        elif kind == 'open':
+            if depth == 0:
+                group_start = pos
+            depth += 1
+        elif kind == 'close':
+            depth -= 1
+            if depth == 0:
+                operands.append(data[group_start:end])
+        elif depth:
+            pass
+        elif kind == 'word' and data[pos] not in b'+-.0123456789' and match.group() not in OPERAND_WORDS:
+            if match.group() == b'BI':
+                end = _inline_image_end(data, end)
+                operations.append(([], data[pos:end]))
+            else:
+                operations.append((operands, match.group()))
+            operands = []
+        else:
+            operands.append(data[pos:end])
+        pos = end
+
+    if operands:
+        operations.append((operands, b''))
+    return operations
+
+
+def serialize_content(operations: Sequence[Operation]) -> bytes:
+    return b"\n".join(b" ".join(operands + [operator]) if operands else operator for operands, operator in operations)
+
+
+def device_color(operands: List[bytes], operator: bytes) -> Optional[Color]:
+    """Returns the RGB value set by a fill color operator, or None when it is not a device gray, RGB or CMYK color."""
+    try:
+        values = [float(operand) for operand in operands]
+    except ValueError:
+        return None
+    if operator == b'cs':
+        return None
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+    if len(values) == 3:
+        return tuple(values)
+    if len(values) == 4:
+        c, m, y, k = values
+        return (1 - c) * (1 - k), (1 - m) * (1 - k), (1 - y) * (1 - k)
+    return None
+
+
+def same_color(a: Optional[Color], b: Optional[Color]) -> bool:
+    return a is not None and b is not None and all(abs(x - y) < 0.002 for x, y in zip(a, b))
+
+
+class ContentStreamEditor:
+    """
+    Applies text color, background color and font scale to a PDF by rewriting its
+    page content streams, without converting the document to another format.
+
+    - Text: every text object is drawn in the font color; the fill color in effect
+      outside text objects is restored after each one.
+    - Background: a page-sized rectangle is painted beneath the existing content, and
+      rectangles filled with the page's own background color (such as a full-page
+      fill or paragraph backgrounds) are repainted in the new color.
+    - Font scale: font sizes, leading and character and word spacing are scaled, so
+      text grows from where it starts; lines are not reflowed.
+    """
+
+    def __init__(self, font_color=None, bg_color=None, font_size_scale=None):
+        self.font_rgb = hex_to_rgb(font_color) if font_color else None
+        self.bg_rgb = hex_to_rgb(bg_color) if bg_color else None
+        self.scale = float(font_size_scale) if font_size_scale else 1.0
+
+    def rewrite(self, operations: List[Operation], page_width: float, page_height: float) -> List[Operation]:
+        """
+        Rewrites the operations of one content stream.
+
+        Args:
+            operations (List[Operation]): The parsed content stream.
+            page_width (float): Width of the page the stream is drawn on.
+            page_height (float): Height of the page the stream is drawn on.
+
+        Returns:
+            List[Operation]: The rewritten operations.
+        """
+        out: List[Operation] = []
+        in_text = False
+        fill: List[Operation] = []  # operations that restore the current fill color
+        color: Optional[Color] = BLACK
+        saved: List[Tuple[List[Operation], Optional[Color]]] = []
+        page_background = WHITE
+        path_start: Optional[int] = None
+        path_rects: List[List[float]] = []
+
+        for operands, operator in operations:
+            if operator == b'q':
+                saved.append((fill, color))
+            elif operator == b'Q' and saved:
+                fill, color = saved.pop()
+            elif operator in FILL_COLOR_OPS:
+                fill = fill[:1] + [(operands, operator)] if operator in (b'sc', b'scn') else [(operands, operator)]
+                color = device_color(operands, operator)
+                if in_text and self.font_rgb:
+                    continue
+            elif operator == b'BT':
+                in_text = True
+                out.append((operands, operator))
+                if self.font_rgb:
+                    out.append(color_operation(self.font_rgb))
+                continue
+            elif operator == b'ET':
+                in_text = False
+                out.append((operands, operator))
+                if self.font_rgb:
+                    out.extend(fill or [([b'0'], b'g')])
+                continue
+            elif operator in TEXT_SIZE_OPERANDS and self.scale != 1.0:
+                operands = list(operands)
+                for i in TEXT_SIZE_OPERANDS[operator]:
+                    operands[i] = format_number(float(operands[i]) * self.scale)
+            elif operator in PATH_CONSTRUCTION_OPS and self.bg_rgb:
+                if path_start is None:
+                    path_start, path_rects = len(out), []
+                if operator == b're':
+                    path_rects.append([float(operand) for operand in operands])
+                else:
+                    path_rects.append([])
+            elif operator in PATH_END_OPS and path_start is not None:
+                start, path_start = path_start, None
+                if operator in FILL_PAINT_OPS and path_rects and all(path_rects):
+                    covers_page = any(abs(w) >= PAGE_BACKGROUND_COVERAGE * page_width and abs(h) >= PAGE_BACKGROUND_COVERAGE * page_height
+                                      for _, _, w, h in path_rects)
+                    if covers_page and color is not None:
+                        page_background = color
+                    if same_color(color, page_background):
+                        out.insert(start, ([], b'q'))
+                        out.insert(start + 1, color_operation(self.bg_rgb))
+                        out.append((operands, operator))
+                        out.append(([], b'Q'))
+                        continue
+            out.append((operands, operator))
+        return out
+
+    def page_background(self, page: pymupdf.Page) -> List[Operation]:
+        box = page.mediabox
+        rect = [format_number(v) for v in (box.x0, box.y0, box.width, box.height)]
+        return [([], b'q'), color_operation(self.bg_rgb), (rect, b're'), ([], b'f'), ([], b'Q')]
+
+    def edit_document(self, doc: pymupdf.Document, pages: Optional[Sequence[int]] = None) -> None:
+        """
+        Rewrites the content streams of every page, and of the form XObjects they draw, in place.
+
+        Args:
+            doc (pymupdf.Document): The open document.
+            pages (Sequence[int], optional): Indexes of the pages to edit; all pages when None. Forms
+                also drawn on other pages are left alone, so that those pages do not change.
+
+        A content stream shared by several pages is not rewritten in place, which would edit it
+        once per page and change unselected pages too; each page gets its own rewritten copy.
+        """
+        streams = Counter(xref for page in doc for xref in page.get_contents())
+        forms: Set[int] = set()
+        if pages is not None:
+            selected = set(pages)
+            forms = {xref for page in doc if page.number not in selected for xref, *_ in page.get_xobjects()}
+        for page in (doc if pages is None else (doc[number] for number in pages)):
+            width, height = page.mediabox.width, page.mediabox.height
+            operations = self.rewrite(parse_content(page.read_contents()), width, height)
+            if self.bg_rgb:
+                operations = self.page_background(page) + operations
+            content = serialize_content(operations)
+
+            xrefs = page.get_contents()
+            if xrefs and all(streams[xref] == 1 for xref in xrefs):
+                doc.update_stream(xrefs[0], content)
+                for xref in xrefs[1:]:
+                    doc.update_stream(xref, b"")
+            else:
+                xref = doc.get_new_xref()
+                doc.update_object(xref, "<<>>")
+                doc.update_stream(xref, content)
+                page.set_contents(xref)
+
+            for xref, *_ in page.get_xobjects():
+                if xref in forms or doc.xref_get_key(xref, "Subtype")[1] != "/Form":
+                    continue
+                forms.add(xref)
+                doc.update_stream(xref, serialize_content(self.rewrite(parse_content(doc.xref_stream(xref)), width, height)))
+
+    def edit_bytes(self, pdf_bytes: bytes) -> bytes:
+        """Applies the formats to a PDF held in memory and returns the edited PDF."""
+        with MUPDF_LOCK, pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+            self.edit_document(doc)
+            return doc.tobytes(garbage=1, deflate=True)
+
+    def edit(self, input_pdf: str, output_pdf: str) -> None:
+        """Applies the formats to the PDF at `input_pdf` and saves the result to `output_pdf`."""
+        with open(input_pdf, 'rb') as f:
+            write_atomic(output_pdf, self.edit_bytes(f.read()))
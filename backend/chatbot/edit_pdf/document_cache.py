@@ -0,0 +1,141 @@
+from django.conf import settings
+from importlib.metadata import version
+from typing import Any, Dict, Optional
+import threading
+import hashlib
+import sqlite3
+import time
+import os
+
+# Conversions made by another pdf2docx release are not reused
+CONVERTER_VERSION = version('pdf2docx')
+
+
+class DocumentCache:
+    """
+    On-disk cache of whole PDFs converted to Word, keyed by a hash of the PDF's content.
+
+    Only conversions of every page are stored: an edit limited to some pages converts just
+    those pages each time, without the cache. A changed source file hashes to a new key, and storing its conversion drops the
+    entries of earlier versions of the same file. The least recently used entries are
+    evicted once the stored documents exceed `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS document_cache ("
+            "key TEXT PRIMARY KEY, source TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS document_cache_last_used ON document_cache (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS document_cache_source ON document_cache (source)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(pdf_path: str) -> str:
+        """
+        Builds the cache key for a PDF from its content and the converter version.
+
+        Args:
+            pdf_path (str): Path to the PDF.
+
+        Returns:
+            str: A hex SHA-256 digest.
+        """
+        digest = hashlib.sha256(CONVERTER_VERSION.encode('utf-8'))
+        with open(pdf_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached DOCX for the key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM document_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE document_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return bytes(row[0])
+
+    def set(self, key: str, source: str, value: bytes) -> None:
+        """
+        Stores the DOCX converted from `source`, replacing conversions of its earlier
+        versions, and evicts least recently used entries beyond max_bytes.
+        """
+        source = os.path.abspath(source)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM document_cache WHERE source = ? AND key != ?", (source, key))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO document_cache (key, source, value, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, source, sqlite3.Binary(value), len(value), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def invalidate(self, source: str) -> None:
+        """Removes every conversion of the file at `source`."""
+        with self._lock:
+            self._conn.execute("DELETE FROM document_cache WHERE source = ?", (os.path.abspath(source),))
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM document_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM document_cache ORDER BY last_used"):
+            if total - freed <= self.max_bytes:
+                break
+            stale.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM document_cache WHERE key = ?", stale)
+
+    def clear(self) -> None:
+        """Removes every entry and resets the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM document_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters for this process and the current size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM document_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+_document_cache: Optional[DocumentCache] = None
+_document_cache_lock = threading.Lock()
+
+
+def get_document_cache() -> Optional[DocumentCache]:
+    """
+    Returns the process-wide cache, or None when caching is disabled or the
+    Django settings are not configured.
+    """
+    global _document_cache
+    if not settings.configured or not settings.DOCUMENT_CACHE_ENABLED:
+        return None
+    with _document_cache_lock:
+        if _document_cache is None:
+            _document_cache = DocumentCache(settings.DOCUMENT_CACHE_PATH, settings.DOCUMENT_CACHE_MAX_BYTES)
+    return _document_cache
@@ -1,25 +1,66 @@
+from contextvars import ContextVar
 from typing import Dict, Any, Optional
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import StrOutputParser
 from langchain.agents import create_tool_calling_agent, AgentExecutor
 from langchain.tools import tool
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_groq import ChatGroq
-from dotenv import load_dotenv
-from .editor import PDFEditor
+from .edit_plan import EditPlan
+from .editor import count_pages
+from .instructions import parse_instructions
+from .tool_results import memoized, tool_results
+from .document_cache import get_document_cache
+from ..llm import get_chat_model, token_usage
+from ..llm_cache import get_llm_cache
+from ..metrics import EDIT_INSTRUCTION_SECONDS, span
+from ..summaries import summarize
+from ..text_layer import get_text_layer_store
 import os
 from django.conf import settings
 import shutil
+import asyncio
+import time
 
-# settings.configure()
-load_dotenv()
 
-# API key for the LLM service
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    raise ValueError(
-        "GROQ_API_KEY is not set. Please set it as an environment variable."
-    )
+# The plan collecting the agent's edits while it handles an instruction
+_edit_plan: ContextVar[Optional[EditPlan]] = ContextVar('edit_plan', default=None)
+
+
+def edited_path(input_pdf: str) -> str:
+    return input_pdf[:-4] + "_edited.pdf"
+
+
+def apply_plan(plan: EditPlan, input_pdf: str) -> str:
+    """Applies an edit plan to the PDF with the configured engine and returns the edited PDF's path."""
+    with span('edit_apply'):
+        return plan.apply(input_pdf, edited_path(input_pdf), engine=settings.PDF_EDIT_ENGINE,
+                          workers=settings.PDF2DOCX_WORKERS, chunk_pages=settings.PDF2DOCX_CHUNK_PAGES,
+                          cache=get_document_cache(), text_layers=get_text_layer_store())
+
+
+def plan_edit(input_pdf: str, add_operations) -> str:
+    """
+    Adds operations to the plan of the instruction being handled, which applies them once the
+    agent is done; outside an instruction, applies them right away.
+
+    Args:
+        input_pdf (str): The PDF being edited.
+        add_operations (Callable[[EditPlan], Any]): Adds the operations to a plan.
+
+    Returns:
+        str: The path the edited PDF is saved to, or the error to report back to the agent when
+        the operations do not fit the PDF, such as pages it does not have.
+    """
+    plan = _edit_plan.get()
+    if plan is not None:
+        try:
+            add_operations(plan)
+        except ValueError as e:
+            return f"Error: {e}"
+        return edited_path(input_pdf)
+    plan = EditPlan()
+    add_operations(plan)
+    return apply_plan(plan, input_pdf)
 
 
 class FormatArgs(BaseModel):
@@ -37,10 +78,15 @@ class FormatArgs(BaseModel):
         None,
         description="The background color in hexadecimal format (e.g., '#330080').",
     )
+    pages: Optional[str] = Field(
+        None,
+        description="The pages to change, numbered from 1, as a comma-separated list of pages and ranges (e.g., '3' or '1-3, 7'). Null for the whole document.",
+    )
 
 
 @tool
-def generate_formatting_args(instructions: str) -> Dict[str, Any]:
+@memoized
+async def generate_formatting_args(instructions: str) -> Dict[str, Any]:
     """
     Generates formatting arguments based on user instructions for editing PDF as a valid dict.
     Args:
@@ -59,19 +105,30 @@ def generate_formatting_args(instructions: str) -> Dict[str, Any]:
             ("human", "{instructions}"),
         ]
     )
-    runnable = formatting_prompt | llm.with_structured_output(schema=FormatArgs)
-    response = runnable.invoke({"instructions": instructions})
+    prompt_value = formatting_prompt.invoke({"instructions": instructions})
+    cache = get_llm_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(llm, prompt_value.to_string(), FormatArgs.__name__)
+        formatting_args = cache.get(cache_key)
+        if formatting_args is not None:
+            return formatting_args
+
+    with span('formatting_args'):
+        response = await llm.with_structured_output(schema=FormatArgs).ainvoke(prompt_value, config={'callbacks': [token_usage]})
 
     # Filter out None values
     formatting_args = {
         key: value for key, value in response.dict().items() if value is not None
     }
+    if cache is not None:
+        cache.set(cache_key, formatting_args)
     return formatting_args
 
 
 
 @tool
-def edit_pdf(formatting_args: Dict[str, Any], input_pdf: str) -> str:
+async def edit_pdf(formatting_args: Dict[str, Any], input_pdf: str) -> str:
     """
     Edit the PDF based on the given arguments and return the modified pdf content.
     Args:
@@ -80,40 +137,66 @@ def edit_pdf(formatting_args: Dict[str, Any], input_pdf: str) -> str:
     Returns:
         The path to the modified PDF.
     """
-    output_pdf = input_pdf[:-4] + "_edited.pdf"
+    output_pdf = await asyncio.to_thread(plan_edit, input_pdf, lambda plan: plan.add_formatting_args(formatting_args))
     print("----------------------------\n",output_pdf, "\n")
+    return output_pdf
 
-    # Extract formatting arguments
-    text_color = formatting_args.get("text_color")
-    font_scale = formatting_args.get("font_scale", 1.0)
-    background_color = formatting_args.get("background_color")
 
-    # Create PDF editor object and apply custom formats
-    editor = PDFEditor(input_pdf, output_pdf, text_color, background_color, font_scale)
-    editor.apply_custom_formats()
+@tool
+async def replace_text(old_text: str, new_text: str, input_pdf: str, pages: Optional[str] = None) -> str:
+    """
+    Replace every occurrence of a piece of text in the PDF.
+    Args:
+        old_text: The text to replace.
+        new_text: The text to put in its place.
+        input_pdf: The path to the PDF to be edited.
+        pages: The pages to change, such as '3' or '1-3, 7'; leave empty for the whole document.
+    Returns:
+        The path to the modified PDF.
+    """
+    return await asyncio.to_thread(plan_edit, input_pdf, lambda plan: plan.replace_text(old_text, new_text, pages))
 
-    return output_pdf
+
+@tool
+async def append_page(text: str, input_pdf: str) -> str:
+    """
+    Add a page with the given text at the end of the PDF.
+    Args:
+        text: The text of the new page.
+        input_pdf: The path to the PDF to be edited.
+    Returns:
+        The path to the modified PDF.
+    """
+    return await asyncio.to_thread(plan_edit, input_pdf, lambda plan: plan.append_page(text))
 
 
 @tool
-def summarize_text(text: str) -> str:
+@memoized
+async def summarize_text(text: str) -> str:
     """Generate a summary of the provided text."""
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", "You are a highly skilled text summarizer."),
-            ("human", "Summarize the following text: {}".format(text)),
-        ]
-    )
-    runnable = prompt | llm.with_structured_output(schema=str)
-    response = runnable.invoke()
-    summary = response
-    return summary
+    # Long texts are summarized in chunks and the chunk summaries combined
+    return await summarize(text, llm)
+
+
+@memoized
+async def summarize_document(document: str) -> str:
+    """Summarizes the text layer of a document hash, so a PDF is summarized again once it changes."""
+    text = await asyncio.to_thread(lambda: get_text_layer_store().get(document).text())
+    return await summarize(text, llm)
+
+
+@tool
+async def summarize_pdf(input_pdf: str) -> str:
+    """Generate a summary of the text of the PDF at the given path."""
+    def load_text_layer():
+        with open(input_pdf, 'rb') as f:
+            return get_text_layer_store().load(f.read()).document
+
+    return await summarize_document(await asyncio.to_thread(load_text_layer))
 
 
 # Define the chains
-llm = ChatGroq(
-    temperature=0.7, model_name="mixtral-8x7b-32768", groq_api_key=GROQ_API_KEY
-)
+llm = get_chat_model("mixtral-8x7b-32768", 0.7)
 prompt = ChatPromptTemplate.from_messages(
     [
         (
@@ -124,8 +207,11 @@ prompt = ChatPromptTemplate.from_messages(
         ),
         (
             "system",
-            "Instructions can include changes to background color, text color, and font size. "
-            "Apply these changes to the entire PDF. If any attribute is not mentioned in the instructions, leave it unchanged.",
+            "Instructions can include changes to background color, text color, and font size, replacing text and adding pages. "
+            "Apply these changes to the entire PDF unless the instructions name specific pages. "
+            "If any attribute is not mentioned in the instructions, leave it unchanged. "
+            "Edits are collected and applied together once you are done, so call the tools for every change the instructions ask for. "
+            "Call tools that do not need each other's results in the same step; they run at the same time.",
         ),
         (
             "human",
@@ -144,25 +230,67 @@ pdf_editor_tool = edit_pdf
 summary_tool = summarize_text
 
 # Create the agent
-tools = [formatting_tool, pdf_editor_tool, summary_tool]
+tools = [formatting_tool, pdf_editor_tool, replace_text, append_page, summary_tool, summarize_pdf]
 agent = create_tool_calling_agent(llm, tools, prompt)
+# One executor serves every request; it keeps no state between runs. Run asynchronously, it
+# executes the tool calls of one agent step concurrently.
+agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
 
 
 # Function to process the user's request
 def edit_pdf_from_description(input_pdf, instructions):
+    return asyncio.run(aedit_pdf_from_description(input_pdf, instructions))
 
-    i = 3
-    while i > 0:
-        try:
-            agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
-            result = agent_executor.invoke(
-                {"instructions": instructions, "input_pdf": input_pdf}
-            )
-            print("----------------------------\n",result, "\n")
-            break
-        except Exception as e:
-            print(f"Error occurred: {str(e)}")
-            i -= 1
+
+async def aedit_pdf_from_description(input_pdf, instructions):
+    """
+    Edits a PDF as the user's instructions ask, with the rules or the agent.
+
+    Returns:
+        str: The path of the edited PDF, or an empty string when the agent asked for no edit.
+
+    Raises:
+        Exception: The error of the agent's last attempt when every attempt failed; nothing is
+            applied then.
+    """
+    start = time.perf_counter()
+    page_count = await asyncio.to_thread(count_pages, input_pdf)
+    # Common formatting requests are read without the LLM; the agent handles everything else
+    formatting_args = parse_instructions(instructions, page_count) if settings.EDIT_RULES_ENABLED else None
+    if formatting_args is not None:
+        print("----------------------------\n", "Formatting without the agent:", formatting_args, "\n")
+        output_pdf = await asyncio.to_thread(apply_plan, EditPlan(page_count).add_formatting_args(formatting_args), input_pdf)
+        EDIT_INSTRUCTION_SECONDS.observe(time.perf_counter() - start, route='rules')
+        return output_pdf
+
+    # The agent's tool calls only add to the plan; it is applied in one pass when the agent is done.
+    # Each attempt starts a new plan, so a retry does not add the edits of a failed attempt twice,
+    # while the results of the read-only tools are kept across retries. Page selections are checked
+    # as the tools add them, so the agent is told about pages the PDF does not have.
+    with tool_results():
+        i = 3
+        while i > 0:
+            plan = EditPlan(page_count)
+            token = _edit_plan.set(plan)
+            try:
+                with span('edit_agent'):
+                    result = await agent_executor.ainvoke(
+                        {"instructions": instructions, "input_pdf": input_pdf},
+                        config={'callbacks': [token_usage]}
+                    )
+                print("----------------------------\n",result, "\n")
+                break
+            except Exception as e:
+                print(f"Error occurred: {str(e)}")
+                i -= 1
+                if i == 0:
+                    # The edits of a failed attempt are never applied
+                    raise
+            finally:
+                _edit_plan.reset(token)
+    output_pdf = await asyncio.to_thread(apply_plan, plan, input_pdf) if not plan.is_empty() else ""
+
+    EDIT_INSTRUCTION_SECONDS.observe(time.perf_counter() - start, route='agent')
 
     # Define the source and destination paths
     # current_directory = os.getcwd()
@@ -177,7 +305,7 @@ def edit_pdf_from_description(input_pdf, instructions):
     # Move the file
     # shutil.move(source_path, destination_path)
 
-    return input_pdf[:-4] + "_edited.pdf"
+    return output_pdf
 
 
 # def main():
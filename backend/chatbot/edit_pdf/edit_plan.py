@@ -0,0 +1,139 @@
+from typing import Any, Dict, List, Optional, Tuple
+from .editor import PDFEditor, parse_pages
+
+OPERATIONS = ('text_color', 'background_color', 'font_scale', 'replace_text', 'append_page')
+
+
+class EditPlan:
+    """
+    Edits collected from one or more instructions and applied to a PDF in a single pass,
+    so the document is converted once however many edits were asked for.
+
+    Colors set later win over earlier ones, font scales multiply, and text replacements and
+    appended pages are applied in the order they were added.
+
+    Operations can be limited to a page selection such as "1-3, 7". The document is then
+    edited once per distinct selection: the whole-document edits first, then each selection in
+    the order it first appears, so edits of a few pages win over whole-document ones.
+    """
+
+    def __init__(self, page_count: Optional[int] = None):
+        # Pages of the PDF the plan is for; when known, page selections are checked as they are added
+        self.page_count = page_count
+        self.operations: List[Tuple[str, Dict[str, Any]]] = []
+
+    def add(self, operation: str, **params) -> 'EditPlan':
+        """
+        Adds an operation to the plan.
+
+        Args:
+            operation (str): One of OPERATIONS.
+            **params: The operation's parameters: `color`, `scale`, `old` and `new`, or `text`, and
+                optionally the `pages` to limit it to. Appended pages ignore `pages`.
+
+        Returns:
+            EditPlan: The plan, so calls can be chained.
+
+        Raises:
+            ValueError: If the operation is unknown, or the pages are not a selection of the PDF's pages.
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown edit operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+        pages = params.pop('pages', None)
+        params['pages'] = None if operation == 'append_page' or pages is None else str(pages).replace(' ', '')
+        if params['pages'] is not None and self.page_count is not None:
+            parse_pages(params['pages'], self.page_count)
+        self.operations.append((operation, params))
+        return self
+
+    def text_color(self, color: str, pages: Optional[str] = None) -> 'EditPlan':
+        return self.add('text_color', color=color, pages=pages)
+
+    def background_color(self, color: str, pages: Optional[str] = None) -> 'EditPlan':
+        return self.add('background_color', color=color, pages=pages)
+
+    def font_scale(self, scale: float, pages: Optional[str] = None) -> 'EditPlan':
+        return self.add('font_scale', scale=float(scale), pages=pages)
+
+    def replace_text(self, old: str, new: str, pages: Optional[str] = None) -> 'EditPlan':
+        return self.add('replace_text', old=old, new=new, pages=pages)
+
+    def append_page(self, text: str) -> 'EditPlan':
+        return self.add('append_page', text=text)
+
+    def add_formatting_args(self, formatting_args: Dict[str, Any]) -> 'EditPlan':
+        """Adds the operations described by the formatting arguments the agent extracts from an instruction."""
+        pages = formatting_args.get('pages')
+        if pages is not None and self.page_count is not None:
+            # Checked first, so a bad selection adds none of the operations
+            parse_pages(str(pages).replace(' ', ''), self.page_count)
+        if formatting_args.get('text_color'):
+            self.text_color(formatting_args['text_color'], pages)
+        if formatting_args.get('background_color'):
+            self.background_color(formatting_args['background_color'], pages)
+        if formatting_args.get('font_scale') not in (None, 1, 1.0):
+            self.font_scale(formatting_args['font_scale'], pages)
+        return self
+
+    def is_empty(self) -> bool:
+        return not self.operations
+
+    def selections(self) -> List[Optional[str]]:
+        """Returns the distinct page selections of the operations in the order they are applied, None for the whole document."""
+        selections = list(dict.fromkeys(params['pages'] for _, params in self.operations))
+        return sorted(selections, key=lambda pages: pages is not None)
+
+    def resolve(self, pages: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Combines the operations limited to one page selection into the edits to apply.
+
+        Args:
+            pages (str, optional): The page selection; None for the operations on the whole document.
+
+        Returns:
+            Dict[str, Any]: `text_color`, `background_color` and `font_scale`, which are None when
+            not set, plus the `replacements` and `appended_pages` lists.
+        """
+        resolved: Dict[str, Any] = {'text_color': None, 'background_color': None, 'font_scale': None,
+                                    'replacements': [], 'appended_pages': []}
+        for operation, params in self.operations:
+            if params['pages'] != pages:
+                continue
+            if operation in ('text_color', 'background_color'):
+                resolved[operation] = params['color']
+            elif operation == 'font_scale':
+                resolved['font_scale'] = (resolved['font_scale'] or 1.0) * params['scale']
+            elif operation == 'replace_text':
+                resolved['replacements'].append((params['old'], params['new']))
+            else:
+                resolved['appended_pages'].append(params['text'])
+        return resolved
+
+    def apply(self, input_pdf: str, output_pdf: str, engine: str = "native", workers: int = 1, chunk_pages: int = 8,
+              cache: Optional[Any] = None, text_layers: Optional[Any] = None) -> str:
+        """
+        Applies the whole plan to a PDF.
+
+        Args:
+            input_pdf (str): Path to the PDF to edit.
+            output_pdf (str): Where to save the edited PDF.
+            engine (str): "native" or "docx", as for PDFEditor.
+            workers (int): Processes converting the PDF to Word with the docx engine.
+            chunk_pages (int): Pages per conversion task with the docx engine.
+            cache (DocumentCache, optional): Cache of whole-document PDF-to-Word conversions.
+            text_layers (TextLayerStore, optional): Extracted text of PDFs, used to find the text to
+                replace when the input PDF's text was extracted before.
+
+        Returns:
+            str: The path to the edited PDF.
+        """
+        source = input_pdf
+        for pages in self.selections():
+            edits = self.resolve(pages)
+            # Only the input has a text layer; each later pass edits the output of the one before
+            text_layer = text_layers.find(source) if text_layers is not None and edits['replacements'] and source == input_pdf else None
+            PDFEditor(source, output_pdf, edits['text_color'], edits['background_color'], edits['font_scale'], engine=engine,
+                      workers=workers, chunk_pages=chunk_pages, cache=cache, replacements=edits['replacements'],
+                      appended_pages=edits['appended_pages'], pages=pages, text_layer=text_layer).apply_custom_formats()
+            source = output_pdf
+        return output_pdf
@@ -1,32 +1,229 @@
 import subprocess
+import shutil
+import multiprocessing
+import tempfile
+import pymupdf
+import re
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pdf2docx import Converter
 from docx2pdf import convert
 from docx import Document
 from docx.text.paragraph import Paragraph
+from docx.text.run import Run
 from docx.shape import InlineShape
 from docx.table import Table
 from docx.shared import Pt, RGBColor, Inches
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.parts.hdrftr import FooterPart, HeaderPart
+from ..metrics import span
+from .content_stream import MUPDF_LOCK, ContentStreamEditor, atomic_path, write_atomic
+
+RUN_TAG = qn('w:r')
+TEXT_TAG = qn('w:t')
+CELL_TAG = qn('w:tc')
+SHADING_TAG = qn('w:shd')
+# Elements that follow w:shd in a w:tcPr
+TC_PR_AFTER_SHADING = ('w:noWrap', 'w:tcMar', 'w:textDirection', 'w:tcFitText', 'w:vAlign', 'w:hideMark',
+                       'w:headers', 'w:cellIns', 'w:cellDel', 'w:cellMerge', 'w:tcPrChange')
+HYPERLINK_TAG = qn('w:hyperlink')
+INSTR_TEXT_TAG = qn('w:instrText')
+HYPERLINK_FIELD_RE = re.compile(r'HYPERLINK\s+"([^"]*)"')
+PAGE_RANGE_RE = re.compile(r'^(\d+)(?:\s*-\s*(\d*))?$')
+
+
+def parse_pages(selection, page_count):
+    """
+    Turns a page selection into page indexes.
+
+    Args:
+        selection (str): Page numbers counted from 1, such as "3", "1-3, 7" or "5-" for page 5 to the end.
+            None selects every page.
+        page_count (int): Number of pages in the document; pages past the end are ignored.
+
+    Returns:
+        list: Sorted indexes of the selected pages, counted from 0.
+    """
+    if selection is None:
+        return list(range(page_count))
+    pages = set()
+    for part in str(selection).split(','):
+        match = PAGE_RANGE_RE.match(part.strip())
+        if match is None or int(match.group(1)) < 1:
+            raise ValueError(f"Invalid page selection {selection!r}; use page numbers and ranges such as '1-3, 7'")
+        first = int(match.group(1))
+        last = first if match.group(2) is None else int(match.group(2) or page_count)
+        if match.group(2) and last < first:
+            raise ValueError(f"Invalid page range {part.strip()!r} in {selection!r}; the first page must come before the last")
+        pages.update(range(first - 1, min(last, page_count)))
+    if not pages:
+        raise ValueError(f"Page selection {selection!r} matches none of the document's {page_count} pages")
+    return sorted(pages)
+
+
+def count_pages(pdf_path):
+    """Returns the number of pages of the PDF at `pdf_path`."""
+    with MUPDF_LOCK, pymupdf.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def page_ranges(pages):
+    """Groups sorted page indexes into (first, last) runs of consecutive pages."""
+    ranges = []
+    for page in pages:
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return [tuple(r) for r in ranges]
+
+
+def replace_text_in_pdf(doc, replacements, pages=None, text_layer=None):
+    """
+    Replaces text on the pages of an open PDF.
+
+    The old text is redacted without touching images or drawings, and the new text is written
+    in Helvetica at the size and color of the text it replaces, starting where the old text
+    started. Following text on the line is not moved.
+
+    Args:
+        doc (pymupdf.Document): The open document.
+        replacements (list): (old, new) pairs, applied in order.
+        pages (list, optional): Indexes of the pages to change; all pages when None.
+        text_layer (TextLayer, optional): The text of the document as opened, used to skip the
+            pages that do not contain the text to replace without searching them.
+    """
+    if not replacements:
+        return
+    numbers = range(doc.page_count) if pages is None else pages
+    if text_layer is not None:
+        # A page only changes if it contains one of the texts to replace to begin with
+        candidates = set()
+        for old, _ in replacements:
+            candidates.update(text_layer.pages_containing(old))
+        numbers = [number for number in numbers if number in candidates]
+    for page in (doc[number] for number in numbers):
+        for old, new in replacements:
+            hits = page.search_for(old)
+            if not hits:
+                continue
+            spans = [span for block in page.get_text('dict')['blocks'] for line in block.get('lines', []) for span in line['spans']]
+            insertions = []
+            for rect in hits:
+                span = next((span for span in spans if pymupdf.Rect(span['bbox']).intersects(rect)), None)
+                size, color, baseline = (span['size'], span['color'], span['origin'][1]) if span else (rect.height / 1.2, 0, rect.y1)
+                insertions.append(((rect.x0, baseline), size, pymupdf.sRGB_to_pdf(color)))
+                page.add_redact_annot(rect, fill=False)
+            page.apply_redactions(images=pymupdf.PDF_REDACT_IMAGE_NONE, graphics=pymupdf.PDF_REDACT_LINE_ART_NONE)
+            for point, size, color in insertions:
+                page.insert_text(point, new, fontsize=size, fontname='helv', color=color)
+
+
+def append_pages_to_pdf(doc, pages):
+    """Appends a page the size of the last one for each text in `pages`, with the text set in 12pt Helvetica."""
+    for text in pages:
+        size = doc[-1].rect if doc.page_count else pymupdf.paper_rect('a4')
+        page = doc.new_page(width=size.width, height=size.height)
+        page.insert_textbox(page.rect + (72, 72, -72, -72), text, fontsize=12, fontname='helv')
+
+
+def replace_text_in_docx(doc, replacements):
+    """Replaces text in the body, headers and footers of a Word document, within single runs."""
+    roots = [doc.element.body] + [part.element for part in doc.part.package.iter_parts()
+                                  if isinstance(part, (HeaderPart, FooterPart))]
+    for root in roots:
+        for t in root.iter(TEXT_TAG):
+            for old, new in replacements:
+                if t.text and old in t.text:
+                    t.text = t.text.replace(old, new)
+
+
+def append_pages_to_docx(doc, pages):
+    """Appends each text in `pages` to a Word document, starting on a new page."""
+    for text in pages:
+        doc.add_page_break()
+        for line in text.split('\n'):
+            doc.add_paragraph(line)
+
+
+def parse_page_chunk(pdf_path, pages):
+    """Parses the layout of some pages of a PDF, in a worker process, and returns it in pdf2docx's stored format."""
+    cv = Converter(pdf_path)
+    try:
+        return cv.parse(pages=pages, **cv.default_settings).store()
+    finally:
+        cv.close()
 
 
 class PDFConverter:
-    def __init__(self, pdf_path, docx_path, modified_docx):
+    def __init__(self, pdf_path, docx_path, modified_docx, workers=1, chunk_pages=8, cache=None, pages=None):
         self.pdf_path = pdf_path
         self.docx_path = docx_path
         self.modified_docx = modified_docx
+        self.workers = workers
+        self.chunk_pages = chunk_pages
+        self.cache = cache
+        self.pages = pages  # indexes of the pages to convert, all when None
+
+    def page_chunks(self, page_count):
+        """Splits the indexes of the pages to convert into consecutive chunks of at most `chunk_pages` pages."""
+        pages = list(range(page_count)) if self.pages is None else [page for page in self.pages if page < page_count]
+        return [pages[start:start + self.chunk_pages] for start in range(0, len(pages), self.chunk_pages)]
 
     def pdf_to_word(self):
-        """Converts PDF to Word document."""
-        cv = Converter(self.pdf_path)
-        cv.convert(self.docx_path, start=0, end=None)
-        cv.close()
+        """
+        Converts PDF to Word document, reusing the cached conversion of the same PDF when there is one.
+
+        Only whole documents are cached; converting a selection of pages always runs pdf2docx.
+        """
+        if self.cache is None or self.pages is not None:
+            self.convert_pdf_to_word()
+            return
+
+        key = self.cache.make_key(self.pdf_path)
+        docx = self.cache.get(key)
+        if docx is not None:
+            with open(self.docx_path, 'wb') as f:
+                f.write(docx)
+            return
+        self.convert_pdf_to_word()
+        with open(self.docx_path, 'rb') as f:
+            self.cache.set(key, self.pdf_path, f.read())
+
+    def convert_pdf_to_word(self):
+        """Converts PDF to Word document, parsing its pages in other processes, several chunks at a time when `workers` allows."""
+        # pdf2docx reads the PDF with MuPDF
+        with span('pdf2docx'):
+            with MUPDF_LOCK:
+                cv = Converter(self.pdf_path)
+            try:
+                with MUPDF_LOCK:
+                    chunks = self.page_chunks(len(cv.fitz_doc))
+
+                # The chunks are parsed by the MuPDF of other processes, even when there is only
+                # one, so the lock is not held meanwhile and other threads of this one can use
+                # MuPDF. Spawned workers do not inherit locks held by other threads of this process.
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=max(1, min(self.workers, len(chunks))), mp_context=context) as pool:
+                    parsed_chunks = list(pool.map(parse_page_chunk, repeat(self.pdf_path), chunks))
+
+                # Pages are written in page order, whichever chunk finished first
+                with MUPDF_LOCK:
+                    for parsed in parsed_chunks:
+                        cv.restore(parsed)
+                    cv.make_docx(self.docx_path, **cv.default_settings)
+            finally:
+                with MUPDF_LOCK:
+                    cv.close()
 
     def word_to_pdf(self, output_path):
         """Converts Word document to PDF."""
-        convert(self.modified_docx, output_path)
+        with span('docx2pdf'):
+            convert(self.modified_docx, output_path)
 
 
 class DocumentFormatter:
@@ -54,8 +251,14 @@ class DocumentFormatter:
         if run_format['underline']:
             run.underline = True
         run.font.name = run_format['font_name']
-        if 'HYPERLINK' in run._r.xml:
-            run.hyperlink.target = run_format['hyperlink']  # Preserving hyperlink
+
+    def link_run(self, run, url):
+        """Wraps the run in a hyperlink to `url`."""
+        r_id = run.part.relate_to(url, RT.HYPERLINK, is_external=True)
+        hyperlink = OxmlElement('w:hyperlink')
+        hyperlink.set(qn('r:id'), r_id)
+        run._r.addprevious(hyperlink)
+        hyperlink.append(run._r)
 
     def apply_custom_formats_to_word(self, content, headers, footers):
         """Applies custom formats to the Word document content and returns a new Document object."""
@@ -89,7 +292,7 @@ class DocumentFormatter:
                     run = new_para.add_run(run_text)
                     self.set_run_format(run, run_format, font_color_rgb)
                     if run_format['hyperlink']:
-                        run.hyperlink.target = run_format['hyperlink']  # Preserving hyperlink
+                        self.link_run(run, run_format['hyperlink'])  # Preserving hyperlink
             elif item['type'] == 'table':
                 self.add_table_to_doc(new_doc, item['content'], font_color_rgb)
             elif item['type'] == 'image':
@@ -150,7 +353,7 @@ class DocumentFormatter:
                         run = new_para.add_run(para_text)
                         self.set_run_format(run, para_format, font_color_rgb)
                         if para_format['hyperlink']:
-                            run.hyperlink.target = para_format['hyperlink']  # Preserving hyperlink
+                            self.link_run(run, para_format['hyperlink'])  # Preserving hyperlink
                         new_para.paragraph_format.space_after = Pt(para_format['space_after']) if para_format['space_after'] else None
                         new_para.paragraph_format.space_before = Pt(para_format['space_before']) if para_format['space_before'] else None
                         new_para.paragraph_format.left_indent = Pt(para_format['left_indent']) if para_format['left_indent'] else None
@@ -162,39 +365,71 @@ class DocumentFormatter:
                 cell.paragraphs[0].paragraph_format.right_indent = Pt(cell_data['margin_right'])
 
     def apply_formats_in_place(self, doc):
-        """Applies font color and background color in place to the existing document."""
-        if self.font_color:
-            font_color_rgb = RGBColor(*[int(c*255) for c in self.hex_to_rgb(self.font_color)])
+        """
+        Applies font color and background color in place to the existing document.
 
-        if self.bg_color:
-            bg_color_hex = self.bg_color.lstrip('#')
+        Runs and table cells are recolored in one pass over the XML of the body and of
+        every header and footer, which also reaches nested tables and hyperlinked runs.
+        """
+        font_color_rgb = RGBColor(*[int(c*255) for c in self.hex_to_rgb(self.font_color)]) if self.font_color else None
+        bg_color_hex = self.bg_color.lstrip('#') if self.bg_color else None
+
+        if bg_color_hex:
             bg = OxmlElement('w:background')
             bg.set(qn('w:color'), bg_color_hex)
             doc.element.insert(0, bg)
             shd1 = OxmlElement('w:displayBackgroundShape')
             doc.settings.element.insert(0, shd1)
 
-        for para in doc.paragraphs:
-            for run in para.runs:
-                if self.font_color:
-                    run.font.color.rgb = font_color_rgb
-
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    tc_pr = cell._element.get_or_add_tcPr()
-                    shd = OxmlElement('w:shd')
-                    shd.set(qn('w:fill'), bg_color_hex)
-                    tc_pr.append(shd)  # Apply bg color
-                    for para in cell.paragraphs:
-                        for run in para.runs:
-                            if self.font_color:
-                                run.font.color.rgb = font_color_rgb
+        tags = [tag for tag, value in ((RUN_TAG, font_color_rgb), (CELL_TAG, bg_color_hex)) if value]
+        if not tags:
+            return
+        roots = [doc.element.body] + [part.element for part in doc.part.package.iter_parts()
+                                      if isinstance(part, (HeaderPart, FooterPart))]
+        for root in roots:
+            for element in list(root.iter(*tags)):
+                if element.tag == RUN_TAG:
+                    color = element.get_or_add_rPr().get_or_add_color()
+                    color.val = font_color_rgb
+                    color.themeColor = None
+                else:
+                    self.shade_cell(element, bg_color_hex)
+
+    def shade_cell(self, tc, color_hex):
+        """Sets the fill of a `w:tc` element, replacing any shading it already has."""
+        tc_pr = tc.get_or_add_tcPr()
+        shd = tc_pr.find(SHADING_TAG)
+        if shd is None:
+            shd = OxmlElement('w:shd')
+            tc_pr.insert_element_before(shd, *TC_PR_AFTER_SHADING)
+        shd.set(qn('w:val'), 'clear')
+        shd.set(qn('w:fill'), color_hex)
+
+
+class RunFormat:
+    """
+    The formatting of a run, read like the dict it replaces (`run_format['bold']`).
+
+    Records are shared by every run with the same formatting, so they must not be modified.
+    """
+    __slots__ = ('size', 'bold', 'italic', 'underline', 'font_name',
+                 'space_after', 'space_before', 'left_indent', 'right_indent', 'hyperlink')
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"RunFormat({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
 
 
 class ContentExtractor:
     def __init__(self, doc):
         self.doc = doc
+        self._formats = {}  # field values -> the shared RunFormat for them
 
     def extract_content(self):
         """Extracts the content from the document including paragraphs, tables, and images."""
@@ -246,22 +481,34 @@ class ContentExtractor:
     def extract_paragraph(self, para):
         """Extracts paragraph content and formatting."""
         para_content = []
-        for run in para.runs:
-            run_format = {
-                'size': run.font.size.pt if run.font.size else None,
-                'bold': run.bold,
-                'italic': run.italic,
-                'underline': run.underline,
-                'font_name': run.font.name,
-                'space_after': para.paragraph_format.space_after.pt if para.paragraph_format.space_after else None,
-                'space_before': para.paragraph_format.space_before.pt if para.paragraph_format.space_before else None,
-                'left_indent': para.paragraph_format.left_indent.pt if para.paragraph_format.left_indent else None,
-                'right_indent': para.paragraph_format.right_indent.pt if para.paragraph_format.right_indent else None,
-                'hyperlink': run.hyperlink.target if 'HYPERLINK' in run._r.xml else None  # Extracting hyperlink
-            }
+        paragraph_format = para.paragraph_format
+        spacing = tuple(length.pt if length else None for length in (
+            paragraph_format.space_after, paragraph_format.space_before,
+            paragraph_format.left_indent, paragraph_format.right_indent))
+        for r in para._p.xpath('./w:r | ./w:hyperlink/w:r'):  # runs inside hyperlinks too, in document order
+            run = Run(r, para)
+            font = run.font
+            size = font.size
+            key = (size.pt if size else None, font.bold, font.italic, font.underline, font.name) + spacing \
+                + (self.extract_hyperlink(para, r),)
+            run_format = self._formats.get(key)
+            if run_format is None:
+                run_format = self._formats[key] = RunFormat(*key)
             para_content.append((run.text, run_format))
         return {'type': 'paragraph', 'content': para_content}
 
+    def extract_hyperlink(self, para, r):
+        """Returns the target of the hyperlink the run element belongs to, or None."""
+        parent = r.getparent()
+        if parent is not None and parent.tag == HYPERLINK_TAG:
+            r_id = parent.get(qn('r:id'))
+            return para.part.rels[r_id].target_ref if r_id else None
+        for instr in r.iterchildren(INSTR_TEXT_TAG):
+            match = HYPERLINK_FIELD_RE.search(instr.text or '')
+            if match:
+                return match.group(1)
+        return None
+
     def extract_table(self, table):
         """Extracts table content and formatting."""
         table_data = []
@@ -294,22 +541,110 @@ class ContentExtractor:
 
 
 class PDFEditor:
-    def __init__(self, pdf_path, output_path, font_color=None, bg_color=None, font_size_scale=None):
+    def __init__(self, pdf_path, output_path, font_color=None, bg_color=None, font_size_scale=None, engine="native",
+                 workers=1, chunk_pages=8, cache=None, replacements=None, appended_pages=None, pages=None, text_layer=None):
         self.pdf_path = pdf_path
         self.output_path = output_path
         self.font_color = font_color
         self.bg_color = bg_color
         self.font_size_scale = font_size_scale
+        self.engine = engine
+        self.workers = workers
+        self.chunk_pages = chunk_pages
+        self.cache = cache
+        self.replacements = replacements or []
+        self.appended_pages = appended_pages or []
+        self.pages = pages  # page selection such as "1-3, 7", see parse_pages; the whole document when None
+        self.text_layer = text_layer  # text of the PDF at pdf_path, for finding the text to replace
 
     def apply_custom_formats(self):
-        """Main function to apply custom formats to the PDF and save the output."""
-        intermediate_docx = "intermediate.docx"
-        modified_docx = "modified.docx"
+        """
+        Main function to apply custom formats to the PDF and save the output.
+
+        Font size changes always go through Word, which reflows the text; the native engine
+        would only scale the glyphs where they are, so lines would overlap and run off the page.
+        """
+        if self.engine == "native" and self.font_size_scale in (None, 1, 1.0):
+            # Rewrite the page content streams directly, keeping the layout of the original PDF
+            with span('recolor'):
+                self.apply_custom_formats_natively()
+            return
+        self.apply_custom_formats_via_docx()
+
+    def apply_custom_formats_natively(self):
+        """Applies every edit to the PDF in one pass over the open document."""
+        editor = ContentStreamEditor(self.font_color, self.bg_color, self.font_size_scale)
+        if self.pages is None:
+            with open(self.pdf_path, 'rb') as f:
+                data = f.read()
+            with MUPDF_LOCK, pymupdf.open(stream=data, filetype="pdf") as doc:
+                replace_text_in_pdf(doc, self.replacements, text_layer=self.text_layer)
+                append_pages_to_pdf(doc, self.appended_pages)
+                # Formats last, so replaced text and appended pages get them too
+                editor.edit_document(doc)
+                edited = doc.tobytes(garbage=1, deflate=True)
+            write_atomic(self.output_path, edited)
+            return
+
+        # Only the selected pages are rewritten, and saved as an update appended to a copy of
+        # the original file, so the other pages keep their bytes
+        with atomic_path(self.output_path) as temporary:
+            shutil.copyfile(self.pdf_path, temporary)
+            with MUPDF_LOCK, pymupdf.open(temporary) as doc:
+                pages = parse_pages(self.pages, doc.page_count)
+                replace_text_in_pdf(doc, self.replacements, pages, self.text_layer)
+                append_pages_to_pdf(doc, self.appended_pages)
+                editor.edit_document(doc, pages)
+                doc.saveIncr()
+
+    def apply_custom_formats_via_docx(self):
+        """Round-trips the PDF through Word to apply the formats, reflowing the text when the font size changes."""
+        # Each edit gets its own workspace, removed even if the edit fails, so edits can run concurrently
+        with tempfile.TemporaryDirectory(prefix="pdf-edit-") as workspace:
+            if self.pages is None:
+                self.round_trip(workspace, None, self.appended_pages, self.output_path)
+                return
+
+            # Each run of consecutive selected pages goes through Word on its own and replaces
+            # those pages; the other pages are kept as they are
+            with MUPDF_LOCK, pymupdf.open(self.pdf_path) as doc:
+                ranges = page_ranges(parse_pages(self.pages, doc.page_count))
+            rendered = []
+            for first, last in ranges:
+                range_workspace = os.path.join(workspace, f"pages_{first}_{last}")
+                os.mkdir(range_workspace)
+                rendered.append(os.path.join(range_workspace, "rendered.pdf"))
+                self.round_trip(range_workspace, list(range(first, last + 1)), [], rendered[-1])
+
+            with atomic_path(self.output_path) as temporary:
+                shutil.copyfile(self.pdf_path, temporary)
+                with MUPDF_LOCK, pymupdf.open(temporary) as doc:
+                    for (first, last), path in reversed(list(zip(ranges, rendered))):
+                        doc.delete_pages(first, last)
+                        with pymupdf.open(path) as part:
+                            doc.insert_pdf(part, start_at=first)
+                    append_pages_to_pdf(doc, self.appended_pages)
+                    doc.saveIncr()
+
+    def round_trip(self, workspace, pages, appended_pages, output_path):
+        """
+        Converts pages of the PDF to Word, applies the edits there and converts the result back.
+
+        Args:
+            workspace (str): Directory for the intermediate documents.
+            pages (list): Indexes of the pages to convert; all pages when None.
+            appended_pages (list): Texts of the pages to add at the end of the document.
+            output_path (str): Where to save the converted PDF.
+        """
+        intermediate_docx = os.path.join(workspace, "intermediate.docx")
+        modified_docx = os.path.join(workspace, "modified.docx")
 
         # Convert PDF to Word
-        converter = PDFConverter(self.pdf_path, intermediate_docx, modified_docx)
+        converter = PDFConverter(self.pdf_path, intermediate_docx, modified_docx, self.workers, self.chunk_pages, self.cache, pages)
         converter.pdf_to_word()
         doc = Document(intermediate_docx)
+        replace_text_in_docx(doc, self.replacements)
+        append_pages_to_docx(doc, appended_pages)
 
         # Check if we need to create a new document or modify in place
         if self.font_size_scale is not None and float(self.font_size_scale) != 1.0:
@@ -326,11 +661,7 @@ class PDFEditor:
             doc.save(modified_docx)
 
         # Convert modified DOCX to PDF
-        converter.word_to_pdf(self.output_path)
-
-        # Delete intermediate DOCX files
-        os.remove(intermediate_docx)
-        os.remove(modified_docx)
+        converter.word_to_pdf(output_path)
 
 
 # if __name__ == "__main__":
@@ -0,0 +1,186 @@
+from typing import Any, Dict, List, Optional, Tuple
+from .editor import parse_pages
+import re
+
+COLOR_NAMES = {
+    'black': '#000000', 'white': '#FFFFFF', 'red': '#FF0000', 'green': '#008000', 'blue': '#0000FF',
+    'yellow': '#FFFF00', 'orange': '#FFA500', 'purple': '#800080', 'pink': '#FFC0CB', 'gray': '#808080',
+    'grey': '#808080', 'brown': '#A52A2A', 'cyan': '#00FFFF', 'magenta': '#FF00FF', 'navy': '#000080',
+    'teal': '#008080', 'maroon': '#800000', 'olive': '#808000', 'lime': '#00FF00', 'silver': '#C0C0C0',
+    'gold': '#FFD700', 'beige': '#F5F5DC', 'ivory': '#FFFFF0', 'indigo': '#4B0082', 'violet': '#EE82EE',
+    'lavender': '#E6E6FA', 'cream': '#FFFDD0', 'dark blue': '#00008B', 'dark green': '#006400',
+    'dark red': '#8B0000', 'dark gray': '#A9A9A9', 'dark grey': '#A9A9A9', 'light blue': '#ADD8E6',
+    'light green': '#90EE90', 'light gray': '#D3D3D3', 'light grey': '#D3D3D3', 'light yellow': '#FFFFE0',
+}
+TEXT_WORDS = {'text', 'font', 'fonts', 'letters', 'writing', 'words', 'foreground'}
+BACKGROUND_WORDS = {'background', 'backgrounds', 'bg', 'backdrop'}
+LARGER_WORDS = {'bigger', 'larger', 'increase', 'enlarge', 'grow', 'up', 'raise'}
+SMALLER_WORDS = {'smaller', 'decrease', 'reduce', 'shrink', 'down', 'lower'}
+FACTOR_WORDS = {'double': 2.0, 'twice': 2.0, 'triple': 3.0, 'half': 0.5, 'halve': 0.5}
+# Words that carry no edit of their own
+FILLER_WORDS = {
+    'a', 'all', 'an', 'as', 'be', 'by', 'can', 'change', 'color', 'colors', 'colour', 'colours', 'could', 'doc',
+    'document', 'entire', 'everything', 'file', 'for', 'from', 'i', 'in', 'into', 'is', 'it', 'its', 'just',
+    'make', 'me', 'my', 'of', 'on', 'pdf', 'please', 'set', 'should', 'size', 'sizes', 'switch', 'the', 'to',
+    'turn', 'use', 'want', 'whole', 'with', 'would', 'you', 'bit', 'little', 'slightly', 'give', 'have', 'scale',
+}
+# Whole-document presets
+MODES = {'dark': {'background_color': '#000000', 'text_color': '#FFFFFF'},
+         'light': {'background_color': '#FFFFFF', 'text_color': '#000000'}}
+DEFAULT_LARGER = 1.25
+DEFAULT_SMALLER = 0.8
+
+PAGES_RE = re.compile(r'\bpages?\s+(\d+(?:\s*(?:-|to|through|,|and)\s*\d+)*)')
+CLAUSE_RE = re.compile(r'\s*(?:[,;!]|\.(?!\d)|\band\b|\bthen\b|\balso\b)\s*')
+TOKEN_RE = re.compile(r'#[0-9a-f]{6}\b|#[0-9a-f]{3}\b|\d+(?:\.\d+)?\s*%|\d+(?:\.\d+)?\s*x\b|\d+(?:\.\d+)?|[a-z]+')
+# A size factor such as "2x" or "1.5 x"; words that merely end in x, like "fix", are not factors
+FACTOR_RE = re.compile(r'(\d+(?:\.\d+)?)\s*x')
+
+
+def expand_hex(code: str) -> str:
+    code = code.lstrip('#')
+    if len(code) == 3:
+        code = ''.join(c * 2 for c in code)
+    return f"#{code.upper()}"
+
+
+def tokenize(clause: str) -> Optional[List[Tuple[str, Any]]]:
+    """
+    Classifies the words of one clause as targets, colors, size changes and filler.
+
+    Returns:
+        Optional[List[Tuple[str, Any]]]: (kind, value) pairs without the filler, or None when
+        a word is not understood.
+    """
+    words = TOKEN_RE.findall(clause)
+    tokens: List[Tuple[str, Any]] = []
+    i = 0
+    while i < len(words):
+        word = words[i]
+        pair = ' '.join(words[i:i + 2])
+        if pair in COLOR_NAMES:
+            tokens.append(('color', COLOR_NAMES[pair]))
+            i += 2
+            continue
+        if word.startswith('#'):
+            tokens.append(('color', expand_hex(word)))
+        elif word in COLOR_NAMES:
+            tokens.append(('color', COLOR_NAMES[word]))
+        elif word in MODES and i + 1 < len(words) and words[i + 1] in ('mode', 'theme'):
+            tokens.append(('mode', word))
+            i += 2
+            continue
+        elif word in BACKGROUND_WORDS:
+            tokens.append(('target', 'background_color'))
+        elif word in TEXT_WORDS:
+            tokens.append(('target', 'text_color'))
+        elif word in LARGER_WORDS:
+            tokens.append(('direction', 1))
+        elif word in SMALLER_WORDS:
+            tokens.append(('direction', -1))
+        elif word in FACTOR_WORDS:
+            tokens.append(('factor', FACTOR_WORDS[word]))
+        elif word.endswith('%'):
+            tokens.append(('percent', float(word[:-1])))
+        elif FACTOR_RE.fullmatch(word):
+            tokens.append(('factor', float(FACTOR_RE.fullmatch(word).group(1))))
+        elif word not in FILLER_WORDS:
+            return None
+        i += 1
+    return tokens
+
+
+def clause_scale(tokens: List[Tuple[str, Any]]) -> Optional[float]:
+    """Returns the font scale a clause of size words asks for, or None when it is not clear."""
+    directions = {value for kind, value in tokens if kind == 'direction'}
+    percents = [value for kind, value in tokens if kind == 'percent']
+    factors = [value for kind, value in tokens if kind == 'factor']
+    if len(directions) > 1 or len(percents) + len(factors) > 1:
+        return None
+    direction = directions.pop() if directions else 0
+    if factors:
+        return factors[0] if direction == 0 or (factors[0] > 1) == (direction > 0) else None
+    if percents:
+        # "by 20%" with a direction changes the size by that much; "to 150%" without one sets it
+        if direction:
+            return 1 + direction * percents[0] / 100
+        return percents[0] / 100
+    if direction:
+        return DEFAULT_LARGER if direction > 0 else DEFAULT_SMALLER
+    return None
+
+
+def parse_clause(tokens: List[Tuple[str, Any]], args: Dict[str, Any]) -> bool:
+    """Adds the edits of one clause to `args`; returns False when the clause is not understood or contradicts another."""
+    def assign(key, value):
+        if args.get(key, value) != value:
+            return False
+        args[key] = value
+        return True
+
+    kinds = {kind for kind, _ in tokens}
+    if kinds & {'direction', 'percent', 'factor'}:
+        # Size clauses may only name the text they change
+        if kinds & {'color', 'mode'} or any(value != 'text_color' for kind, value in tokens if kind == 'target'):
+            return False
+        scale = clause_scale(tokens)
+        return scale is not None and scale > 0 and assign('font_scale', scale)
+
+    if kinds == {'mode'} and len(tokens) == 1:
+        return all(assign(key, value) for key, value in MODES[tokens[0][1]].items())
+
+    # Every color must sit next to the target it colors: "background black" or "white text"
+    i = 0
+    while i < len(tokens):
+        (kind, value), following = tokens[i], tokens[i + 1] if i + 1 < len(tokens) else (None, None)
+        if kind == 'target' and following[0] == 'color':
+            target, color = value, following[1]
+        elif kind == 'color' and following[0] == 'target':
+            target, color = following[1], value
+        else:
+            return False
+        if not assign(target, color):
+            return False
+        i += 2
+    return bool(tokens)
+
+
+def parse_instructions(instructions: str, page_count: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Reads common formatting instructions without an LLM, such as "make the background
+    black and the text white", "white text on a dark blue background", "font 20% bigger
+    on pages 2-3" or "dark mode".
+
+    Args:
+        instructions (str): The user's instructions.
+        page_count (int, optional): Pages of the PDF to edit; when given, instructions naming
+            pages it does not have, or a range such as "5-3", are left to the agent.
+
+    Returns:
+        Optional[Dict[str, Any]]: Formatting arguments as generate_formatting_args returns them,
+        or None when any part of the instructions is not understood, so the agent handles them.
+    """
+    text = instructions.lower().strip()
+    args: Dict[str, Any] = {}
+
+    pages = PAGES_RE.findall(text)
+    if len(pages) > 1:
+        return None
+    if pages:
+        args['pages'] = re.sub(r'\s*(?:to|through)\s*', '-', re.sub(r'\s*(?:,|and)\s*', ',', pages[0]))
+        text = PAGES_RE.sub(' ', text)
+        if page_count is not None:
+            try:
+                parse_pages(args['pages'], page_count)
+            except ValueError:
+                return None
+
+    for clause in CLAUSE_RE.split(text):
+        if not clause.strip():
+            continue
+        tokens = tokenize(clause)
+        if tokens is None or not parse_clause(tokens, args):
+            return None
+    if not args.keys() - {'pages'}:
+        return None
+    return args
@@ -0,0 +1,67 @@
+import unittest
+from docx import Document
+from docx.shared import Pt
+from chatbot.edit_pdf.editor import ContentExtractor, DocumentFormatter, RunFormat
+
+
+def linked_document():
+    doc = Document()
+    paragraph = doc.add_paragraph()
+    paragraph.paragraph_format.space_after = Pt(6)
+    paragraph.add_run("See ")
+    DocumentFormatter().link_run(paragraph.add_run("the site"), "https://example.com")
+    paragraph.add_run(".")
+    return doc
+
+
+class TestContentExtractor(unittest.TestCase):
+
+    def test_identical_formats_share_one_record(self):
+        doc = Document()
+        for _ in range(3):
+            paragraph = doc.add_paragraph()
+            paragraph.add_run("bold").bold = True
+            paragraph.add_run("plain")
+        content, _, _ = ContentExtractor(doc).extract_content()
+        formats = [run_format for item in content for _, run_format in item['content']]
+        self.assertEqual(len({id(run_format) for run_format in formats}), 2)
+        self.assertIsInstance(formats[0], RunFormat)
+        self.assertTrue(formats[0]['bold'])
+        self.assertIsNone(formats[1]['bold'])
+
+    def test_paragraph_properties_apply_to_every_run(self):
+        doc = Document()
+        paragraph = doc.add_paragraph()
+        paragraph.paragraph_format.left_indent = Pt(18)
+        run = paragraph.add_run("big")
+        run.font.size = Pt(14)
+        run.font.name = 'Arial'
+        paragraph.add_run("small").font.size = Pt(8)
+        (_, big), (_, small) = ContentExtractor(doc).extract_paragraph(paragraph)['content']
+        self.assertEqual((big['size'], big['font_name'], big['left_indent']), (14, 'Arial', 18))
+        self.assertEqual((small['size'], small['left_indent'], small['space_after']), (8, 18, None))
+
+    def test_hyperlinks(self):
+        content = ContentExtractor(linked_document()).extract_content()[0][0]['content']
+        self.assertEqual([(text, run_format['hyperlink']) for text, run_format in content],
+                         [("See ", None), ("the site", "https://example.com"), (".", None)])
+
+    def test_field_code_hyperlinks(self):
+        doc = Document()
+        paragraph = doc.add_paragraph()
+        run = paragraph.add_run()
+        instr = run._r.makeelement('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}instrText')
+        instr.text = ' HYPERLINK "https://example.org/a" '
+        run._r.append(instr)
+        (_, run_format), = ContentExtractor(doc).extract_paragraph(paragraph)['content']
+        self.assertEqual(run_format['hyperlink'], "https://example.org/a")
+
+    def test_hyperlinks_survive_reformatting(self):
+        content, headers, footers = ContentExtractor(linked_document()).extract_content()
+        new_doc = DocumentFormatter(font_color='#FF0000').apply_custom_formats_to_word(content, headers, footers)
+        reextracted = ContentExtractor(new_doc).extract_content()[0][0]['content']
+        self.assertEqual([run_format['hyperlink'] for _, run_format in reextracted], [None, "https://example.com", None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import io
+import unittest
+import pymupdf
+from reportlab.pdfgen import canvas
+from chatbot.edit_pdf.content_stream import ContentStreamEditor, parse_content, serialize_content
+
+
+def sample_pdf(pages=2):
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=(300, 400))
+    for page in range(pages):
+        # A full-page white background, a blue box, then black text
+        pdf.setFillColorRGB(1, 1, 1)
+        pdf.rect(0, 0, 300, 400, fill=1, stroke=0)
+        pdf.setFillColorRGB(0, 0, 1)
+        pdf.rect(20, 20, 50, 50, fill=1, stroke=0)
+        pdf.setFillColorRGB(0, 0, 0)
+        pdf.setFont('Helvetica', 12)
+        pdf.drawString(40, 300, f"Page (one) \\ {page}")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def text_spans(page):
+    return [span for block in page.get_text('dict')['blocks'] for line in block.get('lines', []) for span in line['spans']]
+
+
+class TestContentStream(unittest.TestCase):
+
+    def test_parse_round_trip(self):
+        data = b"q 1 0 0 1 5 5 cm BT /F1 12 Tf [(a\\)b (c)) -20 <4142>] TJ ET << /MCID 0 >> BDC EMC Q"
+        operations = parse_content(data)
+        self.assertEqual([operator for _, operator in operations], [b'q', b'cm', b'BT', b'Tf', b'TJ', b'ET', b'BDC', b'EMC', b'Q'])
+        self.assertEqual(operations[4][0], [b"[(a\\)b (c)) -20 <4142>]"])
+        self.assertEqual(parse_content(serialize_content(operations)), operations)
+
+    def test_inline_images_are_kept_whole(self):
+        operations = parse_content(b"q BI /W 1 /H 1 /BPC 8 /CS /G ID \x00EI\xff EI Q")
+        self.assertEqual(len(operations), 3)
+        self.assertTrue(operations[1][1].startswith(b'BI') and operations[1][1].endswith(b'EI'))
+
+    def test_text_color(self):
+        edited = pymupdf.open(stream=ContentStreamEditor(font_color='#FF0000').edit_bytes(sample_pdf()))
+        for page in edited:
+            self.assertEqual({span['color'] for span in text_spans(page)}, {0xFF0000})
+            # Fills outside text keep their color
+            self.assertEqual(page.get_pixmap().pixel(40, 355), (0, 0, 255))
+
+    def test_background_color(self):
+        edited = pymupdf.open(stream=ContentStreamEditor(bg_color='#000000').edit_bytes(sample_pdf()))
+        pixmap = edited[0].get_pixmap()
+        self.assertEqual(pixmap.pixel(200, 200), (0, 0, 0))
+        self.assertEqual(pixmap.pixel(40, 355), (0, 0, 255))
+        self.assertEqual({span['color'] for span in text_spans(edited[0])}, {0})
+
+    def test_background_on_pages_without_one(self):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=(300, 400))
+        pdf.drawString(40, 300, "Hello")
+        pdf.save()
+        edited = pymupdf.open(stream=ContentStreamEditor(bg_color='#00FF00').edit_bytes(buffer.getvalue()))
+        self.assertEqual(edited[0].get_pixmap().pixel(200, 200), (0, 255, 0))
+
+    def test_font_scale(self):
+        edited = pymupdf.open(stream=ContentStreamEditor(font_size_scale=1.5).edit_bytes(sample_pdf()))
+        self.assertEqual({round(span['size'], 1) for span in text_spans(edited[0])}, {18.0})
+        self.assertEqual(text_spans(edited[0])[0]['text'], "Page (one) \\ 0")
+
+    def test_shared_content_streams(self):
+        doc = pymupdf.open(stream=sample_pdf(3))
+        # Pages 1 and 2 draw the content stream of page 0
+        shared = doc[0].get_contents()[0]
+        doc[1].set_contents(shared)
+        doc[2].set_contents(shared)
+        ContentStreamEditor(font_size_scale=1.5).edit_document(doc, pages=[0, 1])
+        edited = pymupdf.open(stream=doc.tobytes())
+        # Scaled once on each selected page, and not at all on the other
+        self.assertEqual([{round(span['size'], 1) for span in text_spans(page)} for page in edited], [{18.0}, {18.0}, {12.0}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from docx import Document
+from chatbot.edit_pdf.document_cache import DocumentCache
+from chatbot.edit_pdf.editor import PDFConverter
+from chatbot.edit_pdf.test_content_stream import sample_pdf
+
+
+class TestDocumentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.cache = DocumentCache(os.path.join(self.workdir, "cache.sqlite3"), max_bytes=10 * 1024 * 1024)
+        self.input_pdf = os.path.join(self.workdir, "input.pdf")
+        with open(self.input_pdf, 'wb') as f:
+            f.write(sample_pdf(pages=2))
+
+    def convert(self, name):
+        docx_path = os.path.join(self.workdir, name)
+        PDFConverter(self.input_pdf, docx_path, None, cache=self.cache).pdf_to_word()
+        return [paragraph.text for paragraph in Document(docx_path).paragraphs if paragraph.text]
+
+    def test_repeated_edits_convert_once(self):
+        with patch.object(PDFConverter, 'convert_pdf_to_word', autospec=True, side_effect=PDFConverter.convert_pdf_to_word) as convert:
+            first = self.convert("first.docx")
+            second = self.convert("second.docx")
+        self.assertEqual(convert.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_changed_source_is_reconverted(self):
+        self.convert("first.docx")
+        old_key = self.cache.make_key(self.input_pdf)
+        with open(self.input_pdf, 'wb') as f:
+            f.write(sample_pdf(pages=1))
+        self.assertNotEqual(self.cache.make_key(self.input_pdf), old_key)
+
+        paragraphs = self.convert("second.docx")
+        self.assertEqual([text for text in paragraphs if text.startswith("Page")], ["Page (one) \\ 0"])
+        # The conversion of the earlier version was dropped
+        self.assertIsNone(self.cache.get(old_key))
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_invalidate(self):
+        self.convert("first.docx")
+        self.cache.invalidate(self.input_pdf)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_size_based_eviction(self):
+        cache = DocumentCache(os.path.join(self.workdir, "small.sqlite3"), max_bytes=250)
+        cache.set('a', 'a.pdf', b'a' * 100)
+        cache.set('b', 'b.pdf', b'b' * 100)
+        self.assertIsNotNone(cache.get('a'))  # 'a' is now the most recently used
+        cache.set('c', 'c.pdf', b'c' * 100)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'a' * 100)
+        self.assertEqual(cache.get('c'), b'c' * 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
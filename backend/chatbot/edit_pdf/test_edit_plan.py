@@ -0,0 +1,125 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pymupdf
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from chatbot.edit_pdf.content_stream import ContentStreamEditor
+from chatbot.edit_pdf.edit_plan import EditPlan
+from chatbot.edit_pdf.editor import PDFConverter
+from chatbot.edit_pdf.test_content_stream import sample_pdf, text_spans
+from chatbot.edit_pdf.test_editor import fake_word_to_pdf, reflowing_word_to_pdf
+
+
+class TestEditPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.input_pdf = os.path.join(self.workdir, "input.pdf")
+        with open(self.input_pdf, 'wb') as f:
+            f.write(sample_pdf(pages=2))
+        self.output_pdf = os.path.join(self.workdir, "output.pdf")
+
+    def test_resolve(self):
+        plan = EditPlan().text_color('#FF0000').font_scale(2).add_formatting_args(
+            {'text_color': '#00FF00', 'font_scale': 0.75, 'background_color': '#000000'})
+        plan.replace_text("a", "b").append_page("End")
+        self.assertEqual(plan.resolve(), {
+            'text_color': '#00FF00', 'background_color': '#000000', 'font_scale': 1.5,
+            'replacements': [("a", "b")], 'appended_pages': ["End"],
+        })
+        self.assertEqual(EditPlan().add_formatting_args({'font_scale': 1.0}).resolve()['font_scale'], None)
+        with self.assertRaises(ValueError):
+            EditPlan().add('rotate', degrees=90)
+
+    def test_page_selections_are_checked_when_added(self):
+        plan = EditPlan(page_count=3)
+        for pages in ("0", "5-3", "9"):
+            with self.assertRaises(ValueError):
+                plan.text_color('#FF0000', pages)
+            with self.assertRaises(ValueError):
+                plan.add_formatting_args({'text_color': '#FF0000', 'background_color': '#000000', 'pages': pages})
+        self.assertTrue(plan.is_empty())
+        plan.add_formatting_args({'text_color': '#FF0000', 'pages': '2-3'}).append_page("Notes")
+        self.assertEqual(len(plan.operations), 2)
+
+    def test_native_plan_is_applied_in_one_pass(self):
+        plan = EditPlan().replace_text("one", "two").append_page("Appendix").text_color('#FF0000')
+        with patch.object(ContentStreamEditor, 'edit_document', autospec=True,
+                          side_effect=ContentStreamEditor.edit_document) as edit_document:
+            plan.apply(self.input_pdf, self.output_pdf)
+        self.assertEqual(edit_document.call_count, 1)
+
+        with pymupdf.open(self.output_pdf) as doc:
+            self.assertEqual(doc.page_count, 3)
+            for page in doc.pages(0, 2):
+                self.assertNotIn("one", page.get_text())
+                # The new text starts where the old text did
+                (x0, *_), = [word[:4] for word in page.get_text('words') if word[4] == "two"]
+                self.assertAlmostEqual(x0, 75.4, delta=0.5)
+            self.assertIn("Appendix", doc[2].get_text())
+            spans = [span for page in doc for span in text_spans(page)]
+            # Replaced text and the new page get the plan's formats too
+            self.assertEqual({span['color'] for span in spans}, {0xFF0000})
+            self.assertEqual({round(span['size']) for span in spans}, {12})
+
+    def test_page_selections(self):
+        plan = EditPlan().add_formatting_args({'background_color': '#000000', 'pages': '2'}).text_color('#FF0000')
+        plan.text_color('#00FF00', pages=' 2').append_page("End")
+        self.assertEqual(plan.selections(), [None, '2'])
+        self.assertEqual(plan.resolve()['text_color'], '#FF0000')
+        self.assertEqual(plan.resolve()['appended_pages'], ["End"])
+        self.assertEqual(plan.resolve('2'), {'text_color': '#00FF00', 'background_color': '#000000', 'font_scale': None,
+                                             'replacements': [], 'appended_pages': []})
+
+        plan.apply(self.input_pdf, self.output_pdf)
+        with pymupdf.open(self.output_pdf) as doc:
+            self.assertEqual([{(span['color'], round(span['size'])) for span in text_spans(page)} for page in doc],
+                             [{(0xFF0000, 12)}, {(0x00FF00, 12)}, {(0xFF0000, 12)}])
+            self.assertEqual([page.get_pixmap().pixel(200, 200) for page in doc], [(255, 255, 255), (0, 0, 0), (255, 255, 255)])
+
+    @patch('chatbot.edit_pdf.editor.convert', side_effect=fake_word_to_pdf)
+    def test_docx_plan_converts_once(self, mock_convert):
+        plan = EditPlan().add_formatting_args({'text_color': '#FF0000'}).add_formatting_args({'background_color': '#000000'})
+        plan.replace_text("one", "two")
+        with patch.object(PDFConverter, 'convert_pdf_to_word', autospec=True, side_effect=PDFConverter.convert_pdf_to_word) as to_word:
+            plan.apply(self.input_pdf, self.output_pdf, engine="docx")
+        self.assertEqual(to_word.call_count, 1)
+        self.assertEqual(mock_convert.call_count, 1)
+        with pymupdf.open(self.output_pdf) as doc:
+            self.assertEqual({span['color'] for span in text_spans(doc[0])}, {0xFF0000})
+
+    @patch('chatbot.edit_pdf.editor.convert', side_effect=reflowing_word_to_pdf)
+    def test_font_scale_reflows_the_text(self, mock_convert):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=letter)
+        pdf.setFont('Helvetica', 12)
+        for i in range(40):
+            pdf.drawString(72, 720 - 14 * i, f"Line {i} of a paragraph that runs nearly the whole width of the page.")
+        pdf.save()
+        with open(self.input_pdf, 'wb') as f:
+            f.write(buffer.getvalue())
+
+        # The default engine hands font size changes to Word
+        EditPlan().font_scale(2).apply(self.input_pdf, self.output_pdf)
+        self.assertEqual(mock_convert.call_count, 1)
+        with pymupdf.open(self.output_pdf) as doc:
+            self.assertGreater(doc.page_count, 1)
+            for page in doc:
+                lines = [line for block in page.get_text('dict')['blocks'] for line in block.get('lines', [])]
+                self.assertEqual({round(span['size']) for line in lines for span in line['spans']}, {24})
+                for line in lines:
+                    self.assertTrue(page.rect.contains(pymupdf.Rect(line['bbox'])), line['bbox'])
+                # Lines are at least a font size apart, so they do not overlap
+                tops = [line['bbox'][1] for line in lines]
+                self.assertTrue(all(b - a >= 24 for a, b in zip(tops, tops[1:])), tops)
+            text = " ".join(" ".join(page.get_text().split()) for page in doc)
+        self.assertTrue(all(f"Line {i} " in text for i in range(40)))
+
+
+if __name__ == "__main__":
+    unittest.main()
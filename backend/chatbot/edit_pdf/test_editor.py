@@ -0,0 +1,229 @@
+import os
+import shutil
+import tempfile
+import unittest
+from html import escape
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest.mock import patch
+import pymupdf
+from docx import Document
+from docx.oxml.ns import qn
+from chatbot.edit_pdf.content_stream import MUPDF_LOCK
+from chatbot.edit_pdf.editor import DocumentFormatter, PDFConverter, PDFEditor, page_ranges, parse_pages
+from chatbot.edit_pdf.test_content_stream import sample_pdf, text_spans
+
+COLORS = ['#FF0000', '#00FF00', '#0000FF', '#FFFF00', '#FF00FF', '#00FFFF', '#808080', '#FFFFFF']
+
+
+def edit_copy(workdir, index, engine="native"):
+    """Edits a private copy of the sample PDF with the color at `index` and returns the output path."""
+    input_pdf = os.path.join(workdir, f"input_{index}.pdf")
+    with open(input_pdf, 'wb') as f:
+        f.write(sample_pdf(pages=3))
+    output_pdf = os.path.join(workdir, f"input_{index}_edited.pdf")
+    PDFEditor(input_pdf, output_pdf, font_color=COLORS[index], bg_color='#000000', engine=engine).apply_custom_formats()
+    return output_pdf
+
+
+def text_colors(path):
+    with pymupdf.open(path) as doc:
+        return {span['color'] for page in doc for span in text_spans(page)}
+
+
+def fake_word_to_pdf(docx_path, output_path):
+    """Stands in for docx2pdf, which needs Word: writes a one-page PDF in the color of the DOCX's first run."""
+    color = str(Document(docx_path).paragraphs[0].runs[0].font.color.rgb)
+    with pymupdf.open() as doc:
+        doc.new_page().insert_text((72, 72), "Converted", color=tuple(int(color[i:i + 2], 16) / 255 for i in (0, 2, 4)))
+        doc.save(output_path)
+
+
+def reflowing_word_to_pdf(docx_path, output_path):
+    """Stands in for docx2pdf like fake_word_to_pdf, but lays the paragraphs out again at their run sizes, as Word does."""
+    paragraphs = []
+    for paragraph in Document(docx_path).paragraphs:
+        runs = "".join(f'<span style="font-size: {run.font.size.pt if run.font.size else 12}pt">{escape(run.text)}</span>'
+                       for run in paragraph.runs)
+        if runs:
+            paragraphs.append(f"<p>{runs}</p>")
+    story = pymupdf.Story("".join(paragraphs))
+    writer = pymupdf.DocumentWriter(output_path)
+    more = True
+    while more:
+        device = writer.begin_page(pymupdf.paper_rect('letter'))
+        more, _ = story.place(pymupdf.paper_rect('letter') + (72, 72, -72, -72))
+        story.draw(device)
+        writer.end_page()
+    writer.close()
+
+
+class TestConcurrentEdits(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+
+    def assert_colors(self, outputs):
+        self.assertEqual(len(set(outputs)), len(COLORS))
+        for index, output in enumerate(outputs):
+            self.assertEqual(text_colors(output), {int(COLORS[index].lstrip('#'), 16)})
+
+    def test_threads(self):
+        with ThreadPoolExecutor(max_workers=len(COLORS)) as executor:
+            outputs = list(executor.map(edit_copy, [self.workdir] * len(COLORS), range(len(COLORS))))
+        self.assert_colors(outputs)
+        self.assertEqual(sorted(os.listdir(self.workdir)), sorted(
+            [f"input_{i}.pdf" for i in range(len(COLORS))] + [f"input_{i}_edited.pdf" for i in range(len(COLORS))]))
+
+    def test_processes(self):
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            outputs = list(executor.map(edit_copy, [self.workdir] * len(COLORS), range(len(COLORS))))
+        self.assert_colors(outputs)
+
+    @patch('chatbot.edit_pdf.editor.convert', side_effect=fake_word_to_pdf)
+    def test_docx_round_trips_use_private_workspaces(self, mock_convert):
+        cwd = os.getcwd()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            outputs = list(executor.map(lambda i: edit_copy(self.workdir, i, engine="docx"), range(4)))
+
+        for index, output in enumerate(outputs):
+            self.assertEqual(text_colors(output), {int(COLORS[index].lstrip('#'), 16)})
+        # Every intermediate DOCX lived in its own workspace, and all of them were removed
+        docx_paths = [call.args[0] for call in mock_convert.call_args_list]
+        self.assertEqual(len({os.path.dirname(path) for path in docx_paths}), 4)
+        self.assertFalse(any(os.path.exists(os.path.dirname(path)) for path in docx_paths))
+        self.assertFalse(os.path.exists(os.path.join(cwd, "intermediate.docx")))
+
+
+class TestChunkedConversion(unittest.TestCase):
+
+    def test_page_chunks(self):
+        converter = PDFConverter("in.pdf", "out.docx", None, workers=2, chunk_pages=3)
+        self.assertEqual(converter.page_chunks(7), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(converter.page_chunks(0), [])
+
+    def test_chunked_conversion_matches_serial(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        input_pdf = os.path.join(workdir, "input.pdf")
+        with open(input_pdf, 'wb') as f:
+            f.write(sample_pdf(pages=3))
+
+        def paragraphs(workers):
+            docx_path = os.path.join(workdir, f"output_{workers}.docx")
+            PDFConverter(input_pdf, docx_path, None, workers=workers, chunk_pages=1).pdf_to_word()
+            return [paragraph.text for paragraph in Document(docx_path).paragraphs if paragraph.text]
+
+        serial = paragraphs(1)
+        self.assertEqual([text for text in serial if text.startswith("Page")], ["Page (one) \\ 0", "Page (one) \\ 1", "Page (one) \\ 2"])
+        self.assertEqual(paragraphs(2), serial)
+
+    def test_lock_is_free_while_chunks_are_parsed(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        input_pdf = os.path.join(workdir, "input.pdf")
+        with open(input_pdf, 'wb') as f:
+            f.write(sample_pdf(pages=2))
+        free = []
+
+        class Pool(ThreadPoolExecutor):
+            def __init__(self, max_workers, mp_context):
+                super().__init__(max_workers)
+
+            def map(self, func, *iterables):
+                # Another thread can use MuPDF while the worker processes parse
+                free.append(self.submit(lambda: MUPDF_LOCK.acquire(blocking=False) and (MUPDF_LOCK.release() or True)).result())
+                with MUPDF_LOCK:
+                    return [func(*args) for args in zip(*iterables)]
+
+        with patch('chatbot.edit_pdf.editor.ProcessPoolExecutor', Pool):
+            PDFConverter(input_pdf, os.path.join(workdir, "output.docx"), None, workers=2, chunk_pages=1).pdf_to_word()
+            # A single chunk is parsed in another process too
+            PDFConverter(input_pdf, os.path.join(workdir, "serial.docx"), None, workers=1).pdf_to_word()
+        self.assertEqual(free, [True, True])
+
+
+class TestFormatsInPlace(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = Document()
+        self.doc.add_paragraph("Body")
+        table = self.doc.add_table(3, 2)
+        table.cell(0, 0).merge(table.cell(2, 0))
+        table.cell(0, 1).add_table(1, 1).cell(0, 0).paragraphs[0].add_run("Nested")
+        self.doc.sections[0].header.paragraphs[0].add_run("Header")
+        self.doc.sections[0].footer.add_table(1, 1, self.doc.sections[0].page_width).cell(0, 0).paragraphs[0].add_run("Footer")
+
+    def elements(self, tag):
+        roots = [self.doc.element.body, self.doc.sections[0].header._element, self.doc.sections[0].footer._element]
+        return [element for root in roots for element in root.iter(qn(tag))]
+
+    def test_every_run_and_cell_is_recolored(self):
+        DocumentFormatter(font_color='#FF0000', bg_color='#000000').apply_formats_in_place(self.doc)
+        runs = self.elements('w:r')
+        self.assertEqual(len(runs), 4)
+        self.assertTrue(all(r.rPr.color.val == (0xFF, 0, 0) for r in runs))
+        cells = self.elements('w:tc')
+        self.assertEqual(len(cells), 8)  # 6 body cells (a vertical merge keeps its w:tc), 1 nested, 1 in the footer
+        for tc in cells:
+            self.assertEqual([shd.get(qn('w:fill')) for shd in tc.tcPr.findall(qn('w:shd'))], ['000000'])
+
+    def test_font_color_only(self):
+        DocumentFormatter(font_color='#00FF00').apply_formats_in_place(self.doc)
+        self.assertTrue(all(r.rPr.color.val == (0, 0xFF, 0) for r in self.elements('w:r')))
+        self.assertFalse(any(tc.find(qn('w:tcPr') + '/' + qn('w:shd')) is not None for tc in self.elements('w:tc')))
+
+
+class TestPageRanges(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.input_pdf = os.path.join(self.workdir, "input.pdf")
+        with open(self.input_pdf, 'wb') as f:
+            f.write(sample_pdf(pages=4))
+        self.output_pdf = os.path.join(self.workdir, "output.pdf")
+
+    def page_contents(self, path):
+        with pymupdf.open(path) as doc:
+            return [page.read_contents() for page in doc]
+
+    def test_parse_pages(self):
+        self.assertEqual(parse_pages(None, 3), [0, 1, 2])
+        self.assertEqual(parse_pages("3", 5), [2])
+        self.assertEqual(parse_pages("1-2, 4, 2", 5), [0, 1, 3])
+        self.assertEqual(parse_pages("4-", 5), [3, 4])
+        self.assertEqual(parse_pages("2-9", 3), [1, 2])
+        for selection in ("0", "a", "2-1x", "9", "3-2", "1, 3-2"):
+            with self.assertRaises(ValueError):
+                parse_pages(selection, 3)
+        self.assertEqual(page_ranges([0, 1, 3, 5, 6]), [(0, 1), (3, 3), (5, 6)])
+
+    def test_native_edits_only_selected_pages(self):
+        original = self.page_contents(self.input_pdf)
+        PDFEditor(self.input_pdf, self.output_pdf, font_color='#FF0000', bg_color='#000000', pages="2-3").apply_custom_formats()
+
+        edited = self.page_contents(self.output_pdf)
+        self.assertEqual([edited[i] == original[i] for i in range(4)], [True, False, False, True])
+        # The edit is appended to an unchanged copy of the original file
+        with open(self.input_pdf, 'rb') as f, open(self.output_pdf, 'rb') as g:
+            self.assertTrue(g.read().startswith(f.read()))
+        with pymupdf.open(self.output_pdf) as doc:
+            self.assertEqual([{span['color'] for span in text_spans(page)} for page in doc], [{0}, {0xFF0000}, {0xFF0000}, {0}])
+
+    @patch('chatbot.edit_pdf.editor.convert', side_effect=fake_word_to_pdf)
+    def test_docx_round_trips_only_selected_pages(self, mock_convert):
+        with patch.object(PDFConverter, 'convert_pdf_to_word', autospec=True, side_effect=PDFConverter.convert_pdf_to_word) as to_word:
+            PDFEditor(self.input_pdf, self.output_pdf, font_color='#FF0000', engine="docx", pages="2, 4").apply_custom_formats()
+        self.assertEqual([call.args[0].pages for call in to_word.call_args_list], [[1], [3]])
+
+        original = self.page_contents(self.input_pdf)
+        with pymupdf.open(self.output_pdf) as doc:
+            self.assertEqual(doc.page_count, 4)
+            self.assertEqual([page.get_text().strip() for page in doc],
+                             ["Page (one) \\ 0", "Converted", "Page (one) \\ 2", "Converted"])
+            self.assertEqual([doc[i].read_contents() for i in (0, 2)], [original[0], original[2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
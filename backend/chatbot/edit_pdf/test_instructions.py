@@ -0,0 +1,54 @@
+import unittest
+from chatbot.edit_pdf.instructions import parse_instructions
+
+
+class TestParseInstructions(unittest.TestCase):
+
+    def test_colors(self):
+        self.assertEqual(parse_instructions("Change the background to black and the text to white."),
+                         {'background_color': '#000000', 'text_color': '#FFFFFF'})
+        self.assertEqual(parse_instructions("white text on a dark blue background"),
+                         {'text_color': '#FFFFFF', 'background_color': '#00008B'})
+        self.assertEqual(parse_instructions("set the text colour to #f0f, background #330080"),
+                         {'text_color': '#FF00FF', 'background_color': '#330080'})
+        self.assertEqual(parse_instructions("Dark mode please"), {'background_color': '#000000', 'text_color': '#FFFFFF'})
+
+    def test_font_scale(self):
+        self.assertEqual(parse_instructions("make the text bigger"), {'font_scale': 1.25})
+        self.assertEqual(parse_instructions("make the font slightly smaller"), {'font_scale': 0.8})
+        self.assertEqual(parse_instructions("increase the font size by 20%"), {'font_scale': 1.2})
+        self.assertEqual(parse_instructions("reduce font size by 10%"), {'font_scale': 0.9})
+        self.assertEqual(parse_instructions("set the font size to 150%"), {'font_scale': 1.5})
+        self.assertEqual(parse_instructions("make the font 1.5x bigger"), {'font_scale': 1.5})
+        self.assertEqual(parse_instructions("double the font size"), {'font_scale': 2.0})
+
+    def test_pages(self):
+        self.assertEqual(parse_instructions("make page 3 dark mode"),
+                         {'pages': '3', 'background_color': '#000000', 'text_color': '#FFFFFF'})
+        self.assertEqual(parse_instructions("increase font size by 20% on pages 2 to 4 and 7"), {'pages': '2-4,7', 'font_scale': 1.2})
+
+    def test_pages_the_document_does_not_have_go_to_the_agent(self):
+        self.assertEqual(parse_instructions("make page 3 dark mode", page_count=3),
+                         {'pages': '3', 'background_color': '#000000', 'text_color': '#FFFFFF'})
+        for instructions in ["make page 0 dark mode", "dark mode on pages 5-3", "page 99 dark mode"]:
+            self.assertIsNone(parse_instructions(instructions, page_count=3), instructions)
+
+    def test_unclear_instructions_go_to_the_agent(self):
+        for instructions in [
+            "summarize this document",
+            "make it red",  # no target
+            "make the font bigger and red",  # a color without a target
+            "make the text red and the text blue",  # contradiction
+            "make the headings bigger",
+            "make the text bigger but keep the title",
+            "make the font 2x smaller",
+            "fix the text color to black",  # words ending in x are not size factors
+            "make the font max size",
+            "pages 1 and 2 black background, page 3 white background",
+            "",
+        ]:
+            self.assertIsNone(parse_instructions(instructions), instructions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import asyncio
+from langchain_core.tools import tool
+from chatbot.edit_pdf.tool_results import memoized, tool_results
+
+
+class TestMemoizedTools(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        @memoized
+        async def lookup(text: str, scale: float = 1.0) -> str:
+            """Looks up the text."""
+            self.calls.append(text)
+            await asyncio.sleep(0.01)
+            if text == 'fail':
+                raise ValueError(text)
+            return text.upper()
+
+        self.lookup = lookup
+
+    def test_repeated_calls_run_once(self):
+        async def run():
+            with tool_results():
+                first = await self.lookup('a')
+                second = await self.lookup('a')
+                other = await self.lookup('a', scale=2.0)
+            return first, second, other
+
+        self.assertEqual(asyncio.run(run()), ('A', 'A', 'A'))
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_concurrent_calls_share_one_execution(self):
+        async def run():
+            with tool_results():
+                return await asyncio.gather(self.lookup('a'), self.lookup('a'), self.lookup('b'))
+
+        self.assertEqual(asyncio.run(run()), ['A', 'A', 'B'])
+        self.assertEqual(sorted(self.calls), ['a', 'b'])
+
+    def test_failures_are_retried(self):
+        async def run():
+            with tool_results():
+                for _ in range(2):
+                    with self.assertRaises(ValueError):
+                        await self.lookup('fail')
+
+        asyncio.run(run())
+        self.assertEqual(self.calls, ['fail', 'fail'])
+
+    def test_no_memo_outside_tool_results(self):
+        async def run():
+            await self.lookup('a')
+            await self.lookup('a')
+
+        asyncio.run(run())
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_tool_keeps_its_arguments(self):
+        lookup = tool(self.lookup)
+        self.assertEqual(set(lookup.args), {'text', 'scale'})
+
+        async def run():
+            with tool_results():
+                await lookup.ainvoke({'text': 'a'})
+                return await lookup.ainvoke({'text': 'a'})
+
+        self.assertEqual(asyncio.run(run()), 'A')
+        self.assertEqual(self.calls, ['a'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, Iterator, Optional
+import asyncio
+import json
+
+# Results of the memoized tools called while handling the current instruction
+_tool_results: ContextVar[Optional[Dict[str, asyncio.Future]]] = ContextVar('tool_results', default=None)
+
+
+@contextmanager
+def tool_results() -> Iterator[Dict[str, asyncio.Future]]:
+    """Remembers the results of memoized tools inside the block, such as one instruction and its retries."""
+    results: Dict[str, asyncio.Future] = {}
+    token = _tool_results.set(results)
+    try:
+        yield results
+    finally:
+        _tool_results.reset(token)
+
+
+def memoized(func):
+    """
+    Makes an async tool return its earlier result when it is called again with the same
+    arguments inside tool_results(), so a retried agent run does not repeat the tool calls
+    that already finished. Identical calls running at the same time share one execution,
+    and failed calls are forgotten so they can be retried.
+
+    Only for tools whose result depends on nothing but their arguments: a tool that edits
+    the PDF must run every time it is called, and one that reads a file must take what it
+    reads, such as the file's hash, as an argument.
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        results = _tool_results.get()
+        if results is None:
+            return await func(*args, **kwargs)
+        key = json.dumps([func.__name__, args, kwargs], sort_keys=True, default=str)
+        task = results.get(key)
+        if task is None:
+            task = results[key] = asyncio.ensure_future(func(*args, **kwargs))
+        try:
+            return await task
+        except BaseException:
+            if results.get(key) is task:
+                del results[key]
+            raise
+    return wrapper
@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from multiprocessing import Process
+from typing import List, Optional
+from .models import Conversation, PDF, PDFJob
+from .create_pdf.pdf_generator import generate_pdf_from_description
+from .metrics import collect_timings, remove_snapshot, summarize_timings, write_snapshot
+from .retrieval import index_document, storage_name
+import signal
+import time
+
+
+def enqueue_pdf_job(user, description: str) -> PDFJob:
+    """
+    Queues a PDF generation job for the user's active conversation.
+
+    Args:
+        user (User): The user requesting the PDF.
+        description (str): The user's description of the PDF to generate.
+
+    Returns:
+        PDFJob: The newly queued job.
+    """
+    conversation, created = Conversation.objects.get_or_create(user=user)
+    return PDFJob.objects.create(conversation=conversation, description=description)
+
+
+def claim_next_job() -> Optional[PDFJob]:
+    """
+    Atomically moves the oldest queued job to the running state.
+
+    The claim is a conditional UPDATE on the job's status, so when several
+    workers race for the same job exactly one of them wins it.
+
+    Returns:
+        Optional[PDFJob]: The claimed job, or None if the queue is empty.
+    """
+    while True:
+        job_id = PDFJob.objects.filter(status=PDFJob.QUEUED).values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = PDFJob.objects.filter(id=job_id, status=PDFJob.QUEUED).update(
+            status=PDFJob.RUNNING, started_at=timezone.now()
+        )
+        if claimed:
+            return PDFJob.objects.get(id=job_id)
+
+
+def run_job(job: PDFJob) -> PDFJob:
+    """
+    Generates the PDF for a claimed job and records the outcome.
+
+    On success a PDF row is added to the job's conversation and linked to the job.
+
+    Args:
+        job (PDFJob): A job in the running state.
+
+    Returns:
+        PDFJob: The job in its final (succeeded or failed) state.
+    """
+    with collect_timings() as timings:
+        try:
+            # A requeued job resumes from the checkpoint of the stage that failed
+            pdf_url = generate_pdf_from_description(job.description, run_id=f"job-{job.id}")
+        except Exception as e:
+            print(f"Job {job.id} raised an error: {e}")
+            pdf_url = ""
+            job.error = str(e)
+        document = ''
+        if pdf_url:
+            # Index the text now so the first question about the PDF does not wait for it
+            try:
+                document = index_document(storage_name(pdf_url))
+            except Exception as e:
+                print(f"Job {job.id} could not index its PDF: {e}")
+    job.timings = summarize_timings(timings)
+
+    with transaction.atomic():
+        if pdf_url:
+            job.pdf = PDF.objects.create(conversation=job.conversation, description=job.description, pdf_url=pdf_url,
+                                         document=document)
+            job.status = PDFJob.SUCCEEDED
+        else:
+            job.status = PDFJob.FAILED
+            job.error = job.error or 'PDF generation failed'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['pdf', 'status', 'error', 'timings', 'finished_at'])
+    return job
+
+
+def worker_loop(poll_interval: float) -> None:
+    """
+    Runs queued jobs one at a time until the process receives SIGTERM or SIGINT.
+
+    Args:
+        poll_interval (float): Seconds to sleep when the queue is empty.
+    """
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Connections inherited from the parent process must not be shared
+    connections.close_all()
+    while not stopping:
+        job = claim_next_job()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        print(f"Running job {job.id}")
+        run_job(job)
+        print(f"Job {job.id} finished with status '{job.status}'")
+        # Share this worker's metrics with the /metrics view of the web process
+        write_snapshot()
+    # Forked processes exit without running atexit handlers
+    remove_snapshot()
+
+
+def start_workers(num_workers: Optional[int] = None, poll_interval: Optional[float] = None) -> List[Process]:
+    """
+    Starts a pool of local worker processes that execute queued PDF jobs.
+
+    Args:
+        num_workers (Optional[int]): Number of processes, defaults to settings.PDF_JOB_WORKERS.
+        poll_interval (Optional[float]): Idle sleep in seconds, defaults to settings.PDF_JOB_POLL_INTERVAL.
+
+    Returns:
+        List[Process]: The started worker processes.
+    """
+    num_workers = num_workers or settings.PDF_JOB_WORKERS
+    poll_interval = poll_interval if poll_interval is not None else settings.PDF_JOB_POLL_INTERVAL
+
+    connections.close_all()
+    workers = []
+    for i in range(num_workers):
+        worker = Process(target=worker_loop, args=(poll_interval,), name=f"pdf-worker-{i}")
+        worker.start()
+        workers.append(worker)
+    return workers
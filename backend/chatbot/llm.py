@@ -0,0 +1,231 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult, LLMResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_groq import ChatGroq
+from pydantic import ConfigDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from .metrics import record_tokens
+import itertools
+import time
+import ast
+import re
+import os
+
+load_dotenv()
+
+# 'groq' calls the hosted models; 'offline' uses the deterministic local stand-in
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximates the token count of a text, at roughly four characters per token."""
+    return max(1, len(text) // 4)
+
+
+def sample_markdown(sections: int) -> str:
+    """
+    Builds a deterministic Markdown document of roughly one page per section.
+
+    Args:
+        sections (int): Number of sections.
+
+    Returns:
+        str: The Markdown document.
+    """
+    parts = ["# Offline Report\n\nA deterministic document produced by the offline LLM stand-in.\n"]
+    for i in range(1, sections + 1):
+        parts.append(
+            f"## Section {i}\n\n"
+            f"Section {i} describes the topic in **detail**, with *emphasis* where it helps and `inline code` for identifiers. "
+            "It is long enough to wrap over several lines so that paragraph layout is part of the measured work.\n\n"
+            "- First point of the section\n- Second point of the section\n  - A nested detail\n\n"
+            "| Model | Accuracy | Latency |\n|-------|----------|---------|\n"
+            f"| A{i} | 0.9{i % 10} | {i * 10} ms |\n| B{i} | 0.8{i % 10} | {i * 12} ms |\n\n"
+            f"```python\ndef section_{i}(x):\n    # Scale the input\n    return x * {i}\n```\n"
+        )
+    return "\n".join(parts)
+
+
+def last_tool_results(messages: Sequence[BaseMessage]) -> Dict[str, str]:
+    """Maps tool names to the content of their latest result in the conversation."""
+    names = {}
+    for message in messages:
+        for call in getattr(message, 'tool_calls', None) or []:
+            names[call['id']] = call['name']
+    return {names.get(m.tool_call_id, ''): m.content for m in messages if isinstance(m, ToolMessage)}
+
+
+def parse_tool_result(content: str) -> Any:
+    try:
+        return ast.literal_eval(content)
+    except (ValueError, SyntaxError):
+        return content
+
+
+def edit_instructions(prompt_text: str) -> Tuple[str, str]:
+    """Extracts the instructions and PDF path from the PDF editor agent's prompt."""
+    match = re.search(r"Given the instructions: (.*), modify the PDF: (.*?) accordingly", prompt_text, re.DOTALL)
+    return (match.group(1), match.group(2)) if match else (prompt_text, "")
+
+
+# Canned text responses, chosen by the first pattern found in the rendered prompt
+DEFAULT_RESPONSES: List[Tuple[str, Callable[["OfflineChatModel", str], str]]] = [
+    (r"Separate the formatting instructions", lambda llm, prompt: (
+        "Formatting Instructions: Use a white background with black text.\n"
+        "Content Description: A detailed report on the topic requested by the user."
+    )),
+    (r"Create detailed Markdown content", lambda llm, prompt: sample_markdown(llm.document_sections)),
+    (r"Refine and improve the following Markdown", lambda llm, prompt: prompt.split("Initial Content:\n", 1)[-1]),
+    (r"Convert the following formatting instructions", lambda llm, prompt: (
+        '{"fontName": "Helvetica", "fontSize": 12, "backColor": "#FFFFFF", "textColor": "#000000"}'
+    )),
+    (r"Answer the question using only the passages", lambda llm, prompt: (
+        "According to the document: " + re.search(r"\[Page \d+\]\n(.*)", prompt).group(1)[:200]
+    )),
+    (r"Summarize", lambda llm, prompt: "Summary: " + prompt.strip().split("\n")[-1][:200]),
+]
+
+# Canned tool-call arguments by tool name, built from the prompt and earlier tool results
+DEFAULT_TOOL_ARGS: Dict[str, Callable[[str, Dict[str, str]], Dict[str, Any]]] = {
+    'FormatArgs': lambda prompt, results: {'text_color': '#FFFFFF', 'background_color': '#000000', 'font_scale': 1.0},
+    'generate_formatting_args': lambda prompt, results: {'instructions': edit_instructions(prompt)[0]},
+    'edit_pdf': lambda prompt, results: {
+        'formatting_args': parse_tool_result(results.get('generate_formatting_args', '{}')),
+        'input_pdf': edit_instructions(prompt)[1],
+    },
+}
+
+
+class OfflineChatModel(BaseChatModel):
+    """
+    Deterministic local stand-in for a hosted chat model.
+
+    Responses are replayed from canned templates, and each call sleeps for
+    `latency` seconds plus the time needed to emit the response at `tokens_per_second`.
+    When tools are bound it calls the tools in `tool_plan` in order, one per step, then answers.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model_name: str = "offline"
+    temperature: float = 0.0
+    latency: float = 0.0
+    tokens_per_second: Optional[float] = None
+    document_sections: int = 3
+    responses: List[Tuple[str, Callable]] = DEFAULT_RESPONSES
+    tool_args: Dict[str, Callable] = DEFAULT_TOOL_ARGS
+    tool_plan: List[str] = ['generate_formatting_args', 'edit_pdf']
+
+    @property
+    def _llm_type(self) -> str:
+        return "offline"
+
+    def bind_tools(self, tools: Sequence[Any], *, tool_choice: Optional[str] = None, **kwargs: Any):
+        formatted = [convert_to_openai_tool(tool) for tool in tools]
+        return self.bind(tools=formatted, tool_choice=tool_choice, **kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt_text = "\n".join(str(message.content) for message in messages)
+        tools = [tool['function']['name'] for tool in kwargs.get('tools') or []]
+
+        if tools:
+            message = self._tool_step(prompt_text, tools, messages, forced=kwargs.get('tool_choice') is not None)
+        else:
+            message = AIMessage(content=self._respond(prompt_text))
+
+        output = message.content or str(message.tool_calls)
+        message.usage_metadata = {
+            'input_tokens': estimate_tokens(prompt_text),
+            'output_tokens': estimate_tokens(output),
+            'total_tokens': estimate_tokens(prompt_text) + estimate_tokens(output),
+        }
+        self._simulate_latency(output)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _respond(self, prompt_text: str) -> str:
+        for pattern, response in self.responses:
+            if re.search(pattern, prompt_text):
+                return response(self, prompt_text)
+        return "OK"
+
+    def _tool_step(self, prompt_text: str, tools: List[str], messages: List[BaseMessage], forced: bool) -> AIMessage:
+        results = last_tool_results(messages)
+        if forced:
+            # Structured output: answer with the single bound schema
+            name = tools[0]
+        else:
+            # One tool is called per step, so the number of tool results so far is the step
+            plan = [name for name in self.tool_plan if name in tools]
+            step = sum(isinstance(message, ToolMessage) for message in messages)
+            if step >= len(plan):
+                return AIMessage(content=f"Done: {parse_tool_result(results.get(self.tool_plan[-1], ''))}")
+            name = plan[step]
+        args = self.tool_args[name](prompt_text, results) if name in self.tool_args else {}
+        call_id = f"call_{name}_{next(_call_ids)}"
+        return AIMessage(content="", tool_calls=[{'name': name, 'args': args, 'id': call_id, 'type': 'tool_call'}])
+
+    def _simulate_latency(self, output: str) -> None:
+        delay = self.latency
+        if self.tokens_per_second:
+            delay += estimate_tokens(output) / self.tokens_per_second
+        if delay > 0:
+            time.sleep(delay)
+
+
+_call_ids = itertools.count()
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Adds the token usage reported by each chat model call to the LLM token counters."""
+
+    def __init__(self):
+        self.models: Dict[Any, str] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: Any,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        self.models[run_id] = (metadata or {}).get('ls_model_name') or 'unknown'
+
+    def on_llm_end(self, response: LLMResult, *, run_id: Any, **kwargs: Any) -> None:
+        model = self.models.pop(run_id, 'unknown')
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if usage:
+                    record_tokens(model, usage.get('input_tokens', 0), usage.get('output_tokens', 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        self.models.pop(run_id, None)
+
+
+# Pass as `config={'callbacks': [token_usage]}` to count the tokens of a call
+token_usage = TokenUsageHandler()
+
+
+def get_chat_model(model_name: str, temperature: float) -> BaseChatModel:
+    """
+    Creates the chat model for the configured provider (LLM_PROVIDER).
+
+    Args:
+        model_name (str): The hosted model name.
+        temperature (float): Sampling temperature.
+
+    Returns:
+        BaseChatModel: The chat model.
+    """
+    if LLM_PROVIDER == "offline":
+        return OfflineChatModel(
+            model_name=model_name,
+            temperature=temperature,
+            latency=float(os.getenv("OFFLINE_LLM_LATENCY", 0)),
+            tokens_per_second=float(os.getenv("OFFLINE_LLM_TOKENS_PER_SECOND", 0)) or None,
+        )
+    if LLM_PROVIDER == "groq":
+        groq_api_key = os.getenv("GROQ_API_KEY")
+        if not groq_api_key:
+            raise ValueError("GROQ_API_KEY is not set. Please set it as an environment variable.")
+        return ChatGroq(temperature=temperature, model_name=model_name, groq_api_key=groq_api_key)
+    raise ValueError(f"Unknown LLM_PROVIDER '{LLM_PROVIDER}', expected 'groq' or 'offline'.")
@@ -0,0 +1,188 @@
+from django.conf import settings
+from langchain_core.prompts import ChatPromptTemplate
+from typing import Any, Callable, Dict, Optional
+from .llm import token_usage
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+
+
+class LLMCache:
+    """
+    On-disk cache of LLM responses keyed by a hash of (model name, temperature, rendered prompt).
+
+    Entries expire after `ttl` seconds, and the least recently used entries are
+    evicted once the stored values exceed `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(llm: Any, prompt_text: str, *extra: str) -> str:
+        """
+        Builds the cache key for a prompt sent to the given model.
+
+        Args:
+            llm (Any): The chat model, used for its model name and temperature.
+            prompt_text (str): The fully rendered prompt.
+            *extra (str): Anything else that changes the response, e.g. an output schema name.
+
+        Returns:
+            str: A hex SHA-256 digest.
+        """
+        model_name = getattr(llm, 'model_name', type(llm).__name__)
+        temperature = getattr(llm, 'temperature', None)
+        payload = json.dumps([model_name, temperature, prompt_text, *extra])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value for the key, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        """Stores a JSON-serializable value and evicts least recently used entries beyond max_bytes."""
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_used"):
+            if total - freed <= self.max_bytes:
+                break
+            stale.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+
+    def clear(self) -> None:
+        """Removes every entry and resets the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters for this process and the current size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    Returns the process-wide cache, or None when caching is disabled or the
+    Django settings are not configured.
+    """
+    global _llm_cache
+    if not settings.configured or not settings.LLM_CACHE_ENABLED:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_MAX_BYTES, settings.LLM_CACHE_TTL)
+    return _llm_cache
+
+
+def cached_invoke(prompt: ChatPromptTemplate, llm: Any, inputs: Dict[str, Any],
+                  parse: Optional[Callable[[str], Any]] = None, use_cache: bool = True) -> Any:
+    """
+    Runs `prompt | llm` and returns the stripped response text, serving repeated prompts from the cache.
+
+    Args:
+        prompt (ChatPromptTemplate): The prompt template.
+        llm (Any): The chat model.
+        inputs (Dict[str, Any]): Variables for the prompt template.
+        parse (Optional[Callable[[str], Any]]): Converts the response text; a response is
+            only cached once it parses, so a retry never replays a malformed answer.
+        use_cache (bool): Set to False for stages where variety matters.
+
+    Returns:
+        Any: The response text, or the result of `parse` on it.
+    """
+    parse = parse or (lambda text: text)
+    cache = get_llm_cache() if use_cache else None
+    prompt_value = prompt.invoke(inputs)
+
+    key = None
+    if cache is not None:
+        key = cache.make_key(llm, prompt_value.to_string())
+        cached = cache.get(key)
+        if cached is not None:
+            return parse(cached)
+
+    text = llm.invoke(prompt_value, config={'callbacks': [token_usage]}).content.strip()
+    result = parse(text)
+    if cache is not None:
+        cache.set(key, text)
+    return result
+
+
+async def acached_invoke(prompt: ChatPromptTemplate, llm: Any, inputs: Dict[str, Any],
+                         parse: Optional[Callable[[str], Any]] = None, use_cache: bool = True) -> Any:
+    """Like cached_invoke, but awaits the model, so several calls can be in flight at once."""
+    parse = parse or (lambda text: text)
+    cache = get_llm_cache() if use_cache else None
+    prompt_value = prompt.invoke(inputs)
+
+    key = None
+    if cache is not None:
+        key = cache.make_key(llm, prompt_value.to_string())
+        cached = cache.get(key)
+        if cached is not None:
+            return parse(cached)
+
+    text = (await llm.ainvoke(prompt_value, config={'callbacks': [token_usage]})).content.strip()
+    result = parse(text)
+    if cache is not None:
+        cache.set(key, text)
+    return result
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from chatbot.benchmarks import benchmark_extract
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the time and peak memory of extracting run formatting from a large DOCX."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paragraphs', type=int, default=5000, help="Paragraphs in the generated document.")
+        parser.add_argument('--runs-per-paragraph', type=int, default=10, help="Runs in each paragraph.")
+        parser.add_argument('--runs', type=int, default=3, help="Extractions to time.")
+
+    def handle(self, *args, **options):
+        result = benchmark_extract(options['paragraphs'], options['runs_per_paragraph'], options['runs'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Extracted {result['extracted_runs']} runs ({result['distinct_format_objects']} format records) "
+            f"in {result['latency_mean_s']:.3f}s mean, {result['peak_memory_mb']:.1f} MB peak"
+        ))
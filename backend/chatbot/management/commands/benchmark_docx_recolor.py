@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from chatbot.benchmarks import benchmark_recolor_in_place
+
+
+class Command(BaseCommand):
+    help = "Benchmarks recoloring the runs and table cells of a DOCX in place."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tables', type=int, default=50, help="Tables in the generated document.")
+        parser.add_argument('--rows', type=int, default=30, help="Rows per table.")
+        parser.add_argument('--cols', type=int, default=6, help="Columns per table.")
+        parser.add_argument('--runs', type=int, default=3, help="Recolorings to time with each method.")
+
+    def handle(self, *args, **options):
+        results = benchmark_recolor_in_place(options['tables'], options['rows'], options['cols'], options['runs'])
+        for method in ('proxies', 'xml'):
+            self.stdout.write(f"{method:<8} mean={results[method]['latency_mean_s']:.3f}s errors={results[method]['errors']}")
+        self.stdout.write(self.style.SUCCESS(f"Speedup x{results['speedup']:.1f}"))
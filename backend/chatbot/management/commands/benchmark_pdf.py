@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from chatbot.benchmarks import WORKLOADS, compare_results, run_benchmarks
+import json
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks PDF generation and editing against the offline LLM stand-in "
+        "across document sizes and concurrency levels. Run with LLM_PROVIDER=offline "
+        "on machines without a GROQ_API_KEY."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=list(WORKLOADS))
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1, 10, 50], help="Document sizes in sections of roughly one page.")
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4], help="Requests in flight at once.")
+        parser.add_argument('--runs', type=int, default=8, help="Requests per combination.")
+        parser.add_argument('--latency', type=float, default=0.0, help="Simulated seconds of latency per LLM call.")
+        parser.add_argument('--tokens-per-second', type=float, default=0.0, help="Simulated LLM output rate, 0 for instant output.")
+        parser.add_argument('--output', default='benchmark_results.json', help="Where to save the results as JSON.")
+        parser.add_argument('--compare', help="A previous results file to compare against.")
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            options['workloads'], options['sizes'], options['concurrency'], options['runs'],
+            latency=options['latency'], tokens_per_second=options['tokens_per_second'], log=self.stdout.write,
+        )
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Saved {len(results['results'])} results to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write(f"Compared to {options['compare']}:")
+            for line in compare_results(baseline, results):
+                self.stdout.write(line)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from chatbot.benchmarks import benchmark_pdf2docx_scaling
+import json
+import os
+
+
+class Command(BaseCommand):
+    help = "Benchmarks how page-parallel PDF to Word conversion scales with the number of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sections', type=int, default=400, help="Document size in sections of roughly half a page.")
+        parser.add_argument('--workers', nargs='+', type=int, default=sorted({1, 2, 4, os.cpu_count() or 1}), help="Worker process counts to compare.")
+        parser.add_argument('--chunk-pages', type=int, default=8, help="Pages parsed per task.")
+        parser.add_argument('--runs', type=int, default=3, help="Conversions per worker count.")
+        parser.add_argument('--output', default='pdf2docx_results.json', help="Where to save the results as JSON.")
+
+    def handle(self, *args, **options):
+        results = benchmark_pdf2docx_scaling(
+            options['sections'], options['workers'], options['chunk_pages'], options['runs'], log=self.stdout.write,
+        )
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted {results['meta']['pages']} pages on {results['meta']['cpu_count']} CPUs; saved results to {options['output']}"
+        ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.create_pdf.pdf_generator import get_checkpoint
+import json
+
+
+class Command(BaseCommand):
+    help = "Prints the per-stage checkpoint of a PDF generation run (e.g. 'job-42')."
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_id', help="The generation run id.")
+        parser.add_argument('--outputs', action='store_true', help="Include the full stage outputs.")
+
+    def handle(self, *args, **options):
+        checkpoint = get_checkpoint(options['run_id'])
+        if not checkpoint.stages:
+            raise CommandError(f"No checkpoint found at {checkpoint.path}")
+
+        for name, entry in checkpoint.stages.items():
+            line = f"{name}: {entry['status']} after {entry['attempts']} attempt(s)"
+            if entry['status'] == 'completed':
+                line += f" in {entry['duration']:.2f}s"
+            else:
+                line += f" - {entry['error']}"
+            self.stdout.write(line)
+            if options['outputs'] and entry['status'] == 'completed':
+                self.stdout.write(json.dumps(entry['outputs'], indent=2, default=str))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chatbot.jobs import start_workers
+import signal
+
+
+class Command(BaseCommand):
+    help = "Starts a pool of local worker processes that execute queued PDF generation jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.PDF_JOB_WORKERS, help="Number of worker processes.")
+        parser.add_argument('--poll-interval', type=float, default=settings.PDF_JOB_POLL_INTERVAL, help="Seconds to wait when the queue is empty.")
+
+    def handle(self, *args, **options):
+        workers = start_workers(options['workers'], options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS(f"Started {len(workers)} PDF worker(s). Press CTRL+C to stop."))
+
+        def stop(signum, frame):
+            for worker in workers:
+                worker.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        # Workers finish their current job before exiting
+        for worker in workers:
+            worker.join()
+        self.stdout.write("All PDF workers stopped.")
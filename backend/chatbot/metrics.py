@@ -0,0 +1,302 @@
+from django.conf import settings
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import threading
+import atexit
+import json
+import math
+import time
+import os
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, math.inf)
+
+# (name, seconds) of every span finished in the current request or job, or None outside of one
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('chatpdf_timings', default=None)
+
+
+class Histogram:
+    """Counts observations into cumulative buckets, one set of buckets per combination of label values."""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._samples: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            sample = self._samples.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample['counts'][i] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = [[list(key), {'counts': list(s['counts']), 'sum': s['sum'], 'count': s['count']}]
+                       for key, s in self._samples.items()]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labels),
+                'buckets': [str(bound) for bound in self.buckets], 'samples': samples}
+
+
+class Counter:
+    """A monotonically increasing total, one per combination of label values."""
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._samples: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._samples.items()]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labels), 'samples': samples}
+
+
+class MetricsRegistry:
+    """
+    The metrics of this process.
+
+    Web and worker processes save snapshots of their registry to METRICS_DIR, and the
+    `/metrics` view merges them with its own, so one scrape covers every process.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'chatpdf_stage_duration_seconds', 'Time spent in each pipeline stage.', labels=('stage',)))
+REQUEST_SECONDS = registry.register(Histogram(
+    'chatpdf_request_duration_seconds', 'Time spent handling each HTTP request, by view.', labels=('view',)))
+EDIT_INSTRUCTION_SECONDS = registry.register(Histogram(
+    'chatpdf_edit_instruction_duration_seconds',
+    'Time to carry out each edit instruction, by whether the rule-based parser or the LLM agent read it.', labels=('route',)))
+LLM_TOKENS = registry.register(Counter(
+    'chatpdf_llm_tokens_total', 'Tokens sent to and received from each LLM.', labels=('model', 'direction')))
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """
+    Times the block, adding it to the stage latency histogram and to the timings
+    of the current request or job.
+
+    Args:
+        name (str): The stage name; also used as the Server-Timing metric name.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, duration))
+
+
+@contextmanager
+def collect_timings() -> Iterator[List[Tuple[str, float]]]:
+    """Collects the spans finished inside the block, including those run on threads that copy the context."""
+    timings: List[Tuple[str, float]] = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def summarize_timings(timings: Sequence[Tuple[str, float]]) -> Dict[str, float]:
+    """Adds up the durations of repeated spans, keeping the order in which each name first finished."""
+    totals: Dict[str, float] = {}
+    for name, duration in timings:
+        totals[name] = totals.get(name, 0.0) + duration
+    return totals
+
+
+def server_timing_header(totals: Dict[str, float]) -> str:
+    """
+    Formats span durations as a Server-Timing header value.
+
+    Args:
+        totals (Dict[str, float]): Seconds spent per span name.
+
+    Returns:
+        str: Comma-separated `name;dur=milliseconds` entries.
+    """
+    return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in totals.items())
+
+
+def record_tokens(model: str, input_tokens: int, output_tokens: int) -> None:
+    LLM_TOKENS.inc(input_tokens, model=model, direction='input')
+    LLM_TOKENS.inc(output_tokens, model=model, direction='output')
+
+
+_snapshot_paths = set()
+_snapshot_lock = threading.Lock()
+
+
+def write_snapshot(directory: Optional[str] = None) -> None:
+    """
+    Saves this process's metrics so that the `/metrics` view of another process can include them.
+
+    The snapshot is deleted when the process exits.
+
+    Args:
+        directory (Optional[str]): Where to save the snapshot. Defaults to METRICS_DIR.
+    """
+    directory = directory or settings.METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with _snapshot_lock:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(path + '.tmp', path)
+        if not _snapshot_paths:
+            atexit.register(remove_snapshot)
+        _snapshot_paths.add(path)
+
+
+def remove_snapshot() -> None:
+    """Deletes the snapshots this process saved, once its metrics are no longer being updated."""
+    own = f"{os.getpid()}.json"
+    with _snapshot_lock:
+        # Forked children inherit the paths of their parent, whose snapshots are not theirs
+        for path in [path for path in _snapshot_paths if os.path.basename(path) == own]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            _snapshot_paths.discard(path)
+
+
+def process_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # running, as another user
+    return True
+
+
+def collect_snapshots(directory: Optional[str] = None) -> List[Dict[str, Dict[str, Any]]]:
+    """
+    Returns the metrics of this process followed by the snapshots saved by other processes.
+
+    Snapshots of processes that are no longer running are deleted instead, so a
+    restarted process is not counted twice.
+
+    Args:
+        directory (Optional[str]): Where snapshots are saved. Defaults to METRICS_DIR.
+
+    Returns:
+        List[Dict[str, Dict[str, Any]]]: One snapshot per process.
+    """
+    directory = directory or settings.METRICS_DIR
+    snapshots = [registry.snapshot()]
+    if not os.path.isdir(directory):
+        return snapshots
+    own = f"{os.getpid()}.json"
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json') or filename == own:
+            continue
+        path = os.path.join(directory, filename)
+        pid = filename[:-len('.json')]
+        if pid.isdigit() and not process_running(int(pid)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Skipping unreadable metrics snapshot {filename}: {e}")
+    return snapshots
+
+
+def merge_snapshots(snapshots: Sequence[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Adds up the samples of the same metric and label values across snapshots."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for key, value in metric['samples']:
+                key = tuple(key)
+                if metric['type'] == 'counter':
+                    target['samples'][key] = target['samples'].get(key, 0) + value
+                elif key not in target['samples']:
+                    target['samples'][key] = {'counts': list(value['counts']), 'sum': value['sum'], 'count': value['count']}
+                else:
+                    sample = target['samples'][key]
+                    sample['counts'] = [a + b for a, b in zip(sample['counts'], value['counts'])]
+                    sample['sum'] += value['sum']
+                    sample['count'] += value['count']
+    return merged
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render_metrics(snapshot: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Formats merged metrics in the Prometheus text exposition format.
+
+    Args:
+        snapshot (Dict[str, Dict[str, Any]]): The output of merge_snapshots.
+
+    Returns:
+        str: The metrics page.
+    """
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in metric['samples'].items():
+            if metric['type'] == 'counter':
+                lines.append(f"{name}{format_labels(metric['labels'], key)} {value}")
+                continue
+            for bound, count in zip(metric['buckets'], value['counts']):
+                le = '+Inf' if bound == 'inf' else bound
+                labels = format_labels(metric['labels'], key, f'le="{le}"')
+                lines.append(f"{name}_bucket{labels} {count}")
+            lines.append(f"{name}_sum{format_labels(metric['labels'], key)} {value['sum']}")
+            lines.append(f"{name}_count{format_labels(metric['labels'], key)} {value['count']}")
+    return "\n".join(lines) + "\n"
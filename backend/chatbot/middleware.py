@@ -1,7 +1,41 @@
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
+from .metrics import REQUEST_SECONDS, collect_timings, server_timing_header, summarize_timings, write_snapshot
+import time
 
 class XFrameOptionsMiddleware(MiddlewareMixin):
     def process_response(self, request, response):
         if request.path.startswith('/media/'):
             response['X-Frame-Options'] = 'ALLOW-FROM http://127.0.0.1:3000'  # Or the URL of your frontend
         return response
+
+
+class ServerTimingMiddleware:
+    """
+    Times each request and reports the spans it ran in a Server-Timing header,
+    alongside any timings the view already reported. Every so often it saves this
+    process's metrics, so the `/metrics` view of any web process includes them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.last_snapshot = None
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with collect_timings() as timings:
+            response = self.get_response(request)
+        totals = summarize_timings(timings)
+        totals['total'] = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        REQUEST_SECONDS.observe(totals['total'], view=match.url_name if match and match.url_name else 'unmatched')
+        now = time.monotonic()
+        if self.last_snapshot is None or now - self.last_snapshot >= settings.METRICS_SNAPSHOT_INTERVAL:
+            self.last_snapshot = now
+            write_snapshot()
+        header = server_timing_header(totals)
+        if response.has_header('Server-Timing'):
+            header = f"{response['Server-Timing']}, {header}"
+        response['Server-Timing'] = header
+        return response
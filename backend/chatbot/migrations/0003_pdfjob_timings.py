@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_pdfjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdfjob',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_pdfjob_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pdf',
+            name='document',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
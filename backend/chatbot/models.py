@@ -9,4 +9,32 @@ class PDF(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='pdfs')
     description = models.TextField()
     pdf_url = models.URLField()
+    # Hash of the PDF's content, which identifies its retrieval indexes; empty until it is indexed
+    document = models.CharField(max_length=64, blank=True, default='', db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+class PDFJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='jobs')
+    description = models.TextField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    pdf = models.OneToOneField(PDF, on_delete=models.SET_NULL, null=True, blank=True, related_name='job')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Seconds spent in each stage of the generation, by stage name
+    timings = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
@@ -0,0 +1,305 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from typing import Any, Dict, List, Optional, Tuple
+from .edit_pdf.content_stream import MUPDF_LOCK
+from .metrics import span
+import threading
+import hashlib
+import sqlite3
+import pymupdf
+import json
+import math
+import time
+import re
+
+REFERENCE_RE = re.compile(r'(\d+) 0 R')
+PARENT_RE = re.compile(r'/(?:Parent|P) \d+ 0 R')
+ZOOM_RANGE = (0.1, 2.0)
+
+
+def document_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def page_fingerprints(doc: pymupdf.Document) -> List[str]:
+    """
+    Fingerprints every page of a PDF by what it draws: its content streams, resources,
+    annotations and size. A page keeps its fingerprint when an edit leaves it alone, even
+    in another file, so its preview can be reused.
+
+    Args:
+        doc (pymupdf.Document): The open document.
+
+    Returns:
+        List[str]: A hex digest per page.
+    """
+    hashes: Dict[int, bytes] = {}
+
+    def object_hash(xref: int) -> bytes:
+        if xref in hashes:
+            return hashes[xref]
+        hashes[xref] = b'cycle'  # objects referring back to one in progress
+        digest = hashlib.sha256()
+        # Links back up the page tree would make every page depend on every other one
+        source = PARENT_RE.sub('', doc.xref_object(xref, compressed=True))
+        digest.update(REFERENCE_RE.sub('@', source).encode())
+        for reference in REFERENCE_RE.findall(source):
+            digest.update(object_hash(int(reference)))
+        if doc.xref_is_stream(xref):
+            digest.update(doc.xref_stream_raw(xref))
+        hashes[xref] = digest.digest()
+        return hashes[xref]
+
+    fingerprints = []
+    for page in doc:
+        digest = hashlib.sha256(object_hash(page.xref))
+        digest.update(f"{tuple(page.mediabox)} {page.rotation}".encode())
+        fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+
+def render_page(doc: pymupdf.Document, page: int, zoom: float) -> bytes:
+    """Renders a page to a PNG at `zoom` times 72 dpi."""
+    with span('preview_render'):
+        return doc[page].get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).tobytes('png')
+
+
+class PreviewCache:
+    """
+    On-disk cache of page previews and of the page fingerprints of each document.
+
+    Documents are identified by a hash of their content and pages by their fingerprint,
+    so after an edit only the pages it changed are rendered again. The hash of each stored
+    file is remembered with its size and modification time, so an unchanged file is not
+    read again. The least recently used previews are evicted once they exceed `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS preview_images ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS preview_images_last_used ON preview_images (last_used)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS preview_documents ("
+            "document TEXT PRIMARY KEY, fingerprints TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS preview_files ("
+            "name TEXT PRIMARY KEY, size INTEGER NOT NULL, modified REAL NOT NULL, document TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(fingerprint: str, zoom: float) -> str:
+        return f"{fingerprint}:{zoom:.2f}"
+
+    def get_fingerprints(self, document: str) -> Optional[List[str]]:
+        """Returns the page fingerprints stored for a document hash, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprints FROM preview_documents WHERE document = ?", (document,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE preview_documents SET last_used = ? WHERE document = ?", (time.time(), document))
+                self._conn.commit()
+        return json.loads(row[0]) if row else None
+
+    def get_document(self, name: str, size: int, modified: float) -> Optional[str]:
+        """Returns the document hash stored for a file, or None when the file changed since."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT document FROM preview_files WHERE name = ? AND size = ? AND modified = ?", (name, size, modified)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_document(self, name: str, size: int, modified: float, document: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO preview_files (name, size, modified, document) VALUES (?, ?, ?, ?)",
+                (name, size, modified, document),
+            )
+            self._conn.commit()
+
+    def set_fingerprints(self, document: str, fingerprints: List[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO preview_documents (document, fingerprints, last_used) VALUES (?, ?, ?)",
+                (document, json.dumps(fingerprints), time.time()),
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached preview for the key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM preview_images WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE preview_images SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return bytes(row[0])
+
+    def set(self, key: str, value: bytes) -> None:
+        """Stores a preview and evicts least recently used previews beyond max_bytes."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO preview_images (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM preview_images").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM preview_images ORDER BY last_used"):
+            if total - freed <= self.max_bytes:
+                break
+            stale.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM preview_images WHERE key = ?", stale)
+        # Fingerprints are small, but documents nobody previews any more need not be kept
+        self._conn.execute(
+            "DELETE FROM preview_documents WHERE document NOT IN "
+            "(SELECT document FROM preview_documents ORDER BY last_used DESC LIMIT 1000)"
+        )
+
+    def clear(self) -> None:
+        """Removes every entry and resets the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM preview_images")
+            self._conn.execute("DELETE FROM preview_documents")
+            self._conn.execute("DELETE FROM preview_files")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters for this process and the current size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM preview_images").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+_preview_cache: Optional[PreviewCache] = None
+_preview_cache_lock = threading.Lock()
+
+
+def get_preview_cache() -> Optional[PreviewCache]:
+    """Returns the process-wide cache, or None when caching is disabled."""
+    global _preview_cache
+    if not settings.PREVIEW_CACHE_ENABLED:
+        return None
+    with _preview_cache_lock:
+        if _preview_cache is None:
+            _preview_cache = PreviewCache(settings.PREVIEW_CACHE_PATH, settings.PREVIEW_CACHE_MAX_BYTES)
+    return _preview_cache
+
+
+def clamp_zoom(zoom: float) -> float:
+    """Limits a zoom to ZOOM_RANGE, rounded to two decimals; raises ValueError for NaN and infinities."""
+    if not math.isfinite(zoom):
+        raise ValueError(f"zoom must be finite, not {zoom}")
+    return round(min(max(zoom, ZOOM_RANGE[0]), ZOOM_RANGE[1]), 2)
+
+
+class DocumentPreview:
+    """
+    Previews of the pages of one stored PDF.
+
+    Reading and hashing the file happens only when its size or modification time changed
+    since it was last hashed, and opening the PDF and fingerprinting its pages only when a
+    fingerprint or a preview is not cached yet.
+    """
+
+    def __init__(self, name: str, cache: Optional[PreviewCache] = None):
+        self.name = name
+        self.cache = cache
+        self.size = default_storage.size(name)
+        try:
+            self.modified = default_storage.get_modified_time(name).timestamp()
+        except NotImplementedError:
+            self.modified = None  # storages without modification times are hashed every time
+        self._data: Optional[bytes] = None
+        self._document: Optional[str] = None
+        self._doc: Optional[pymupdf.Document] = None
+        self._fingerprints: Optional[List[str]] = None
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            with default_storage.open(self.name, 'rb') as f:
+                self._data = f.read()
+        return self._data
+
+    @property
+    def document(self) -> str:
+        """The hash of the file's content."""
+        if self._document is None:
+            remembered = self.cache is not None and self.modified is not None
+            if remembered:
+                self._document = self.cache.get_document(self.name, self.size, self.modified)
+            if self._document is None:
+                self._document = document_hash(self.data)
+                if remembered:
+                    self.cache.set_document(self.name, self.size, self.modified, self._document)
+        return self._document
+
+    def open(self) -> pymupdf.Document:
+        if self._doc is None:
+            self._doc = pymupdf.open(stream=self.data, filetype="pdf")
+        return self._doc
+
+    def close(self) -> None:
+        if self._doc is not None:
+            with MUPDF_LOCK:
+                self._doc.close()
+            self._doc = None
+
+    def fingerprints(self) -> List[str]:
+        """Returns the fingerprint of every page."""
+        if self._fingerprints is None:
+            self._fingerprints = self.cache.get_fingerprints(self.document) if self.cache else None
+        if self._fingerprints is None:
+            with MUPDF_LOCK:
+                self._fingerprints = page_fingerprints(self.open())
+            if self.cache:
+                self.cache.set_fingerprints(self.document, self._fingerprints)
+        return self._fingerprints
+
+    def page_image(self, page: int, zoom: float) -> Tuple[bytes, str]:
+        """
+        Returns a page rendered as a PNG, from the cache when that page was rendered before.
+
+        Args:
+            page (int): Index of the page, counted from 0.
+            zoom (float): Scale relative to 72 dpi.
+
+        Returns:
+            Tuple[bytes, str]: The PNG and the page's fingerprint.
+        """
+        fingerprint = self.fingerprints()[page]
+        key = PreviewCache.make_key(fingerprint, zoom)
+        image = self.cache.get(key) if self.cache else None
+        if image is None:
+            with MUPDF_LOCK:
+                image = render_page(self.open(), page, zoom)
+            if self.cache:
+                self.cache.set(key, image)
+        return image, fingerprint
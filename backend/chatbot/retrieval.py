@@ -0,0 +1,382 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from langchain_core.prompts import ChatPromptTemplate
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from .llm import get_chat_model
+from .llm_cache import cached_invoke
+from .metrics import span
+from .models import PDF
+from .text_layer import get_text_layer_store
+from .vectors import VectorStore, get_vector_store
+from array import array
+import threading
+import hashlib
+import sqlite3
+import heapq
+import math
+import time
+import re
+
+WORD_RE = re.compile(r'\S+')
+TERM_RE = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset(
+    'a an and are as at be but by for from has have in is it its of on or that the their this to was were will with'.split()
+)
+# BM25 parameters: term frequency saturation and document length normalization
+K1 = 1.5
+B = 0.75
+
+llm = get_chat_model("llama3-70b-8192", 0.2)
+
+
+def document_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases a text and splits it into the terms that are indexed, without stop words."""
+    return [term for term in TERM_RE.findall(text.lower()) if term not in STOP_WORDS]
+
+
+class Chunk:
+    """A passage of one page, with its character offsets in the page's text."""
+
+    __slots__ = ('page', 'start', 'end', 'text')
+
+    def __init__(self, page: int, start: int, end: int, text: str):
+        self.page = page
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def __repr__(self):
+        return f"Chunk(page={self.page}, start={self.start}, end={self.end})"
+
+
+def chunk_pages(pages: List[str], size: int = 200, overlap: int = 50) -> List[Chunk]:
+    """
+    Splits page texts into overlapping passages of about `size` words.
+
+    A passage never crosses a page, so each answer can cite the page it came from.
+
+    Args:
+        pages (List[str]): The text of each page.
+        size (int): Words per passage.
+        overlap (int): Words shared by consecutive passages of a page.
+
+    Returns:
+        List[Chunk]: The passages in reading order, pages counted from 1.
+    """
+    step = max(1, size - overlap)
+    chunks = []
+    for number, text in enumerate(pages, start=1):
+        words = [match.span() for match in WORD_RE.finditer(text)]
+        for first in range(0, len(words), step):
+            last = min(first + size, len(words)) - 1
+            start, end = words[first][0], words[last][1]
+            chunks.append(Chunk(number, start, end, text[start:end]))
+            if last == len(words) - 1:
+                break
+    return chunks
+
+
+class BM25Index:
+    """
+    Inverted index of a document's passages, scored with BM25.
+
+    Each term maps to the passages containing it and how often it occurs in each, packed in
+    arrays so a large document's index stays compact and can be stored as is.
+    """
+
+    def __init__(self, lengths: array, postings: Dict[str, Tuple[array, array]]):
+        self.lengths = lengths
+        self.postings = postings
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def build(cls, chunks: List[Chunk]) -> 'BM25Index':
+        lengths = array('I')
+        postings: Dict[str, Tuple[array, array]] = {}
+        for i, chunk in enumerate(chunks):
+            counts: Dict[str, int] = {}
+            terms = tokenize(chunk.text)
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            lengths.append(len(terms))
+            for term, count in counts.items():
+                if term not in postings:
+                    postings[term] = (array('I'), array('I'))
+                postings[term][0].append(i)
+                postings[term][1].append(count)
+        return cls(lengths, postings)
+
+    def scores(self, query: str, postings: Optional[Dict[str, Tuple[array, array]]] = None) -> Dict[int, float]:
+        """
+        Scores the passages containing any term of the query.
+
+        Args:
+            query (str): The question or search terms.
+            postings (Dict[str, Tuple[array, array]], optional): Postings of the query terms when
+                they are not all held by the index, as when it is read from a RetrievalStore.
+
+        Returns:
+            Dict[int, float]: BM25 scores by passage index.
+        """
+        postings = self.postings if postings is None else postings
+        count = len(self.lengths)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            if term not in postings:
+                continue
+            chunks, frequencies = postings[term]
+            idf = math.log(1 + (count - len(chunks) + 0.5) / (len(chunks) + 0.5))
+            for chunk, frequency in zip(chunks, frequencies):
+                norm = K1 * (1 - B + B * self.lengths[chunk] / self.average_length)
+                scores[chunk] = scores.get(chunk, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+        return scores
+
+    def search(self, query: str, k: int = 4, postings: Optional[Dict[str, Tuple[array, array]]] = None) -> List[Tuple[int, float]]:
+        """Returns the indexes and scores of the `k` best passages for the query, best first."""
+        return heapq.nlargest(k, self.scores(query, postings).items(), key=lambda item: item[1])
+
+
+class RetrievalStore:
+    """
+    On-disk BM25 indexes of PDFs, keyed by a hash of their content.
+
+    Only the postings of the query's terms and the passages returned are read for a search,
+    so a large document is searched without loading its whole index.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval_documents ("
+            "document TEXT PRIMARY KEY, lengths BLOB NOT NULL, pages INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval_chunks ("
+            "document TEXT NOT NULL, chunk INTEGER NOT NULL, page INTEGER NOT NULL, start INTEGER NOT NULL, "
+            "end INTEGER NOT NULL, text TEXT NOT NULL, PRIMARY KEY (document, chunk))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval_postings ("
+            "document TEXT NOT NULL, term TEXT NOT NULL, chunks BLOB NOT NULL, frequencies BLOB NOT NULL, "
+            "PRIMARY KEY (document, term))"
+        )
+        self._conn.commit()
+
+    def has(self, document: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM retrieval_documents WHERE document = ?", (document,)).fetchone() is not None
+
+    def add(self, document: str, chunks: List[Chunk], pages: int) -> None:
+        """Indexes the passages of a document, replacing any earlier index of it."""
+        index = BM25Index.build(chunks)
+        with self._lock:
+            self._remove(document)
+            self._conn.executemany(
+                "INSERT INTO retrieval_chunks (document, chunk, page, start, end, text) VALUES (?, ?, ?, ?, ?, ?)",
+                ((document, i, chunk.page, chunk.start, chunk.end, chunk.text) for i, chunk in enumerate(chunks)),
+            )
+            self._conn.executemany(
+                "INSERT INTO retrieval_postings (document, term, chunks, frequencies) VALUES (?, ?, ?, ?)",
+                ((document, term, ids.tobytes(), frequencies.tobytes()) for term, (ids, frequencies) in index.postings.items()),
+            )
+            # Written last, so a document is only found once its index is complete
+            self._conn.execute(
+                "INSERT INTO retrieval_documents (document, lengths, pages, created) VALUES (?, ?, ?, ?)",
+                (document, index.lengths.tobytes(), pages, time.time()),
+            )
+            self._conn.commit()
+
+    def search(self, document: str, query: str, k: int = 4) -> List[Tuple[Chunk, float]]:
+        """
+        Finds the passages of an indexed document that best match the query.
+
+        Args:
+            document (str): The document's hash.
+            query (str): The question or search terms.
+            k (int): Number of passages to return.
+
+        Returns:
+            List[Tuple[Chunk, float]]: The passages and their scores, best first; empty when
+            the document is not indexed or no passage contains a query term.
+        """
+        terms = sorted(set(tokenize(query)))
+        with self._lock:
+            row = self._conn.execute("SELECT lengths FROM retrieval_documents WHERE document = ?", (document,)).fetchone()
+            if row is None or not terms:
+                return []
+            lengths = array('I')
+            lengths.frombytes(row[0])
+            postings = {}
+            for term, ids, frequencies in self._conn.execute(
+                f"SELECT term, chunks, frequencies FROM retrieval_postings WHERE document = ? AND term IN ({', '.join('?' * len(terms))})",
+                (document, *terms),
+            ):
+                postings[term] = (array('I'), array('I'))
+                postings[term][0].frombytes(ids)
+                postings[term][1].frombytes(frequencies)
+        best = BM25Index(lengths, {}).search(query, k, postings)
+        chunks = self.chunks(document, [chunk for chunk, _ in best])
+        return [(chunks[chunk], score) for chunk, score in best]
+
+    def chunks(self, document: str, ids: Optional[Sequence[int]] = None) -> Dict[int, Chunk]:
+        """Returns passages of an indexed document by their index, all of them when `ids` is None."""
+        if ids is not None and not ids:
+            return {}
+        query = "SELECT chunk, page, start, end, text FROM retrieval_chunks WHERE document = ?"
+        if ids is not None:
+            query += f" AND chunk IN ({', '.join('?' * len(ids))})"
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY chunk", (document, *(ids or ()))).fetchall()
+        return {chunk: Chunk(page, start, end, text) for chunk, page, start, end, text in rows}
+
+    def _remove(self, document: str) -> None:
+        for table in ('retrieval_documents', 'retrieval_chunks', 'retrieval_postings'):
+            self._conn.execute(f"DELETE FROM {table} WHERE document = ?", (document,))
+
+    def clear(self) -> None:
+        with self._lock:
+            for table in ('retrieval_documents', 'retrieval_chunks', 'retrieval_postings'):
+                self._conn.execute(f"DELETE FROM {table}")
+            self._conn.commit()
+
+
+_retrieval_store: Optional[RetrievalStore] = None
+_retrieval_store_lock = threading.Lock()
+
+
+def get_retrieval_store() -> RetrievalStore:
+    """Returns the process-wide store of document indexes."""
+    global _retrieval_store
+    with _retrieval_store_lock:
+        if _retrieval_store is None:
+            _retrieval_store = RetrievalStore(settings.RETRIEVAL_INDEX_PATH)
+    return _retrieval_store
+
+
+def storage_name(pdf_url: str) -> str:
+    """Returns the storage name of a PDF from the URL it is served at."""
+    return pdf_url[len(settings.MEDIA_URL):] if pdf_url.startswith(settings.MEDIA_URL) else pdf_url
+
+
+def index_document(name: str, store: Optional[RetrievalStore] = None, vectors: Optional[VectorStore] = None) -> str:
+    """
+    Extracts, chunks and indexes the text of a stored PDF unless its content was indexed before.
+
+    The text is read from the PDF's text layer, which is extracted here the first time. The
+    passages get both a BM25 index and embeddings; documents indexed before embeddings existed
+    get them from their stored passages.
+
+    Args:
+        name (str): The PDF's name in the default storage.
+        store (RetrievalStore, optional): Where the BM25 index is kept, defaults to the process-wide store.
+        vectors (VectorStore, optional): Where the embeddings are kept, defaults to the process-wide store.
+
+    Returns:
+        str: The document's hash, which identifies its indexes.
+    """
+    with default_storage.open(name, 'rb') as f:
+        data = f.read()
+    store = store or get_retrieval_store()
+    vectors = vectors or get_vector_store()
+    document = document_hash(data)
+    chunks = None
+    if not store.has(document):
+        with span('retrieval_index'):
+            pages = get_text_layer_store().load(data).pages()
+            chunks = chunk_pages(pages, settings.RETRIEVAL_CHUNK_WORDS, settings.RETRIEVAL_CHUNK_OVERLAP)
+            store.add(document, chunks, len(pages))
+    if not vectors.has(document):
+        with span('retrieval_embed'):
+            chunks = chunks if chunks is not None else list(store.chunks(document).values())
+            vectors.add(document, [chunk.text for chunk in chunks])
+    return document
+
+
+def pdf_document(pdf: PDF, store: Optional[RetrievalStore] = None, vectors: Optional[VectorStore] = None) -> str:
+    """Returns the hash of a PDF's content, indexing the PDF first if it was added before indexing."""
+    if not pdf.document:
+        pdf.document = index_document(storage_name(pdf.pdf_url), store, vectors)
+        pdf.save(update_fields=['document'])
+    return pdf.document
+
+
+def search_pdfs(pdfs: Iterable[PDF], query: str, k: Optional[int] = None, store: Optional[RetrievalStore] = None,
+                vectors: Optional[VectorStore] = None) -> List[Dict[str, Any]]:
+    """
+    Finds the passages closest in meaning to the query across several PDFs, such as all of a user's.
+
+    Args:
+        pdfs (Iterable[PDF]): The PDFs to search; missing files are skipped.
+        query (str): What to look for.
+        k (int, optional): Passages to return, defaults to settings.RETRIEVAL_TOP_K.
+        store (RetrievalStore, optional): Where the passages are kept, defaults to the process-wide store.
+        vectors (VectorStore, optional): Where the embeddings are kept, defaults to the process-wide store.
+
+    Returns:
+        List[Dict[str, Any]]: The best passages, each with its PDF id, conversation, page, offsets, score and text.
+    """
+    store = store or get_retrieval_store()
+    vectors = vectors or get_vector_store()
+    by_document: Dict[str, PDF] = {}
+    for pdf in pdfs:
+        try:
+            by_document.setdefault(pdf_document(pdf, store, vectors), pdf)
+        except FileNotFoundError:
+            continue
+    with span('retrieval_search'):
+        matches = vectors.search(list(by_document), [query], k or settings.RETRIEVAL_TOP_K)[0]
+    results = []
+    for document, chunk_id, score in matches:
+        chunk = store.chunks(document, [chunk_id])[chunk_id]
+        pdf = by_document[document]
+        results.append({'pdf': pdf.id, 'conversation': pdf.conversation_id, 'page': chunk.page, 'start': chunk.start,
+                        'end': chunk.end, 'score': round(score, 4), 'text': chunk.text})
+    return results
+
+
+def format_sources(passages: Iterable[Tuple[Chunk, float]]) -> str:
+    return "\n\n".join(f"[Page {chunk.page}]\n{chunk.text}" for chunk, _ in passages)
+
+
+def answer_question(pdf: PDF, question: str, k: Optional[int] = None, store: Optional[RetrievalStore] = None) -> Dict[str, Any]:
+    """
+    Answers a question about a stored PDF from the passages most relevant to it.
+
+    Only the `k` best passages by BM25 are put in the prompt, rather than the whole document.
+
+    Args:
+        pdf (PDF): The PDF asked about.
+        question (str): The user's question.
+        k (int, optional): Passages to include, defaults to settings.RETRIEVAL_TOP_K.
+        store (RetrievalStore, optional): Where the index is kept, defaults to the process-wide store.
+
+    Returns:
+        Dict[str, Any]: The `answer` and its `sources`, each with the page, offsets, score and text of a passage.
+    """
+    store = store or get_retrieval_store()
+    document = pdf_document(pdf, store)
+    with span('retrieval_search'):
+        passages = store.search(document, question, k or settings.RETRIEVAL_TOP_K)
+
+    if passages:
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "Answer the question using only the passages of the document below. Cite the pages you used. "
+                       "If the passages do not contain the answer, say so.\n\n{passages}"),
+            ("human", "{question}"),
+        ])
+        answer = cached_invoke(prompt, llm, {"passages": format_sources(passages), "question": question})
+    else:
+        answer = "The document does not appear to mention that."
+    return {
+        'answer': answer,
+        'sources': [
+            {'page': chunk.page, 'start': chunk.start, 'end': chunk.end, 'score': round(score, 4), 'text': chunk.text}
+            for chunk, score in passages
+        ],
+    }
@@ -1,6 +1,6 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Conversation, PDF
+from .models import Conversation, PDF, PDFJob
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -17,7 +17,15 @@ class UserSerializer(serializers.ModelSerializer):
 class PDFSerializer(serializers.ModelSerializer):
     class Meta:
         model = PDF
-        fields = ['description', 'pdf_url', 'created_at']
+        fields = ['id', 'description', 'pdf_url', 'created_at']
+
+
+class PDFJobSerializer(serializers.ModelSerializer):
+    pdf_url = serializers.CharField(source='pdf.pdf_url', read_only=True, default=None)
+
+    class Meta:
+        model = PDFJob
+        fields = ['id', 'conversation', 'description', 'status', 'pdf_url', 'error', 'timings', 'created_at', 'started_at', 'finished_at']
 
 
 class ConversationSerializer(serializers.ModelSerializer):
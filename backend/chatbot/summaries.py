@@ -0,0 +1,109 @@
+from django.conf import settings
+from langchain_core.prompts import ChatPromptTemplate
+from typing import Any, List, Optional
+from .llm_cache import acached_invoke
+from .metrics import span
+import asyncio
+import zlib
+import re
+
+# Page breaks, Markdown headings and blank lines, where a text may be cut into chunks
+SECTION_RE = re.compile(r'\f|\n(?=#{1,6} )|\n\s*\n')
+# About one section in BOUNDARY_ODDS ends a chunk once the chunk is half full
+BOUNDARY_ODDS = 4
+
+CHUNK_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a highly skilled text summarizer. The text is one part of a longer document."),
+    ("human", "Summarize the following part of the document, keeping its key facts and figures:\n\n{text}"),
+])
+REDUCE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a highly skilled text summarizer."),
+    ("human", "Summarize these summaries of consecutive parts of one document as a single summary:\n\n{text}"),
+])
+
+
+def split_sections(text: str, max_words: int) -> List[str]:
+    """
+    Cuts a text into chunks of at most about `max_words` words at page breaks, headings or blank lines.
+
+    Whether a chunk ends after a section depends on the section's own content, not only on how
+    full the chunk is, so an edit to one section moves the chunk boundaries near it but leaves
+    the chunks further away, and their cached summaries, as they were.
+
+    Args:
+        text (str): The document's text, with pages separated by form feeds.
+        max_words (int): Words per chunk; longer sections are split between words.
+
+    Returns:
+        List[str]: The chunks in reading order.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    count = 0
+    for section in SECTION_RE.split(text):
+        words = section.split()
+        if not words:
+            continue
+        if len(words) > max_words:
+            # A section too long for a chunk of its own is cut into equal pieces
+            pieces = -(-len(words) // max_words)
+            size = -(-len(words) // pieces)
+            parts = [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+        else:
+            parts = [section.strip()]
+        for part in parts:
+            length = len(part.split())
+            if current and count + length > max_words:
+                chunks.append("\n\n".join(current))
+                current, count = [], 0
+            current.append(part)
+            count += length
+            if count >= max_words // 2 and zlib.crc32(part.encode()) % BOUNDARY_ODDS == 0:
+                chunks.append("\n\n".join(current))
+                current, count = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+async def summarize(text: str, llm: Any, chunk_words: Optional[int] = None, concurrency: Optional[int] = None,
+                    fanout: Optional[int] = None) -> str:
+    """
+    Summarizes a text of any length with map-reduce.
+
+    The text is cut into chunks that are summarized concurrently, at most `concurrency` at a
+    time, and the summaries are combined `fanout` at a time, level by level, into one. Every
+    call goes through the LLM cache, whose key is a hash of the prompt and so of the chunk's
+    content: summarizing an edited document again only calls the model for the chunks that
+    changed and the combined summaries above them.
+
+    Args:
+        text (str): The text, with pages separated by form feeds.
+        llm (Any): The chat model.
+        chunk_words (int, optional): Words per chunk, defaults to settings.SUMMARY_CHUNK_WORDS.
+        concurrency (int, optional): Model calls in flight at once, defaults to settings.SUMMARY_CONCURRENCY.
+        fanout (int, optional): Summaries combined per call, defaults to settings.SUMMARY_REDUCE_FANOUT.
+
+    Returns:
+        str: The summary; empty for a text without words.
+    """
+    fanout = max(2, fanout or settings.SUMMARY_REDUCE_FANOUT)
+    semaphore = asyncio.Semaphore(concurrency or settings.SUMMARY_CONCURRENCY)
+
+    async def run(prompt: ChatPromptTemplate, text: str) -> str:
+        async with semaphore:
+            return await acached_invoke(prompt, llm, {"text": text})
+
+    async def combine(group: List[str]) -> str:
+        return group[0] if len(group) == 1 else await run(REDUCE_PROMPT, "\n\n".join(group))
+
+    chunks = split_sections(text, chunk_words or settings.SUMMARY_CHUNK_WORDS)
+    if not chunks:
+        return ""
+    with span('summary_map'):
+        summaries = await asyncio.gather(*(run(CHUNK_PROMPT, chunk) for chunk in chunks))
+    with span('summary_reduce'):
+        while len(summaries) > 1:
+            groups = [summaries[i:i + fanout] for i in range(0, len(summaries), fanout)]
+            summaries = await asyncio.gather(*(combine(group) for group in groups))
+    return summaries[0]
@@ -1,6 +1,44 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from django.conf import settings
+from django.core.files.storage import default_storage
+from langchain_core.prompts import ChatPromptTemplate
+from unittest.mock import Mock, patch
+from pydantic import BaseModel
+from .models import Conversation, PDF, PDFJob
+from .jobs import claim_next_job, run_job
+from .llm_cache import LLMCache, cached_invoke
+from .create_pdf.pdf_generator import create_pdf, render_pdf
+from .create_pdf import pdf_generator
+from .llm import DEFAULT_TOOL_ARGS, OfflineChatModel, edit_instructions
+from .benchmarks import BENCHMARK_SETTINGS, measure, offline_models, percentile
+from .metrics import Histogram, collect_snapshots, collect_timings, merge_snapshots, registry, remove_snapshot, render_metrics, span, write_snapshot
+from .previews import PreviewCache
+from .retrieval import BM25Index, RetrievalStore, chunk_pages, index_document
+from .summaries import split_sections, summarize
+from .text_layer import HEADER, TextLayer, TextLayerStore, encode_text_layer, extract_text_layer
+from .edit_pdf.editor import replace_text_in_pdf
+from .vectors import VectorIndex, VectorStore, embed, train_coarse_quantizer
+from .edit_pdf.editor import PDFEditor
+from .edit_pdf.edit_plan import EditPlan
+from .edit_pdf.test_content_stream import sample_pdf, text_spans
+from .edit_pdf.tool_results import tool_results
+from django.core.files.base import ContentFile
+from reportlab.pdfgen import canvas
+import numpy as np
+import pymupdf
+import hashlib
+import asyncio
+import tempfile
+import shutil
+import subprocess
+import sys
+import time
+import io
+import json
+import os
 
 class AuthenticationAPITests(APITestCase):
     def test_get_token(self):
@@ -50,3 +88,750 @@ class UserRegistrationTests(APITestCase):
         response = self.client.post('/chatbot/user/register/', data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('password', response.data)
+
+class PDFJobTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.client.force_authenticate(user=self.user)
+
+    def test_generate_pdf_queues_job(self):
+        # Ensure the request returns immediately with a queued job
+        response = self.client.post('/api/chatbot/generate-pdf/', {'description': 'A PDF about cats'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = PDFJob.objects.get(id=response.json()['jobId'])
+        self.assertEqual(job.status, PDFJob.QUEUED)
+        self.assertEqual(job.conversation.user, self.user)
+
+    def test_generate_pdf_empty_description(self):
+        response = self.client.post('/api/chatbot/generate-pdf/', {'description': ''}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(PDFJob.objects.count(), 0)
+
+    @patch('chatbot.jobs.generate_pdf_from_description', return_value='/media/test.pdf')
+    def test_worker_fills_pdf_row(self, mock_generate):
+        response = self.client.post('/api/chatbot/generate-pdf/', {'description': 'A PDF about cats'}, format='json')
+        job = claim_next_job()
+        self.assertEqual(job.status, PDFJob.RUNNING)
+        self.assertIsNone(claim_next_job())
+
+        run_job(job)
+        mock_generate.assert_called_once_with('A PDF about cats', run_id=f'job-{job.id}')
+        self.assertEqual(PDF.objects.get().pdf_url, '/media/test.pdf')
+
+        status_response = self.client.get(f"/api/chatbot/jobs/{response.json()['jobId']}/")
+        self.assertEqual(status_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(status_response.json()['status'], PDFJob.SUCCEEDED)
+        self.assertEqual(status_response.json()['pdf_url'], '/media/test.pdf')
+
+    @patch('chatbot.jobs.generate_pdf_from_description', return_value='')
+    def test_worker_marks_failed_job(self, mock_generate):
+        self.client.post('/api/chatbot/generate-pdf/', {'description': 'A PDF about cats'}, format='json')
+        job = run_job(claim_next_job())
+        self.assertEqual(job.status, PDFJob.FAILED)
+        self.assertTrue(job.error)
+        self.assertEqual(PDF.objects.count(), 0)
+
+    def test_job_status_of_other_user(self):
+        # Ensure users cannot poll jobs they do not own
+        response = self.client.post('/api/chatbot/generate-pdf/', {'description': 'A PDF about cats'}, format='json')
+        other = User.objects.create_user(username='otheruser', password='TestPassword123')
+        self.client.force_authenticate(user=other)
+        status_response = self.client.get(f"/api/chatbot/jobs/{response.json()['jobId']}/")
+        self.assertEqual(status_response.status_code, status.HTTP_404_NOT_FOUND)
+
+class LLMCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = LLMCache(os.path.join(self.tmpdir.name, 'cache.sqlite3'), max_bytes=1024, ttl=60)
+        self.llm = Mock(model_name='test-model', temperature=0.7)
+        self.llm.invoke.return_value.content = ' cached response '
+        self.prompt = ChatPromptTemplate.from_messages([("human", "Say {text}")])
+
+    def tearDown(self):
+        self.cache._conn.close()
+        self.tmpdir.cleanup()
+
+    def test_key_depends_on_model_temperature_and_prompt(self):
+        key = LLMCache.make_key(self.llm, 'prompt')
+        self.assertEqual(key, LLMCache.make_key(Mock(model_name='test-model', temperature=0.7), 'prompt'))
+        self.assertNotEqual(key, LLMCache.make_key(Mock(model_name='test-model', temperature=0.2), 'prompt'))
+        self.assertNotEqual(key, LLMCache.make_key(Mock(model_name='other-model', temperature=0.7), 'prompt'))
+        self.assertNotEqual(key, LLMCache.make_key(self.llm, 'other prompt'))
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.set('key', {'a': 1})
+        self.assertEqual(self.cache.get('key'), {'a': 1})
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_lru_eviction(self):
+        # Each value is ~400 bytes, so only two fit in 1024 bytes
+        self.cache.set('first', 'x' * 400)
+        self.cache.set('second', 'x' * 400)
+        self.cache.get('first')
+        self.cache.set('third', 'x' * 400)
+        self.assertIsNotNone(self.cache.get('first'))
+        self.assertIsNone(self.cache.get('second'))
+        self.assertIsNotNone(self.cache.get('third'))
+
+    def test_ttl_expiry(self):
+        self.cache.set('key', 'value')
+        self.cache.ttl = -1
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_cached_invoke(self):
+        with patch('chatbot.llm_cache.get_llm_cache', return_value=self.cache):
+            first = cached_invoke(self.prompt, self.llm, {'text': 'hi'})
+            second = cached_invoke(self.prompt, self.llm, {'text': 'hi'})
+            cached_invoke(self.prompt, self.llm, {'text': 'hi'}, use_cache=False)
+        self.assertEqual(first, 'cached response')
+        self.assertEqual(second, 'cached response')
+        self.assertEqual(self.llm.invoke.call_count, 2)
+
+    def test_sampled_content_is_not_cached_by_default(self):
+        with patch('chatbot.llm_cache.get_llm_cache', return_value=self.cache), \
+                patch.object(pdf_generator, 'llm_llama', self.llm), patch.object(pdf_generator, 'llm_mixtral', self.llm):
+            pdf_generator.create_content('cats')
+            pdf_generator.create_content('cats')
+            pdf_generator.refine_content_and_structure('draft', 'cats')
+            pdf_generator.refine_content_and_structure('draft', 'cats')
+            self.assertEqual(self.llm.invoke.call_count, 4)
+            with override_settings(LLM_CACHE_GENERATED_CONTENT=True):
+                pdf_generator.create_content('dogs')
+                pdf_generator.create_content('dogs')
+            self.assertEqual(self.llm.invoke.call_count, 5)
+
+    def test_unparseable_response_is_not_cached(self):
+        def parse(text):
+            raise ValueError('bad response')
+
+        with patch('chatbot.llm_cache.get_llm_cache', return_value=self.cache):
+            with self.assertRaises(ValueError):
+                cached_invoke(self.prompt, self.llm, {'text': 'hi'}, parse=parse)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class PDFStorageTests(SimpleTestCase):
+    content = "# Title\n\nSome text.\n\n```python\nprint('hi')\n```\n"
+
+    def test_render_pdf_in_memory(self):
+        pdf_bytes = render_pdf(self.content, {'backColor': '#000000', 'textColor': '#FFFFFF'})
+        self.assertTrue(pdf_bytes.startswith(b'%PDF'))
+
+    def test_create_pdf_saves_to_storage(self):
+        pdf_url = create_pdf(self.content, {})
+        self.assertTrue(pdf_url.startswith('/media/'))
+        name = pdf_url[len('/media/'):]
+        self.assertTrue(default_storage.exists(name))
+
+    def test_serve_media_streams_pdf(self):
+        pdf_url = create_pdf(self.content, {})
+        response = self.client.get(pdf_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content)
+        self.assertTrue(body.startswith(b'%PDF'))
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_failed_render_reruns_on_resume(self):
+        # A render that fails after its retries must not be checkpointed as done
+        checkpoints = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpoints)
+        render = Mock(side_effect=[OSError('disk full'), OSError('disk full'), render_pdf(self.content, {})])
+        with offline_models(1, 0, 0), override_settings(PIPELINE_CHECKPOINT_DIR=checkpoints), \
+                patch.object(pdf_generator, 'render_pdf', render), patch('chatbot.create_pdf.pipeline.time.sleep'):
+            with self.assertRaises(OSError):
+                pdf_generator.generate_pdf_from_description('A PDF about cats', run_id='resume')
+            self.assertEqual(render.call_count, 2)
+            self.assertEqual(pdf_generator.get_checkpoint('resume').stages['render']['status'], 'failed')
+
+            pdf_url = pdf_generator.generate_pdf_from_description('A PDF about cats', run_id='resume')
+        self.assertEqual(render.call_count, 3)
+        self.assertTrue(default_storage.exists(pdf_url[len('/media/'):]))
+
+    def test_serve_media_missing_file(self):
+        response = self.client.get('/media/missing.pdf')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/media/../settings.py')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class OfflineLLMTests(SimpleTestCase):
+    def test_responses_are_deterministic(self):
+        llm = OfflineChatModel(document_sections=2)
+        prompt = "Create detailed Markdown content based on this description: a report"
+        first, second = llm.invoke(prompt), llm.invoke(prompt)
+        self.assertEqual(first.content, second.content)
+        self.assertIn("## Section 2", first.content)
+        self.assertNotIn("## Section 3", first.content)
+        self.assertGreater(first.usage_metadata['output_tokens'], 0)
+
+    def test_simulated_latency(self):
+        llm = OfflineChatModel(latency=0.05)
+        start = time.perf_counter()
+        llm.invoke("Hello")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+    def test_structured_output(self):
+        class FormatArgs(BaseModel):
+            text_color: str
+            background_color: str
+
+        result = OfflineChatModel().with_structured_output(FormatArgs).invoke("Make it dark")
+        self.assertEqual(result.background_color, '#000000')
+
+    def test_offline_generation(self):
+        with override_settings(**BENCHMARK_SETTINGS), offline_models(sections=1, latency=0, tokens_per_second=0):
+            pdf_url = pdf_generator.generate_pdf_from_description("A short report.")
+        self.assertTrue(pdf_url.endswith('.pdf'))
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_percentile(self):
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertAlmostEqual(percentile([0, 10], 95), 9.5)
+        self.assertTrue(percentile([], 50) != percentile([], 50))
+
+    def test_measure_counts_errors(self):
+        calls = iter(range(4))
+        result = measure(lambda: next(calls) % 2, runs=4, concurrency=1)
+        self.assertEqual(result['runs'], 4)
+        self.assertEqual(result['errors'], 2)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(METRICS_DIR=self.metrics_dir, **BENCHMARK_SETTINGS)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test.', labels=('stage',), buckets=(0.1, 1.0, float('inf')))
+        histogram.observe(0.05, stage='a')
+        histogram.observe(0.5, stage='a')
+        text = render_metrics(merge_snapshots([{'test_seconds': histogram.snapshot()}]))
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{stage="a",le="1.0"} 2', text)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 2', text)
+        self.assertIn('test_seconds_count{stage="a"} 2', text)
+
+    def test_merge_adds_up_processes(self):
+        snapshot = registry.snapshot()
+        merged = merge_snapshots([snapshot, snapshot])
+        for name, metric in merged.items():
+            if metric['type'] == 'histogram':
+                for key, value in metric['samples'].items():
+                    original = dict((tuple(k), v) for k, v in snapshot[name]['samples'])[key]
+                    self.assertEqual(value['count'], 2 * original['count'])
+
+    def test_generation_spans_and_tokens(self):
+        with collect_timings() as timings, offline_models(sections=1, latency=0, tokens_per_second=0):
+            self.assertTrue(pdf_generator.generate_pdf_from_description("A short report."))
+        names = {name for name, _ in timings}
+        self.assertTrue({'extract', 'content', 'refine', 'formatting', 'render', 'markdown_parse', 'flowables', 'doc_build'} <= names)
+
+        text = self.client.get('/metrics').content.decode()
+        self.assertIn('chatpdf_stage_duration_seconds_count{stage="doc_build"}', text)
+        self.assertIn('chatpdf_llm_tokens_total{model="llama3-70b-8192",direction="output"}', text)
+
+    def test_metrics_include_worker_snapshots(self):
+        with span('worker_only_stage'):
+            pass
+        write_snapshot()
+        os.rename(os.path.join(self.metrics_dir, f"{os.getpid()}.json"), os.path.join(self.metrics_dir, "1.json"))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Counted once by this process and once by the "worker" snapshot
+        self.assertIn('chatpdf_stage_duration_seconds_count{stage="worker_only_stage"} 2', response.content.decode())
+
+    def test_snapshots_are_deleted_with_their_process(self):
+        self.client.get('/metrics')
+        own = os.path.join(self.metrics_dir, f"{os.getpid()}.json")
+        # Web processes save their metrics for the others too
+        self.assertTrue(os.path.exists(own))
+        remove_snapshot()
+        self.assertFalse(os.path.exists(own))
+
+        stopped = subprocess.Popen([sys.executable, '-c', ''])
+        stopped.wait()
+        stale = os.path.join(self.metrics_dir, f"{stopped.pid}.json")
+        with open(stale, 'w') as f:
+            json.dump(registry.snapshot(), f)
+        self.assertEqual(len(collect_snapshots()), 1)
+        self.assertFalse(os.path.exists(stale))
+
+    def test_server_timing_header(self):
+        response = self.client.get('/metrics')
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @patch('chatbot.jobs.generate_pdf_from_description')
+    def test_job_status_reports_stage_timings(self, mock_generate):
+        def generate(description, run_id):
+            with span('content'):
+                return '/media/test.pdf'
+        mock_generate.side_effect = generate
+        user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.client.force_authenticate(user=user)
+        response = self.client.post('/api/chatbot/generate-pdf/', {'description': 'A PDF about cats'}, format='json')
+        job = run_job(claim_next_job())
+        self.assertIn('content', job.timings)
+
+        status_response = self.client.get(f"/api/chatbot/jobs/{response.json()['jobId']}/")
+        self.assertIn('job_content;dur=', status_response['Server-Timing'])
+        self.assertIn('total;dur=', status_response['Server-Timing'])
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class PreviewTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.cache = PreviewCache(os.path.join(self.workdir, 'previews.sqlite3'), max_bytes=10 * 1024 * 1024)
+        patcher = patch('chatbot.views.get_preview_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.original = os.path.join(self.workdir, 'original.pdf')
+        with open(self.original, 'wb') as f:
+            f.write(sample_pdf(pages=3))
+        with open(self.original, 'rb') as f:
+            default_storage.save('original.pdf', ContentFile(f.read()))
+
+    def test_manifest_and_page_images(self):
+        manifest = self.client.get('/api/chatbot/previews/original.pdf').json()
+        self.assertEqual(manifest['pageCount'], 3)
+        page = manifest['pages'][0]
+        self.assertEqual(page['url'], f"/api/chatbot/previews/1/original.pdf?v={page['fingerprint']}")
+
+        response = self.client.get(page['url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('immutable', response['Cache-Control'])
+
+        self.assertEqual(self.client.get(page['url']).content, response.content)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        revalidated = self.client.get('/api/chatbot/previews/1/original.pdf', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_only_edited_pages_are_rendered_again(self):
+        for number in (1, 2, 3):
+            self.client.get(f'/api/chatbot/previews/{number}/original.pdf')
+        edited = os.path.join(self.workdir, 'edited.pdf')
+        PDFEditor(self.original, edited, font_color='#FF0000', pages="2").apply_custom_formats()
+        with open(edited, 'rb') as f:
+            default_storage.save('edited.pdf', ContentFile(f.read()))
+
+        before = self.client.get('/api/chatbot/previews/original.pdf').json()['pages']
+        after = self.client.get('/api/chatbot/previews/edited.pdf').json()['pages']
+        self.assertEqual([a['fingerprint'] == b['fingerprint'] for a, b in zip(before, after)], [True, False, True])
+        with patch('chatbot.previews.render_page', return_value=b'png') as render:
+            for number in (1, 2, 3):
+                self.client.get(f'/api/chatbot/previews/{number}/edited.pdf')
+        self.assertEqual([call.args[1] for call in render.call_args_list], [1])
+
+    def test_unchanged_files_are_not_read_again(self):
+        first = self.client.get('/api/chatbot/previews/original.pdf').json()
+        self.client.get('/api/chatbot/previews/1/original.pdf')
+        with patch.object(default_storage, 'open', wraps=default_storage.open) as storage_open:
+            self.assertEqual(self.client.get('/api/chatbot/previews/original.pdf').json(), first)
+            self.assertEqual(self.client.get('/api/chatbot/previews/1/original.pdf').status_code, status.HTTP_200_OK)
+        storage_open.assert_not_called()
+
+        # A file saved again under the same name is hashed again
+        default_storage.delete('original.pdf')
+        default_storage.save('original.pdf', ContentFile(sample_pdf(pages=2)))
+        changed = self.client.get('/api/chatbot/previews/original.pdf').json()
+        self.assertNotEqual(changed['document'], first['document'])
+        self.assertEqual(changed['pageCount'], 2)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/chatbot/previews/missing.pdf').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/chatbot/previews/4/original.pdf').status_code, status.HTTP_404_NOT_FOUND)
+        for zoom in ('big', 'nan', 'inf', '-inf'):
+            response = self.client.get(f'/api/chatbot/previews/1/original.pdf?zoom={zoom}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, zoom)
+
+
+def text_pdf(pages):
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for lines in pages:
+        for i, line in enumerate(lines):
+            pdf.drawString(40, 780 - 14 * i, line)
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class RetrievalTests(APITestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.store = RetrievalStore(os.path.join(self.workdir, 'retrieval.sqlite3'))
+        self.vectors = VectorStore(os.path.join(self.workdir, 'vectors'), dimensions=256)
+        self.text_layers = TextLayerStore(os.path.join(self.workdir, 'text_layers'))
+        for target, store in (('get_retrieval_store', self.store), ('get_vector_store', self.vectors),
+                              ('get_text_layer_store', self.text_layers)):
+            patcher = patch(f'chatbot.retrieval.{target}', return_value=store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        filler = ["Quarterly report of the regional office with the usual figures."] * 10
+        default_storage.save('report.pdf', ContentFile(text_pdf([
+            filler,
+            filler[:5] + ["The warehouse in Rotterdam stores spare turbine blades."] + filler[5:],
+            filler,
+        ])))
+
+    def test_chunks_overlap_and_keep_page_offsets(self):
+        text = " ".join(f"w{i}" for i in range(10))
+        chunks = chunk_pages(["", text], size=4, overlap=1)
+        self.assertEqual([chunk.text for chunk in chunks], ["w0 w1 w2 w3", "w3 w4 w5 w6", "w6 w7 w8 w9"])
+        self.assertTrue(all(chunk.page == 2 and text[chunk.start:chunk.end] == chunk.text for chunk in chunks))
+
+    def test_bm25_ranks_rare_terms_higher(self):
+        chunks = chunk_pages(["cats and dogs", "dogs and more dogs", "birds"], size=10, overlap=0)
+        index = BM25Index.build(chunks)
+        self.assertEqual(index.search("dogs")[0][0], 1)
+        self.assertEqual(index.search("cats dogs")[0][0], 0)
+        self.assertEqual(index.search("fish"), [])
+
+    def test_store_matches_in_memory_index(self):
+        chunks = chunk_pages(["cats and dogs", "dogs and more dogs", "birds"], size=10, overlap=0)
+        self.store.add('doc', chunks, pages=3)
+        found = self.store.search('doc', "dogs cats", k=2)
+        expected = BM25Index.build(chunks).search("dogs cats", k=2)
+        self.assertEqual([(chunk.page, round(score, 6)) for chunk, score in found],
+                         [(chunks[i].page, round(score, 6)) for i, score in expected])
+        self.assertEqual(self.store.search('missing', "dogs"), [])
+
+    def test_documents_are_indexed_once(self):
+        document = index_document('report.pdf')
+        self.assertTrue(self.store.has(document))
+        self.assertTrue(self.vectors.has(document))
+        with patch('chatbot.text_layer.extract_text_layer') as extract:
+            self.assertEqual(index_document('report.pdf'), document)
+        extract.assert_not_called()
+
+    def test_search_across_conversations(self):
+        user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.client.force_authenticate(user=user)
+        default_storage.save('recipes.pdf', ContentFile(text_pdf([["Knead the bread dough and bake it at high heat."]])))
+        report = PDF.objects.create(conversation=Conversation.objects.create(user=user), description='report', pdf_url='/media/report.pdf')
+        recipes = PDF.objects.create(conversation=Conversation.objects.create(user=user), description='recipes', pdf_url='/media/recipes.pdf')
+        other = User.objects.create_user(username='otheruser', password='TestPassword123')
+        PDF.objects.create(conversation=Conversation.objects.create(user=other), description='recipes', pdf_url='/media/recipes.pdf')
+
+        response = self.client.post('/api/chatbot/pdfs/search/', {'query': 'how to bake bread dough', 'k': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(results[0]['pdf'], recipes.id)
+        self.assertEqual(results[0]['conversation'], recipes.conversation_id)
+        self.assertEqual({result['pdf'] for result in results}, {recipes.id, report.id})
+        # PDFs are indexed on their first search and remembered
+        report.refresh_from_db()
+        self.assertEqual(len(report.document), 64)
+
+        empty = self.client.post('/api/chatbot/pdfs/search/', {'query': ' '}, format='json')
+        self.assertEqual(empty.status_code, status.HTTP_400_BAD_REQUEST)
+        for k in (0, -3, 2.5, '2', False, settings.RETRIEVAL_MAX_K + 1):
+            bad = self.client.post('/api/chatbot/pdfs/search/', {'query': 'how to bake bread dough', 'k': k}, format='json')
+            self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST, k)
+
+    def test_ask_pdf_uses_the_best_passages(self):
+        user = User.objects.create_user(username='testuser', password='TestPassword123')
+        self.client.force_authenticate(user=user)
+        pdf = PDF.objects.create(conversation=Conversation.objects.create(user=user), description='report', pdf_url='/media/report.pdf')
+
+        response = self.client.post(f'/api/chatbot/pdfs/{pdf.id}/ask/', {'question': 'Where are the turbine blades?', 'k': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sources = response.json()['sources']
+        self.assertEqual(len(sources), 1)
+        self.assertEqual(sources[0]['page'], 2)
+        self.assertIn('Rotterdam', sources[0]['text'])
+        self.assertTrue(response.json()['answer'].startswith('According to the document'))
+
+        empty = self.client.post(f'/api/chatbot/pdfs/{pdf.id}/ask/', {'question': ''}, format='json')
+        self.assertEqual(empty.status_code, status.HTTP_400_BAD_REQUEST)
+        for k in (0, -1, 1.5, '2', True, settings.RETRIEVAL_MAX_K + 1):
+            bad = self.client.post(f'/api/chatbot/pdfs/{pdf.id}/ask/', {'question': 'Where are the turbine blades?', 'k': k}, format='json')
+            self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST, k)
+        self.client.force_authenticate(user=User.objects.create_user(username='otheruser', password='TestPassword123'))
+        other = self.client.post(f'/api/chatbot/pdfs/{pdf.id}/ask/', {'question': 'Where are the turbine blades?'}, format='json')
+        self.assertEqual(other.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class VectorTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.texts = [f"section {i} covers topic {i % 7} with detail {i * 3}" for i in range(300)]
+
+    def test_embeddings_are_deterministic_unit_vectors(self):
+        vectors = embed(["bake the bread", "bake the bread", "tax law", ""], 256)
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_array_equal(vectors[0], vectors[1])
+        np.testing.assert_allclose(np.linalg.norm(vectors[:3], axis=1), 1.0, rtol=1e-5)
+        self.assertFalse(vectors[3].any())
+        query = embed(["bread baking"], 256)[0]
+        self.assertGreater(vectors[0] @ query, vectors[2] @ query)
+
+    def test_batched_search_matches_brute_force(self):
+        vectors = embed(self.texts, 256)
+        queries = embed(["topic 3 detail 9", "section 42"], 256)
+        with patch('chatbot.vectors.SEARCH_BLOCK_ROWS', 64):
+            found = VectorIndex(vectors).search(queries, k=5)
+        for query, matches in zip(queries, found):
+            # Rows with equal scores may come in any order, so compare the scores
+            np.testing.assert_allclose([score for _, score in matches], np.sort(vectors @ query)[::-1][:5], rtol=1e-5)
+            np.testing.assert_allclose([score for _, score in matches], [vectors[row] @ query for row, _ in matches], rtol=1e-5)
+
+    def test_coarse_quantizer_probing_every_cluster_is_exact(self):
+        vectors = embed(self.texts, 256)
+        centroids, assignments = train_coarse_quantizer(vectors, 16)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))])
+        queries = embed(["topic 3 detail 9"], 256)
+        exact = VectorIndex(vectors).search(queries, k=5)
+        clustered = VectorIndex(vectors, centroids, order, offsets).search(queries, k=5, probes=len(centroids))
+        np.testing.assert_allclose([score for _, score in exact[0]], [score for _, score in clustered[0]], rtol=1e-5)
+
+    def test_store_loads_memory_mapped_indexes(self):
+        store = VectorStore(self.workdir, dimensions=256, ivf_min_rows=100, probes=4)
+        store.add('large', self.texts)
+        store.add('small', ["section forty two is short"])
+        self.assertIsInstance(store.get('large').vectors, np.memmap)
+        self.assertIsNotNone(store.get('large').centroids)
+        self.assertIsNone(store.get('small').centroids)
+        self.assertIsNone(store.get('missing'))
+
+        results = store.search(['small', 'large', 'missing'], ["section forty two", "topic 3 detail 9"], k=3)
+        self.assertEqual(results[0][0][:2], ('small', 0))
+        self.assertEqual(len(results[1]), 3)
+        self.assertTrue(all(document == 'large' for document, _, _ in results[1]))
+
+
+class SummaryTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = LLMCache(os.path.join(self.tmpdir.name, 'cache.sqlite3'), max_bytes=10 * 1024 * 1024, ttl=60)
+        self.addCleanup(self.cache._conn.close)
+        patcher = patch('chatbot.llm_cache.get_llm_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sections = [f"## Part {i}\n\n" + " ".join(f"fact{i}x{j}" for j in range(40)) for i in range(30)]
+
+    def test_chunks_respect_the_word_limit(self):
+        chunks = split_sections("\n\n".join(self.sections) + "\f" + "word " * 250, max_words=100)
+        self.assertTrue(all(len(chunk.split()) <= 100 for chunk in chunks))
+        self.assertEqual(sum(len(chunk.split()) for chunk in chunks), 30 * 43 + 250)
+        self.assertEqual(split_sections(" \n\n \f", max_words=100), [])
+
+    def test_an_edit_keeps_distant_chunks(self):
+        edited = list(self.sections)
+        edited[15] = edited[15].replace("fact15x3 ", "changed words here ")
+        before = split_sections("\n\n".join(self.sections), max_words=150)
+        after = split_sections("\n\n".join(edited), max_words=150)
+        self.assertLessEqual(len(set(after) - set(before)), 2)
+
+    def test_map_reduce_runs_chunks_concurrently(self):
+        llm = OfflineChatModel(latency=0.1)
+        start = time.perf_counter()
+        summary = asyncio.run(summarize("\n\n".join(self.sections[:8]), llm, chunk_words=43, concurrency=8, fanout=4))
+        # Eight chunk summaries at once, then two combined summaries at once, then the final one
+        self.assertLess(time.perf_counter() - start, 0.6)
+        self.assertTrue(summary.startswith("Summary:"))
+        self.assertEqual(self.cache.misses, 8 + 2 + 1)
+
+    def test_only_changed_chunks_are_summarized_again(self):
+        llm = OfflineChatModel()
+        asyncio.run(summarize("\n\n".join(self.sections), llm, chunk_words=150, fanout=4))
+        calls = self.cache.misses
+        edited = list(self.sections)
+        edited[15] = edited[15].replace("fact15x3 ", "changed words here ")
+        asyncio.run(summarize("\n\n".join(edited), llm, chunk_words=150, fanout=4))
+        # The changed chunks and the combined summaries above them
+        self.assertLess(self.cache.misses - calls, calls / 2)
+        self.assertEqual(asyncio.run(summarize(" ", llm)), "")
+
+
+class TextLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.store = TextLayerStore(self.workdir)
+        self.data = text_pdf([["First page", "of the report"], [], ["Prices rose by 5 %", "in Zürich"]])
+
+    def test_pages_round_trip(self):
+        layer = self.store.load(self.data)
+        self.assertEqual(layer.page_count, 3)
+        self.assertEqual(layer.document, hashlib.sha256(self.data).hexdigest())
+        with pymupdf.open(stream=self.data, filetype="pdf") as doc:
+            self.assertEqual(layer.pages(), [page.get_text() for page in doc])
+            spans = [span for block in doc[2].get_text('dict')['blocks'] for line in block['lines'] for span in line['spans']]
+        self.assertEqual(layer.page_text(1), "")
+        self.assertEqual(layer.text().split("\f")[2], "Prices rose by 5 %\nin Zürich\n")
+        self.assertEqual(layer.page_size(0), (595.2755737304688, 841.8897705078125))
+
+        found = layer.page_spans(2)
+        self.assertEqual([span.text for span in found], [span['text'] for span in spans])
+        self.assertEqual(found[1].font, 'Helvetica')
+        self.assertAlmostEqual(found[1].size, spans[1]['size'], places=4)
+        self.assertEqual(layer.page_text(2)[found[1].start:found[1].end], "in Zürich")
+        with self.assertRaises(IndexError):
+            layer.page_text(3)
+
+    def test_pages_are_extracted_once_per_content(self):
+        layer = self.store.load(self.data)
+        with patch('chatbot.text_layer.extract_text_layer') as extract:
+            self.assertIs(self.store.load(self.data), layer)
+            self.assertEqual(TextLayerStore(self.workdir).load(self.data).pages(), layer.pages())
+        extract.assert_not_called()
+        # Another version of the PDF has its own layer
+        edited = self.store.load(text_pdf([["Edited"]]))
+        self.assertEqual(edited.pages(), ["Edited\n"])
+        self.assertEqual(layer.page_count, 3)
+
+    def test_damaged_files_are_extracted_again(self):
+        document = hashlib.sha256(self.data).hexdigest()
+        with open(self.store.path(document), 'wb') as f:
+            f.write(b'not a text layer')
+        self.assertIsNone(self.store.get(document))
+        self.assertEqual(self.store.load(self.data).page_count, 3)
+        other = os.path.join(self.workdir, 'other.textlayer')
+        with open(other, 'wb') as f:
+            f.write(b'x' * 100)
+        with self.assertRaises(ValueError):
+            TextLayer(other)
+
+    def test_truncated_files_are_extracted_again(self):
+        document = hashlib.sha256(self.data).hexdigest()
+        encoded = encode_text_layer(document, extract_text_layer(self.data))
+        # Cut inside the offsets table, inside a page record and inside the font table
+        for size in (HEADER.size + 4, len(encoded) // 2, len(encoded) - 1):
+            with open(self.store.path(document), 'wb') as f:
+                f.write(encoded[:size])
+            with self.assertRaises(ValueError):
+                TextLayer(self.store.path(document))
+            self.assertIsNone(self.store.get(document))
+        layer = self.store.load(self.data)
+        self.assertEqual(layer.page_text(2), "Prices rose by 5 %\nin Zürich\n")
+        self.assertEqual(layer.page_spans(2)[1].font, 'Helvetica')
+
+    def test_replacing_text_skips_pages_without_it(self):
+        data = text_pdf([["Alpha beta"], ["Gamma"], ["beta  again"]])
+        layer = self.store.load(data)
+        self.assertEqual(layer.pages_containing("BETA"), [0, 2])
+        self.assertEqual(layer.pages_containing("alpha   beta"), [0])
+        with pymupdf.open(stream=data, filetype="pdf") as doc, patch.object(pymupdf.Page, 'search_for', autospec=True,
+                                                                            side_effect=pymupdf.Page.search_for) as search:
+            replace_text_in_pdf(doc, [("beta", "delta")], text_layer=layer)
+            self.assertEqual([call.args[0].number for call in search.call_args_list], [0, 2])
+            self.assertIn("delta", doc[2].get_text())
+
+
+@override_settings(EDIT_RULES_ENABLED=False, LLM_CACHE_ENABLED=False, PDF_EDIT_ENGINE='native')
+class EditAgentTests(SimpleTestCase):
+    instructions = "Change the background to black and the text to white, then add an appendix."
+
+    def setUp(self):
+        try:
+            from langchain.agents import AgentExecutor, create_tool_calling_agent
+            from .edit_pdf import edit_pdf
+        except ImportError as e:
+            self.skipTest(f"the edit agent cannot be imported with this langchain: {e}")
+        self.module, self.AgentExecutor, self.create_agent = edit_pdf, AgentExecutor, create_tool_calling_agent
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.input_pdf = os.path.join(self.workdir, 'input.pdf')
+        with open(self.input_pdf, 'wb') as f:
+            f.write(sample_pdf(2))
+        self.format_args = Mock(side_effect=DEFAULT_TOOL_ARGS['FormatArgs'])
+        self.tool_args = {
+            **DEFAULT_TOOL_ARGS,
+            'FormatArgs': self.format_args,
+            'append_page': lambda prompt, results: {'text': 'Appendix', 'input_pdf': edit_instructions(prompt)[1]},
+        }
+
+    def run_agent(self, tool_plan, instructions=None):
+        # Goes through the module's agent executor, built on the offline model
+        model = OfflineChatModel(model_name='mixtral-8x7b-32768', tool_plan=tool_plan, tool_args=self.tool_args)
+        agent = self.create_agent(model, self.module.tools, self.module.prompt)
+        with patch.object(self.module, 'llm', model), \
+                patch.object(self.module, 'agent_executor', self.AgentExecutor(agent=agent, tools=self.module.tools)):
+            return self.module.edit_pdf_from_description(self.input_pdf, instructions or self.instructions)
+
+    def test_repeated_edit_calls_all_apply(self):
+        edited = pymupdf.open(self.run_agent(['generate_formatting_args', 'edit_pdf', 'append_page', 'append_page']))
+        self.assertEqual(edited.page_count, 4)
+        self.assertEqual([page.get_text().strip() for page in edited][2:], ['Appendix', 'Appendix'])
+        self.assertEqual({span['color'] for span in text_spans(edited[0])}, {0xFFFFFF})
+
+    def test_retry_reuses_read_only_results_and_repeats_edits_once(self):
+        failures = iter([ValueError('model error')])
+
+        def edit_args(prompt, results):
+            # The first attempt fails after the formatting arguments and the page were asked for
+            error = next(failures, None)
+            if error:
+                raise error
+            return DEFAULT_TOOL_ARGS['edit_pdf'](prompt, results)
+
+        self.tool_args['edit_pdf'] = edit_args
+        edited = pymupdf.open(self.run_agent(['generate_formatting_args', 'append_page', 'edit_pdf']))
+        self.assertEqual(edited.page_count, 3)
+        self.assertEqual(self.format_args.call_count, 1)
+        self.assertEqual({span['color'] for span in text_spans(edited[0])}, {0xFFFFFF})
+
+    def test_failed_attempts_apply_nothing(self):
+        def edit_args(prompt, results):
+            raise ValueError('model error')
+
+        self.tool_args['edit_pdf'] = edit_args
+        with self.assertRaises(ValueError):
+            self.run_agent(['generate_formatting_args', 'append_page', 'edit_pdf'])
+        self.assertFalse(os.path.exists(self.module.edited_path(self.input_pdf)))
+
+    def test_no_edits_returns_no_path(self):
+        self.tool_args['summarize_text'] = lambda prompt, results: {'text': 'Some text.'}
+        self.assertEqual(self.run_agent(['summarize_text'], "Summarize it."), "")
+        self.assertFalse(os.path.exists(self.module.edited_path(self.input_pdf)))
+
+    def test_bad_page_selection_is_reported_to_the_agent(self):
+        plan = EditPlan(page_count=2)
+        token = self.module._edit_plan.set(plan)
+        try:
+            result = asyncio.run(self.module.edit_pdf.ainvoke(
+                {'formatting_args': {'text_color': '#FF0000', 'pages': '9'}, 'input_pdf': self.input_pdf}))
+        finally:
+            self.module._edit_plan.reset(token)
+        self.assertTrue(result.startswith("Error:"), result)
+        self.assertTrue(plan.is_empty())
+
+    def test_pdf_summary_follows_the_file(self):
+        summarize = Mock(side_effect=lambda text, llm: asyncio.sleep(0, result=text.strip()))
+
+        async def summaries():
+            with tool_results():
+                first = await self.module.summarize_pdf.ainvoke({'input_pdf': self.input_pdf})
+                with open(self.input_pdf, 'wb') as f:
+                    f.write(text_pdf([["Edited"]]))
+                return first, await self.module.summarize_pdf.ainvoke({'input_pdf': self.input_pdf})
+
+        with override_settings(TEXT_LAYER_DIR=self.workdir), patch('chatbot.text_layer._text_layer_store', None), \
+                patch.object(self.module, 'summarize', summarize):
+            first, second = asyncio.run(summaries())
+        self.assertIn("Page (one)", first)
+        self.assertEqual(second, "Edited")
@@ -0,0 +1,249 @@
+from django.conf import settings
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from .edit_pdf.content_stream import MUPDF_LOCK, write_atomic
+from .metrics import span
+import threading
+import hashlib
+import pymupdf
+import struct
+import mmap
+import json
+import os
+
+MAGIC = b'PDFTEXT1'
+# Magic, SHA-256 of the PDF, page count, offset of the font table
+HEADER = struct.Struct('<8s32sIQ')
+OFFSET = struct.Struct('<Q')
+# Text length in bytes, span count, page width and height
+PAGE = struct.Struct('<II2f')
+# Start and end in the page text, bounding box, font size, sRGB color, font index, font flags
+SPAN = struct.Struct('<II5fIHH')
+# Text layers kept open by a TextLayerStore
+OPEN_LAYERS = 256
+
+
+class TextSpan:
+    """A run of text in one font, with where it is in its page's text and on the page."""
+
+    __slots__ = ('text', 'start', 'end', 'bbox', 'size', 'color', 'font', 'flags')
+
+    def __init__(self, text: str, start: int, end: int, bbox: Tuple[float, float, float, float], size: float, color: int,
+                 font: str, flags: int):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.bbox = bbox
+        self.size = size
+        self.color = color
+        self.font = font
+        self.flags = flags
+
+    def __repr__(self):
+        return f"TextSpan({self.text!r}, bbox={self.bbox}, size={self.size}, font={self.font!r})"
+
+
+def extract_text_layer(data: bytes) -> List[Tuple[str, List[Dict[str, Any]], float, float]]:
+    """
+    Reads the text and text spans of every page of a PDF.
+
+    A page's text is its lines in reading order, each ending with a newline.
+
+    Returns:
+        List[Tuple[str, List[Dict[str, Any]], float, float]]: For each page, its text, its spans as
+        dictionaries with the keys of TextSpan, and its width and height.
+    """
+    pages = []
+    with MUPDF_LOCK, pymupdf.open(stream=data, filetype="pdf") as doc:
+        for page in doc:
+            parts: List[str] = []
+            spans: List[Dict[str, Any]] = []
+            length = 0
+            for block in page.get_text('dict')['blocks']:
+                for line in block.get('lines', []):
+                    for item in line['spans']:
+                        spans.append({'start': length, 'end': length + len(item['text']), 'bbox': tuple(item['bbox']),
+                                      'size': item['size'], 'color': item['color'], 'font': item['font'], 'flags': item['flags']})
+                        parts.append(item['text'])
+                        length += len(item['text'])
+                    parts.append('\n')
+                    length += 1
+            pages.append((''.join(parts), spans, page.rect.width, page.rect.height))
+    return pages
+
+
+def encode_text_layer(document: str, pages: List[Tuple[str, List[Dict[str, Any]], float, float]]) -> bytes:
+    """
+    Packs extracted pages into the text layer format.
+
+    The file starts with a header and a table of where each page's record starts, so any page
+    can be read without reading the pages before it. A record is the page's UTF-8 text followed
+    by its spans as fixed-size structs; font names are stored once, in a table at the end.
+
+    Args:
+        document (str): Hex SHA-256 of the PDF the pages were read from.
+        pages (list): Pages as extract_text_layer returns them.
+
+    Returns:
+        bytes: The encoded text layer.
+    """
+    fonts: Dict[str, int] = {}
+    records = []
+    for text, spans, width, height in pages:
+        encoded = text.encode('utf-8')
+        record = [PAGE.pack(len(encoded), len(spans), width, height), encoded]
+        for item in spans:
+            font = fonts.setdefault(item['font'], len(fonts))
+            record.append(SPAN.pack(item['start'], item['end'], *item['bbox'], item['size'], item['color'], font, item['flags']))
+        records.append(b''.join(record))
+
+    offset = HEADER.size + OFFSET.size * (len(pages) + 1)
+    offsets = []
+    for record in records:
+        offsets.append(offset)
+        offset += len(record)
+    offsets.append(offset)
+    return b''.join([
+        HEADER.pack(MAGIC, bytes.fromhex(document), len(pages), offset),
+        *(OFFSET.pack(value) for value in offsets),
+        *records,
+        json.dumps(list(fonts)).encode('utf-8'),
+    ])
+
+
+class TextLayer:
+    """
+    A text layer file, memory-mapped so that reading a page only touches that page's bytes.
+
+    Raises:
+        ValueError: If the file is not a text layer, or is cut short.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{path} is not a text layer")
+        magic, digest, self.page_count, self._fonts_offset = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a text layer")
+        self.document = digest.hex()
+        self._check()
+        self._fonts: List[str] = json.loads(self._map[self._fonts_offset:].decode('utf-8'))
+
+    def _check(self) -> None:
+        """Checks that the offsets table and every page record lie within the file, so reading a page cannot fail."""
+        table_end = HEADER.size + OFFSET.size * (self.page_count + 1)
+        if table_end > len(self._map):
+            raise ValueError(f"{self.path} is truncated")
+        offsets = [value for value, in OFFSET.iter_unpack(self._map[HEADER.size:table_end])]
+        if offsets[0] != table_end or offsets[-1] != self._fonts_offset or self._fonts_offset > len(self._map):
+            raise ValueError(f"{self.path} is truncated")
+        for start, end in zip(offsets, offsets[1:]):
+            if start + PAGE.size > end:
+                raise ValueError(f"{self.path} is truncated")
+            length, span_count, _, _ = PAGE.unpack_from(self._map, start)
+            if start + PAGE.size + length + SPAN.size * span_count != end:
+                raise ValueError(f"{self.path} is truncated")
+
+    def _record(self, page: int) -> Tuple[int, int, int, float, float]:
+        if not 0 <= page < self.page_count:
+            raise IndexError(f"page {page} out of range for a document of {self.page_count} pages")
+        start, = OFFSET.unpack_from(self._map, HEADER.size + OFFSET.size * page)
+        length, span_count, width, height = PAGE.unpack_from(self._map, start)
+        return start + PAGE.size, length, span_count, width, height
+
+    def page_size(self, page: int) -> Tuple[float, float]:
+        return self._record(page)[3:]
+
+    def page_text(self, page: int) -> str:
+        """Returns the text of a page, counted from 0."""
+        start, length, _, _, _ = self._record(page)
+        return self._map[start:start + length].decode('utf-8')
+
+    def page_spans(self, page: int) -> List[TextSpan]:
+        """Returns the text spans of a page, counted from 0, in reading order."""
+        start, length, span_count, _, _ = self._record(page)
+        text = self._map[start:start + length].decode('utf-8')
+        spans = []
+        for begin, end, x0, y0, x1, y1, size, color, font, flags in SPAN.iter_unpack(
+                self._map[start + length:start + length + SPAN.size * span_count]):
+            spans.append(TextSpan(text[begin:end], begin, end, (x0, y0, x1, y1), size, color, self._fonts[font], flags))
+        return spans
+
+    def pages(self) -> List[str]:
+        return [self.page_text(page) for page in range(self.page_count)]
+
+    def text(self) -> str:
+        """Returns the whole text, with pages separated by form feeds."""
+        return '\f'.join(self.pages())
+
+    def pages_containing(self, text: str) -> List[int]:
+        """Returns the pages whose text contains `text`, ignoring case and differences in whitespace."""
+        needle = ' '.join(text.lower().split())
+        return [page for page in range(self.page_count) if needle in ' '.join(self.page_text(page).lower().split())]
+
+
+class TextLayerStore:
+    """
+    Text layers of PDFs saved in `directory`, one file per hash of the PDF's content.
+
+    A PDF's text is extracted once; an edited PDF has another hash, so it never gets the text
+    of the version it was edited from.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._layers: 'OrderedDict[str, TextLayer]' = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, document: str) -> str:
+        return os.path.join(self.directory, f"{document}.textlayer")
+
+    def get(self, document: str) -> Optional[TextLayer]:
+        """Returns the text layer of a document hash, or None when it has not been extracted."""
+        with self._lock:
+            if document in self._layers:
+                self._layers.move_to_end(document)
+                return self._layers[document]
+        try:
+            layer = TextLayer(self.path(document))
+        except (FileNotFoundError, ValueError):
+            return None
+        if layer.document != document:
+            return None
+        with self._lock:
+            self._layers[document] = layer
+            while len(self._layers) > OPEN_LAYERS:
+                self._layers.popitem(last=False)
+        return layer
+
+    def load(self, data: bytes) -> TextLayer:
+        """Returns the text layer of a PDF, extracting it the first time the PDF's content is seen."""
+        document = hashlib.sha256(data).hexdigest()
+        layer = self.get(document)
+        if layer is None:
+            with span('text_layer_extract'):
+                write_atomic(self.path(document), encode_text_layer(document, extract_text_layer(data)))
+            layer = self.get(document)
+        return layer
+
+    def find(self, pdf_path: str) -> Optional[TextLayer]:
+        """Returns the text layer of the PDF file if it was extracted before, without extracting it."""
+        with open(pdf_path, 'rb') as f:
+            return self.get(hashlib.sha256(f.read()).hexdigest())
+
+
+_text_layer_store: Optional[TextLayerStore] = None
+_text_layer_store_lock = threading.Lock()
+
+
+def get_text_layer_store() -> TextLayerStore:
+    """Returns the process-wide store of text layers."""
+    global _text_layer_store
+    with _text_layer_store_lock:
+        if _text_layer_store is None:
+            _text_layer_store = TextLayerStore(settings.TEXT_LAYER_DIR)
+    return _text_layer_store
@@ -1,8 +1,13 @@
-from .views import generate_pdf, ConversationDetailView, ConversationListCreateView
+from .views import ask_pdf, generate_pdf, pdf_job_status, search_user_pdfs, pdf_preview, page_preview, ConversationDetailView, ConversationListCreateView
 from django.urls import path
 
 urlpatterns = [
     path('generate-pdf/', generate_pdf, name='generate_pdf'),
+    path('jobs/<int:pk>/', pdf_job_status, name='pdf-job-status'),
+    path('pdfs/<int:pk>/ask/', ask_pdf, name='pdf-ask'),
+    path('pdfs/search/', search_user_pdfs, name='pdf-search'),
     path('conversations/', ConversationListCreateView.as_view(), name='conversation-list-create'),
     path('conversations/<int:pk>/', ConversationDetailView.as_view(), name='conversation-detail'),
+    path('previews/<int:page>/<path:name>', page_preview, name='page-preview'),
+    path('previews/<path:name>', pdf_preview, name='pdf-preview'),
 ]
\ No newline at end of file
@@ -0,0 +1,252 @@
+from django.conf import settings
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import threading
+import zlib
+import os
+import re
+
+FEATURE_RE = re.compile(r'[a-z0-9]+')
+# Rows scored per matrix product when searching without the coarse quantizer, to bound memory
+SEARCH_BLOCK_ROWS = 65536
+# Memory-mapped indexes kept open by a VectorStore
+OPEN_INDEXES = 256
+
+
+@lru_cache(maxsize=1 << 16)
+def feature_slot(feature: str, dimensions: int) -> Tuple[int, float]:
+    """Hashes a feature to a column and a sign; the sign keeps collisions from adding up on average."""
+    h = zlib.crc32(feature.encode())
+    return h % dimensions, (1.0 if h & 0x80000000 else -1.0)
+
+
+def text_features(text: str) -> List[str]:
+    """Returns the words of a text and its pairs of adjacent words, which carry some word order."""
+    words = FEATURE_RE.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def embed(texts: Sequence[str], dimensions: int) -> np.ndarray:
+    """
+    Embeds texts with feature hashing: no model, the same text always gets the same vector.
+
+    Counts are dampened logarithmically and each vector is scaled to unit length, so the dot
+    product of two embeddings is their cosine similarity.
+
+    Args:
+        texts (Sequence[str]): The texts.
+        dimensions (int): Length of each vector.
+
+    Returns:
+        np.ndarray: A float32 matrix with one row per text.
+    """
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts: Dict[int, float] = {}
+        for feature in text_features(text):
+            column, sign = feature_slot(feature, dimensions)
+            counts[column] = counts.get(column, 0.0) + sign
+        if counts:
+            columns = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            vectors[row, columns] = np.sign(values) * np.log1p(np.abs(values))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def train_coarse_quantizer(vectors: np.ndarray, lists: int, iterations: int = 10, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Clusters unit vectors with spherical k-means, for searching only the clusters nearest a query.
+
+    Args:
+        vectors (np.ndarray): The embeddings, one per row.
+        lists (int): Number of clusters.
+        iterations (int): Rounds of k-means.
+        seed (int): Seed for picking the first centroids, so a build can be repeated exactly.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The unit-length centroids and the cluster of every row.
+    """
+    lists = max(1, min(lists, len(vectors)))
+    centroids = vectors[np.random.default_rng(seed).choice(len(vectors), lists, replace=False)].copy()
+    assignments = np.zeros(len(vectors), dtype=np.int32)
+    for _ in range(iterations):
+        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+            block = vectors[start:start + SEARCH_BLOCK_ROWS]
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Clusters that lost all their rows keep their old centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+    return centroids, assignments
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Returns the column indexes of the k highest scores of each row, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1)
+
+
+class VectorIndex:
+    """
+    Embeddings of one document's passages, with an optional coarse quantizer.
+
+    Without the quantizer every passage is scored with a matrix product per block of rows.
+    With it, the passages are grouped into clusters (an IVF index) and only the clusters
+    whose centroids are nearest each query are scored, which trades a little recall for speed.
+    """
+
+    def __init__(self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None, order: Optional[np.ndarray] = None,
+                 offsets: Optional[np.ndarray] = None):
+        self.vectors = vectors
+        self.centroids = centroids
+        # Rows sorted by cluster, and where each cluster starts in that order
+        self.order = order
+        self.offsets = offsets
+
+    def search(self, queries: np.ndarray, k: int, probes: int = 8) -> List[List[Tuple[int, float]]]:
+        """
+        Finds the passages nearest each query.
+
+        Args:
+            queries (np.ndarray): Query embeddings, one per row.
+            k (int): Passages to return per query.
+            probes (int): Clusters searched per query when the index has a quantizer.
+
+        Returns:
+            List[List[Tuple[int, float]]]: For each query, passage indexes and cosine similarities, best first.
+        """
+        if self.centroids is not None:
+            return self._search_clusters(queries, k, probes)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), SEARCH_BLOCK_ROWS):
+            block = self.vectors[start:start + SEARCH_BLOCK_ROWS]
+            # The best rows so far compete with the rows of this block
+            scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+            keep = top_k(scores, k)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+        return [list(zip(rows.tolist(), scores.tolist())) for rows, scores in zip(best_rows, best_scores)]
+
+    def _search_clusters(self, queries: np.ndarray, k: int, probes: int) -> List[List[Tuple[int, float]]]:
+        nearest = top_k(queries @ self.centroids.T, probes)
+        results = []
+        for query, clusters in zip(queries, nearest):
+            rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in clusters])
+            scores = self.vectors[rows] @ query
+            best = top_k(scores[np.newaxis], k)[0]
+            results.append(list(zip(rows[best].tolist(), scores[best].tolist())))
+        return results
+
+
+class VectorStore:
+    """
+    Embeddings of PDFs saved as float32 .npy files per document hash, in `directory`.
+
+    Files are memory-mapped when a document is first searched, so only the rows a search
+    touches are read from disk, and a document's index is written once and never changed.
+    """
+
+    def __init__(self, directory: str, dimensions: int = 1024, ivf_min_rows: int = 0, probes: int = 8):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.ivf_min_rows = ivf_min_rows
+        self.probes = probes
+        self._indexes: 'OrderedDict[str, VectorIndex]' = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, document: str, part: str = 'vectors') -> str:
+        return os.path.join(self.directory, f"{document}.{part}.npy")
+
+    def has(self, document: str) -> bool:
+        return os.path.exists(self.path(document))
+
+    def add(self, document: str, texts: Sequence[str]) -> None:
+        """
+        Embeds the passages of a document and saves them; documents with at least
+        `ivf_min_rows` passages also get a coarse quantizer.
+        """
+        vectors = embed(texts, self.dimensions)
+        if self.ivf_min_rows and len(vectors) >= self.ivf_min_rows:
+            centroids, assignments = train_coarse_quantizer(vectors, int(np.sqrt(len(vectors))))
+            self._save(document, 'centroids', centroids)
+            self._save(document, 'order', np.argsort(assignments, kind='stable').astype(np.int32))
+            self._save(document, 'offsets', np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))]).astype(np.int64))
+        # Saved last, so a document is only found once all its files are written
+        self._save(document, 'vectors', vectors)
+
+    def _save(self, document: str, part: str, array: np.ndarray) -> None:
+        path = self.path(document, part)
+        with open(f"{path}.tmp", 'wb') as f:
+            np.save(f, array)
+        os.replace(f"{path}.tmp", path)
+
+    def get(self, document: str) -> Optional[VectorIndex]:
+        """Returns the memory-mapped index of a document, or None when it has none."""
+        with self._lock:
+            if document in self._indexes:
+                self._indexes.move_to_end(document)
+                return self._indexes[document]
+        if not self.has(document):
+            return None
+        parts = {'vectors': np.load(self.path(document), mmap_mode='r')}
+        if os.path.exists(self.path(document, 'centroids')):
+            for part in ('centroids', 'order', 'offsets'):
+                parts[part] = np.load(self.path(document, part), mmap_mode='r')
+        index = VectorIndex(**parts)
+        with self._lock:
+            self._indexes[document] = index
+            while len(self._indexes) > OPEN_INDEXES:
+                self._indexes.popitem(last=False)
+        return index
+
+    def search(self, documents: Sequence[str], queries: Sequence[str], k: int = 4) -> List[List[Tuple[str, int, float]]]:
+        """
+        Finds the passages nearest each query across several documents.
+
+        The queries are embedded together and each document is searched for all of them
+        with one matrix product per block of its rows.
+
+        Args:
+            documents (Sequence[str]): Hashes of the documents to search; those without an index are skipped.
+            queries (Sequence[str]): The queries.
+            k (int): Passages to return per query.
+
+        Returns:
+            List[List[Tuple[str, int, float]]]: For each query, the document, passage index and
+            cosine similarity of the best passages, best first.
+        """
+        embedded = embed(queries, self.dimensions)
+        results: List[List[Tuple[str, int, float]]] = [[] for _ in queries]
+        for document in dict.fromkeys(documents):
+            index = self.get(document)
+            if index is None:
+                continue
+            for found, matches in zip(results, index.search(embedded, k, self.probes)):
+                found.extend((document, row, score) for row, score in matches)
+        return [sorted(found, key=lambda match: -match[2])[:k] for found in results]
+
+
+_vector_store: Optional[VectorStore] = None
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    """Returns the process-wide store of document embeddings."""
+    global _vector_store
+    with _vector_store_lock:
+        if _vector_store is None:
+            _vector_store = VectorStore(settings.VECTOR_INDEX_DIR, settings.VECTOR_DIMENSIONS, settings.VECTOR_IVF_MIN_ROWS,
+                                        settings.VECTOR_IVF_PROBES)
+    return _vector_store
@@ -1,15 +1,36 @@
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.core.files.storage import default_storage
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.conf import settings
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework import generics, status
 from rest_framework.response import Response
-from .serializers import ConversationSerializer, PDFSerializer, UserSerializer
-from .models import Conversation, PDF
-from .create_pdf.pdf_generator import generate_pdf_from_description
+from .serializers import ConversationSerializer, PDFSerializer, PDFJobSerializer, UserSerializer
+from .models import Conversation, PDF, PDFJob
+from .jobs import enqueue_pdf_job
+from .metrics import collect_snapshots, merge_snapshots, render_metrics, server_timing_header
+from .previews import DocumentPreview, clamp_zoom, get_preview_cache
+from .retrieval import answer_question, search_pdfs
+from django.core.exceptions import SuspiciousFileOperation
 import json
+import os
+
+def parse_k(value):
+    """Reads the number of passages a request asks for; None means the default.
+
+    Raises:
+        ValueError: If it is not a whole number between 1 and settings.RETRIEVAL_MAX_K.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= settings.RETRIEVAL_MAX_K:
+        raise ValueError(f"k must be a whole number between 1 and {settings.RETRIEVAL_MAX_K}")
+    return value
 
 # User registration
 class CreateUserView(generics.CreateAPIView):
@@ -17,7 +38,7 @@ class CreateUserView(generics.CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
 
-# Create PDF based on user input text
+# Queue PDF generation based on user input text
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def generate_pdf(request):
@@ -27,21 +48,63 @@ def generate_pdf(request):
     if not description:
         return JsonResponse({'error': 'Description cannot be empty'}, status=400)
 
-    # Placeholder for actual PDF generation logic
-    pdf_url = generate_pdf_from_description(description)
-    if not pdf_url:
-        return JsonResponse({'error': 'PDF generation failed'}, status=500)
+    # Generation runs in the worker pool (see `manage.py run_pdf_workers`)
+    job = enqueue_pdf_job(request.user, description)
 
-    # Create or get an active conversation
-    conversation, created = Conversation.objects.get_or_create(user=request.user)
+    return JsonResponse({
+        'jobId': job.id,
+        'status': job.status,
+        'conversationId': job.conversation_id
+    }, status=202)
 
-    # Create PDF entry
-    pdf_entry = PDF.objects.create(conversation=conversation, description=description, pdf_url=pdf_url)
+# Poll the status of a PDF generation job
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def pdf_job_status(request, pk):
+    job = get_object_or_404(PDFJob, id=pk, conversation__user=request.user)
+    response = JsonResponse(PDFJobSerializer(job).data)
+    if job.timings:
+        # Where the worker spent its time generating this job's PDF
+        response['Server-Timing'] = server_timing_header({f"job_{name}": seconds for name, seconds in job.timings.items()})
+    return response
 
-    return JsonResponse({
-        'pdfUrl': pdf_entry.pdf_url,
-        'conversationId': conversation.id
-    })
+# Answer a question about one of the user's PDFs from its most relevant passages
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def ask_pdf(request, pk):
+    pdf = get_object_or_404(PDF, id=pk, conversation__user=request.user)
+    data = json.loads(request.body)
+    question = data.get('question', '').strip()
+
+    if not question:
+        return JsonResponse({'error': 'Question cannot be empty'}, status=400)
+    try:
+        k = parse_k(data.get('k'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        result = answer_question(pdf, question, k)
+    except (FileNotFoundError, SuspiciousFileOperation):
+        raise Http404(f"'{pdf.pdf_url}' does not exist")
+    return JsonResponse(result)
+
+# Find the passages closest in meaning to a query across the PDFs of all of the user's conversations
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def search_user_pdfs(request):
+    data = json.loads(request.body)
+    query = data.get('query', '').strip()
+
+    if not query:
+        return JsonResponse({'error': 'Query cannot be empty'}, status=400)
+    try:
+        k = parse_k(data.get('k'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    pdfs = PDF.objects.filter(conversation__user=request.user).order_by('created_at')
+    return JsonResponse({'results': search_pdfs(pdfs, query, k)})
 
 class ConversationListCreateView(generics.ListCreateAPIView):
     serializer_class = ConversationSerializer
@@ -57,3 +120,66 @@ class ConversationDetailView(generics.RetrieveAPIView):
 
     def get_object(self):
         return get_object_or_404(Conversation, id=self.kwargs['pk'], user=self.request.user)
+
+# Stream a stored file, such as a generated PDF, in chunks with its Content-Length
+@require_GET
+def serve_media(request, name):
+    try:
+        pdf_file = default_storage.open(name, 'rb')
+    except (FileNotFoundError, SuspiciousFileOperation):
+        raise Http404(f"'{name}' does not exist")
+    return FileResponse(pdf_file, filename=os.path.basename(name))
+
+def open_preview(name):
+    try:
+        return DocumentPreview(name, get_preview_cache())
+    except (FileNotFoundError, SuspiciousFileOperation):
+        raise Http404(f"'{name}' does not exist")
+
+# The pages of a stored PDF with a fingerprint and preview URL each; a page's fingerprint only
+# changes when an edit changes the page, so the editor reloads just those previews
+@require_GET
+def pdf_preview(request, name):
+    preview = open_preview(name)
+    try:
+        fingerprints = preview.fingerprints()
+    finally:
+        preview.close()
+    return JsonResponse({
+        'document': preview.document,
+        'pageCount': len(fingerprints),
+        'pages': [
+            {'page': number, 'fingerprint': fingerprint, 'url': f"{reverse('page-preview', args=[number, name])}?v={fingerprint}"}
+            for number, fingerprint in enumerate(fingerprints, start=1)
+        ],
+    })
+
+# One page of a stored PDF as a PNG, rendered on first request; ?zoom= scales it relative to 72 dpi
+@require_GET
+def page_preview(request, page, name):
+    try:
+        zoom = clamp_zoom(float(request.GET.get('zoom', settings.PREVIEW_ZOOM)))
+    except ValueError:
+        return JsonResponse({'error': 'zoom must be a finite number'}, status=400)
+
+    preview = open_preview(name)
+    try:
+        if not 1 <= page <= len(preview.fingerprints()):
+            raise Http404(f"'{name}' has no page {page}")
+        etag = f'"{preview.fingerprints()[page - 1]}-{zoom:.2f}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponse(status=304, headers={'ETag': etag})
+        image, fingerprint = preview.page_image(page - 1, zoom)
+    finally:
+        preview.close()
+
+    response = HttpResponse(image, content_type='image/png')
+    response['ETag'] = etag
+    # URLs carrying the fingerprint always show the same image
+    response['Cache-Control'] = 'private, max-age=31536000, immutable' if request.GET.get('v') == fingerprint else 'private, no-cache'
+    return response
+
+# Latency histograms and token counters of the web process and the PDF workers, for Prometheus
+@require_GET
+def metrics(request):
+    return HttpResponse(render_metrics(merge_snapshots(collect_snapshots())), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -6,6 +6,23 @@ import api from "../Api";
 import aiImage from '../assets/ai_image_2.jpg';
 
 const BASE_URL = 'http://127.0.0.1:8000';
+const JOB_POLL_INTERVAL = 2000;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+// Poll a generation job until the worker pool has finished it
+const waitForJob = async (jobId) => {
+    while (true) {
+        const response = await api.get(`/api/chatbot/jobs/${jobId}/`);
+        if (response.data.status === 'succeeded') {
+            return response.data;
+        }
+        if (response.data.status === 'failed') {
+            throw new Error(response.data.error || 'PDF generation failed');
+        }
+        await sleep(JOB_POLL_INTERVAL);
+    }
+};
 
 function CreatePDF() {
     const [description, setDescription] = useState('');
@@ -57,7 +74,8 @@ function CreatePDF() {
 
         try {
             const response = await api.post('/api/chatbot/generate-pdf/', { description });
-            const pdfUrl = `${BASE_URL}${response.data.pdfUrl}`;
+            const job = await waitForJob(response.data.jobId);
+            const pdfUrl = `${BASE_URL}${job.pdf_url}`;
             const updatedConversationEntry = { ...newConversationEntry, ai: pdfUrl };
             setConversation(prev => {
                 const updatedConversation = [...prev];